@@ -0,0 +1,219 @@
+"""
+Measures insert and delete throughput of FilterableIntervalTree, compared with the generic red-black fixups and
+rotations from rb_tree_funcs that it used before, wrapped with the augmentation updates it used to apply after each
+rotation, and the walk to the root it used to repair aggregates after a delete.  Both paths maintain the same
+aggregates, subtree_size included, and the gap aggregates too with --track-gaps.
+
+    python -m benchmarks.insert_delete --intervals 100000
+    python -m benchmarks.insert_delete --intervals 100000 --track-gaps
+"""
+import argparse
+import random
+from time import perf_counter
+from intervaltree import i_tree_funcs
+from intervaltree import rb_tree_funcs
+from intervaltree.i_tree_funcs import FilterableIntervalTree, FilterableIntervalTreeNode, Interval
+
+
+def legacy_update_rotated(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    """
+    recomputes the sizes, and the gap aggregates when the tree keeps them, of a rotated node and its new parent
+    """
+    for current in [node, node.parent]:
+        current.subtree_size = current.left_child.subtree_size + current.right_child.subtree_size + 1
+        if tree.track_gaps:
+            i_tree_funcs.update_gap_statistics(current)
+
+
+def legacy_left_rotate(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    rb_tree_funcs.left_rotate(tree, node)
+    i_tree_funcs.update_subtree_filter_vector(node)
+    i_tree_funcs.update_subtree_filter_vector(node.parent)
+    node.subtree_maximum = max(node.key.end, node.left_child.subtree_maximum, node.right_child.subtree_maximum)
+    node.parent.subtree_maximum = max(node.parent.subtree_maximum, node.subtree_maximum)
+    legacy_update_rotated(tree, node)
+    return node
+
+
+def legacy_right_rotate(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    rb_tree_funcs.right_rotate(tree, node)
+    i_tree_funcs.update_subtree_filter_vector(node)
+    i_tree_funcs.update_subtree_filter_vector(node.parent)
+    node.subtree_maximum = max(node.key.end, node.left_child.subtree_maximum, node.right_child.subtree_maximum)
+    node.parent.subtree_maximum = max(node.parent.subtree_maximum, node.subtree_maximum)
+    legacy_update_rotated(tree, node)
+    return node
+
+
+def legacy_add_node(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    """
+    add_node with the fixup going through the color properties and generic rotations, and the gap aggregates
+    repaired by a walk to the root
+    """
+    node.tree = tree
+    node.left_child = node.right_child = tree.nil
+    end = node.key.end
+    begin = node.key.begin
+    if tree.root is tree.nil:
+        tree.root = node
+        node.parent = tree.nil
+        node.black = True
+        return node
+
+    current_node = last_parent = tree.root
+    going_left = None
+    while current_node is not tree.nil:
+        last_parent = current_node
+        going_left = begin <= current_node.key.begin
+        if end > current_node.subtree_maximum:
+            current_node.subtree_maximum = end
+        current_node.subtree_filter_vector |= node.filter_vector
+        current_node.subtree_size += 1
+        current_node = last_parent.left_child if going_left else last_parent.right_child
+
+    if going_left:
+        last_parent.left_child = node
+    else:
+        last_parent.right_child = node
+    node.parent = last_parent
+    rb_tree_funcs.redblack_insert_fixup(tree, node, legacy_left_rotate, legacy_right_rotate)
+    if tree.track_gaps:
+        current_node = node.parent
+        while current_node is not tree.nil:
+            i_tree_funcs.update_gap_statistics(current_node)
+            current_node = current_node.parent
+    return node
+
+
+def legacy_transplant(tree: FilterableIntervalTree, a_node: FilterableIntervalTreeNode,
+                      a_replacement: FilterableIntervalTreeNode):
+    u = a_node
+    u_parent = u.parent
+    v = a_replacement
+    if u.subtree_maximum == u.key.end:
+        v.subtree_maximum = max(u.left_child.subtree_maximum, u.right_child.subtree_maximum, v.subtree_maximum)
+    else:
+        v.subtree_maximum = max(u.subtree_maximum, v.subtree_maximum)
+    if u is tree.root:
+        tree.root = v
+    elif u is u_parent.left_child:
+        u_parent.left_child = v
+    else:
+        u_parent.right_child = v
+    v.parent = u_parent
+    if u_parent is not tree.nil:
+        i_tree_funcs.update_subtree_filter_vector(u_parent)
+
+
+def legacy_update_statistics_in_chain(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    """
+    the walk delete_node used to make to the root after every delete
+    """
+    parent = node.parent
+    no_updates = 0
+    while parent is not tree.nil and no_updates < 400:
+        expected_max = max(parent.key.end, parent.left_child.subtree_maximum, parent.right_child.subtree_maximum)
+        expected_sfv = parent.left_child.subtree_filter_vector | parent.right_child.subtree_filter_vector | \
+            parent.filter_vector
+        expected_size = parent.left_child.subtree_size + parent.right_child.subtree_size + 1
+        if expected_max != parent.subtree_maximum or expected_sfv != parent.subtree_filter_vector or \
+                expected_size != parent.subtree_size:
+            parent.subtree_maximum = expected_max
+            parent.subtree_filter_vector = expected_sfv
+            parent.subtree_size = expected_size
+        else:
+            no_updates += 1
+        if tree.track_gaps:
+            i_tree_funcs.update_gap_statistics(parent)
+        parent = parent.parent
+
+
+def legacy_delete_node(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    """
+    delete_node with the fixup going through the color properties and generic rotations, followed by a walk to the
+    root
+    """
+    z = node
+    y = z
+    y_original_black = y.black
+    if z.left_child is tree.nil:
+        x = z.right_child
+        legacy_transplant(tree, z, z.right_child)
+    elif z.right_child is tree.nil:
+        x = z.left_child
+        legacy_transplant(tree, z, z.left_child)
+    else:
+        y = rb_tree_funcs.tree_successor(tree, z)
+        y_original_black = y.black
+        x = y.right_child
+        if y.parent is z:
+            x.parent = y
+        else:
+            legacy_transplant(tree, y, y.right_child)
+            y.right_child = z.right_child
+            y.right_child.parent = y
+        y.left_child = z.left_child
+        y.left_child.parent = y
+        legacy_transplant(tree, z, y)
+        y.black = z.black
+    if y_original_black:
+        rb_tree_funcs.rb_delete_fixup(tree, x, legacy_left_rotate, legacy_right_rotate)
+    legacy_update_statistics_in_chain(tree, x)
+    tree.nil.parent = None
+
+
+def build_entries(interval_count: int, payload_count: int):
+    entries = []
+    for _ in range(interval_count):
+        begin = random.randint(0, interval_count * 10)
+        payload = 'payload:%d' % random.randrange(payload_count)
+        entries.append((Interval(begin, begin + random.randint(1, 1000)), payload))
+    return entries
+
+
+def measure(add, delete, entries, deletion_order, track_gaps: bool):
+    """
+    nodes are built fresh for every run, the tree functions leave color and aggregates behind on removed nodes
+    """
+    tree = FilterableIntervalTree(track_gaps=track_gaps)
+    nodes = [tree.create_node(key, payload) for key, payload in entries]
+    deletion_order = [nodes[_] for _ in deletion_order]
+    started = perf_counter()
+    for node in nodes:
+        add(tree, node)
+    insert_time = perf_counter() - started
+
+    started = perf_counter()
+    for node in deletion_order:
+        delete(tree, node)
+    delete_time = perf_counter() - started
+    return insert_time, delete_time
+
+
+def run(interval_count: int, payload_count: int, seed: str, track_gaps: bool):
+    random.seed(seed)
+    entries = build_entries(interval_count, payload_count)
+    deletion_order = random.sample(range(interval_count), interval_count)
+
+    print('%d intervals, %d payloads%s' % (interval_count, payload_count, ', tracking gaps' if track_gaps else ''))
+    print('%-10s %14s %14s' % ('path', 'inserts/s', 'deletes/s'))
+    for name, add, delete in [
+        ('generic', legacy_add_node, legacy_delete_node),
+        ('fast', i_tree_funcs.add_node, i_tree_funcs.delete_node),
+    ]:
+        insert_time, delete_time = measure(add, delete, entries, deletion_order, track_gaps)
+        print('%-10s %14.0f %14.0f' % (name, interval_count / insert_time, interval_count / delete_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--intervals', type=int, default=100000)
+    parser.add_argument('--payloads', type=int, default=100)
+    parser.add_argument('--seed', default='benchmark')
+    parser.add_argument('--track-gaps', action='store_true', help='times trees that maintain the gap aggregates')
+    args = parser.parse_args()
+    run(args.intervals, args.payloads, args.seed, args.track_gaps)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Measures the neighbor lookups adjust_payload makes, with the bloom-guided searches compared with the subtree scans
+they replaced, then times adjust_payload itself.
+
+    python -m benchmarks.neighbor_search --nodes 1000000
+"""
+import argparse
+import random
+from collections import deque
+from time import perf_counter
+from intervaltree.filter_config import FilterConfig
+from intervaltree.i_tree_funcs import FilterableIntervalTree, FilterableIntervalTreeNode, Interval, \
+    adjust_payload, get_predecessor_for_node, get_successor_for_node
+
+
+def legacy_get_maximum_node(tree, node, qualifier):
+    stack = deque([node])
+    while node.right_child is not tree.nil:
+        stack.append(node.right_child)
+        node = node.right_child
+
+    candidate = stack.pop()
+    while not qualifier(candidate.payload):
+        if candidate.left_child is not tree.nil:
+            stack.append(candidate.left_child)
+            node = candidate.left_child
+            while node.right_child is not tree.nil:
+                stack.append(node.right_child)
+                node = node.right_child
+        if stack:
+            candidate = stack.pop()
+        else:
+            return None
+    return candidate
+
+
+def legacy_neighbor(tree, node, qualifier, forward):
+    """
+    the original predecessor search, and the successor search that mirrored it, both scanning subtrees with
+    get_maximum_node without looking at filter vectors, the way adjust_payload called them
+    """
+    tree_nil = tree.nil
+    near = 'right_child' if forward else 'left_child'
+    far = 'left_child' if forward else 'right_child'
+    current = node
+    while True:
+        if getattr(current, near) is not tree_nil:
+            result = legacy_get_maximum_node(tree, getattr(current, near), qualifier)
+            if result:
+                return result
+        parent = current.parent
+        if parent is not tree_nil and current is getattr(parent, far):
+            if qualifier(parent.payload):
+                return parent
+            if getattr(parent, near) is not tree_nil:
+                result = legacy_get_maximum_node(tree, getattr(parent, near), qualifier)
+                if result:
+                    return result
+        while current.parent is not tree_nil and getattr(current.parent, near) is current:
+            current = current.parent
+        if current.parent is tree_nil:
+            return None
+        current = current.parent
+        if qualifier(current.payload):
+            return current
+
+
+def build_tree(node_count: int, payload_count: int, filter_config: FilterConfig) -> FilterableIntervalTree:
+    payloads = [{'device': _, 'state': 'idle'} for _ in range(payload_count)]
+    vectors = filter_config.vectors_for_payloads(payloads)
+    nodes = []
+    clock = 0
+    for _ in range(node_count):
+        duration = random.randint(1, 60)
+        choice = random.randrange(payload_count)
+        nodes.append(FilterableIntervalTreeNode(Interval(clock, clock + duration), payloads[choice], vectors[choice]))
+        clock += random.randint(0, duration)
+    return FilterableIntervalTree.from_sorted(nodes, filter_config)
+
+
+def random_node(tree: FilterableIntervalTree) -> FilterableIntervalTreeNode:
+    """
+    ends a random walk down from the root, which samples nodes without listing the whole tree
+    """
+    node = tree.root
+    while random.random() < 0.95:
+        child = node.left_child if random.getrandbits(1) else node.right_child
+        if child is tree.nil:
+            break
+        node = child
+    return node
+
+
+def run(node_count: int, payload_count: int, width: int, lookup_count: int, legacy_count: int, seed: str):
+    random.seed(seed)
+    started = perf_counter()
+    tree = build_tree(node_count, payload_count, FilterConfig(width=width))
+    print('built %d nodes with %d payloads and %d bit filters in %.1fs' %
+          (node_count, payload_count, width, perf_counter() - started))
+
+    nodes = [random_node(tree) for _ in range(lookup_count)]
+
+    print('%-24s %10s %14s' % ('lookup', 'lookups', 'us per lookup'))
+    started = perf_counter()
+    for node in nodes[:legacy_count]:
+        qualifier = node.payload.__eq__
+        legacy_neighbor(tree, node, qualifier, False)
+        legacy_neighbor(tree, node, qualifier, True)
+    elapsed = perf_counter() - started
+    print('%-24s %10d %14.1f' % ('subtree scan', 2 * legacy_count, 1e6 * elapsed / (2 * legacy_count)))
+
+    started = perf_counter()
+    for node in nodes:
+        get_predecessor_for_node(tree, node)
+        get_successor_for_node(tree, node)
+    elapsed = perf_counter() - started
+    print('%-24s %10d %14.1f' % ('bloom guided', 2 * lookup_count, 1e6 * elapsed / (2 * lookup_count)))
+
+    started = perf_counter()
+    adjusted = 0
+    for _ in range(lookup_count):
+        # adjust_payload removes nodes, so each one is picked from the tree as it is now
+        node = random_node(tree)
+        key = node.key
+        if len(key) < 3:
+            continue
+        adjust_payload(tree, node, Interval(key.begin + 1, key.end - 1), {'state': 'busy'})
+        adjusted += 1
+    elapsed = perf_counter() - started
+    print('%-24s %10d %14.1f' % ('adjust_payload', adjusted, 1e6 * elapsed / max(adjusted, 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=1000000)
+    parser.add_argument('--payloads', type=int, default=10000)
+    parser.add_argument('--width', type=int, default=64, help='filter vector width in bits')
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--legacy-lookups', type=int, default=50,
+                        help='lookups made with the subtree scans, which are far slower')
+    parser.add_argument('--seed', default='benchmark')
+    args = parser.parse_args()
+    run(args.nodes, args.payloads, args.width, args.lookups, args.legacy_lookups, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Counts the nodes query_tree visits on time-series style data, compared with the pruning rules it used before the
+begin ordering of the tree was taken into account.
+
+    python -m benchmarks.query_pruning --intervals 100000 --queries 500
+"""
+import argparse
+import random
+from intervaltree.i_tree_funcs import FilterableIntervalTree, FilterableIntervalTreeNode, Interval, \
+    generate_query_node, query_tree
+from intervaltree.query_stats import QueryStats
+
+
+def build_time_series(interval_count: int, device_count: int, state_count: int):
+    """
+    back to back state intervals per device, with exponentially distributed durations and staggered starts
+    """
+    nodes = []
+    clocks = [random.randint(0, 3600) for _ in range(device_count)]
+    per_device = interval_count // device_count
+    for device, clock in enumerate(clocks):
+        for _ in range(per_device):
+            duration = max(1, int(random.expovariate(1 / 300)))
+            payload = '%s:%s' % (device, random.randrange(state_count))
+            nodes.append(FilterableIntervalTreeNode(Interval(clock, clock + duration), payload))
+            clock += duration
+    return nodes
+
+
+def count_legacy_visits(tree: FilterableIntervalTree, query_node: FilterableIntervalTreeNode, must_contain: bool):
+    """
+    replays the pruning rules of the original query_tree, which only looked at subtree_maximum and the bloom filter
+    """
+    tree_nil = tree.nil
+    query_begin = query_node.key.begin
+    query_end = query_node.key.end
+    query_fv = query_node.filter_vector
+    visits = 0
+    not_root = False
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        visits += 1
+        left_child = node.left_child
+        right_child = node.right_child
+        left_ok = left_child is not tree_nil and left_child.subtree_maximum >= query_begin
+        left_ok &= query_fv & left_child.subtree_filter_vector == query_fv
+        right_ok = right_child is not tree_nil and right_child.subtree_maximum >= query_begin
+        if must_contain and not_root:
+            right_ok &= right_child.subtree_maximum >= query_end
+        right_ok &= query_fv & right_child.subtree_filter_vector == query_fv
+        if right_ok:
+            stack.append(right_child)
+        if left_ok:
+            stack.append(left_child)
+        not_root = True
+    return visits
+
+
+def run(interval_count: int, query_count: int, device_count: int, state_count: int, window: int, seed: str):
+    random.seed(seed)
+    nodes = build_time_series(interval_count, device_count, state_count)
+    tree = FilterableIntervalTree.from_iterable(nodes)
+    horizon = max(_.key.end for _ in nodes)
+    payloads = sorted({_.payload for _ in nodes})
+
+    print('%d intervals, %d devices, %d states per device, %d queries with windows up to %ds' %
+          (len(nodes), device_count, state_count, query_count, window))
+    print('%-8s %-10s %14s %14s %10s %10s' % ('mode', 'filter', 'legacy visits', 'new visits', 'results', 'saved'))
+
+    for must_contain in [False, True]:
+        for filtered in [False, True]:
+            legacy_total = new_total = result_total = 0
+            for _ in range(query_count):
+                begin = random.randint(0, horizon)
+                end = begin + random.randint(0, window)
+                if filtered:
+                    query = generate_query_node(begin, end, random.choice(payloads))
+                else:
+                    query = generate_query_node(begin, end, filter_vector=0)
+                stats = QueryStats()
+                result_total += sum(1 for _ in query_tree(tree, query, must_contain, stats))
+                new_total += stats.nodes_visited
+                legacy_total += count_legacy_visits(tree, query, must_contain)
+
+            print('%-8s %-10s %14.1f %14.1f %10.1f %9.1f%%' % (
+                'contain' if must_contain else 'overlap',
+                'payload' if filtered else 'none',
+                legacy_total / query_count,
+                new_total / query_count,
+                result_total / query_count,
+                100 * (1 - new_total / legacy_total)
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--intervals', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--states', type=int, default=4)
+    parser.add_argument('--window', type=int, default=600, help='largest query window in seconds')
+    parser.add_argument('--seed', default='benchmark')
+    args = parser.parse_args()
+    run(args.intervals, args.queries, args.devices, args.states, args.window, args.seed)
+
+
+if __name__ == '__main__':
+    main()
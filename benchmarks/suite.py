@@ -0,0 +1,298 @@
+"""
+Times the tree operations over a grid of interval counts, interval distributions and payload cardinalities, and
+writes the results as JSON so that releases can be compared before upgrading.
+
+    python -m benchmarks.suite --sizes 1000 10000 100000 1000000 --output results.json
+    python -m benchmarks.suite --sizes 1000 10000 --baseline results.json
+
+Every scenario is generated from the seed, so two runs with the same arguments time the same work.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Callable, List
+from intervaltree.bs_tree_funcs import inorder_walk
+from intervaltree.filter_config import DEFAULT_FILTER_CONFIG
+from intervaltree.i_tree_funcs import FilterableIntervalTree, FilterableIntervalTreeNode, Interval, add_node, \
+    adjust_payload, delete_node, generate_query_node, get_predecessor_for_node, get_successor_for_node, query_tree
+from .neighbor_search import random_node
+
+
+def uniform_keys(count: int, span: int) -> List[Interval]:
+    """
+    begins spread evenly over the span, short intervals of random length
+    """
+    keys = []
+    for _ in range(count):
+        begin = random.randrange(span)
+        keys.append(Interval(begin, begin + random.randint(1, 200)))
+    return keys
+
+
+def clustered_keys(count: int, span: int) -> List[Interval]:
+    """
+    begins packed around a few hot spots, one for every thousand intervals
+    """
+    centers = [random.randrange(span) for _ in range(max(1, count // 1000))]
+    keys = []
+    for _ in range(count):
+        begin = int(random.gauss(random.choice(centers), 500))
+        keys.append(Interval(begin, begin + random.randint(1, 50)))
+    return keys
+
+
+def nested_keys(count: int, span: int) -> List[Interval]:
+    """
+    dyadic blocks of the span at random depths, any two of which are either disjoint or nested
+    """
+    keys = []
+    for _ in range(count):
+        width = max(1, span >> random.randrange(16))
+        begin = random.randrange(span // width) * width
+        keys.append(Interval(begin, begin + width))
+    return keys
+
+
+DISTRIBUTIONS = {
+    'uniform': uniform_keys,
+    'clustered': clustered_keys,
+    'nested': nested_keys,
+}
+
+# the number of distinct payloads for a number of intervals
+CARDINALITIES = {
+    'low': lambda count: 16,
+    'high': lambda count: max(16, count // 2),
+}
+
+OPERATIONS = [
+    'add_node',
+    'query_overlap',
+    'query_contain',
+    'predecessor',
+    'successor',
+    'adjust_payload',
+    'inorder_walk',
+    'delete_node',
+]
+
+
+def timed(function: Callable[[], int]) -> tuple:
+    """
+    :param function: runs the operations and returns how many it ran
+    :return: the number of operations and the seconds they took
+    """
+    started = perf_counter()
+    count = function()
+    return count, perf_counter() - started
+
+
+def run_scenario(distribution: str, cardinality: str, size: int, operations: List[str], query_count: int,
+                 seed: str) -> dict:
+    """
+    Builds one tree and runs the selected operations against it in the order of OPERATIONS
+    :return: the operation count and seconds for each operation, by name
+    """
+    random.seed('%s:%s:%s:%d' % (seed, distribution, cardinality, size))
+    span = size * 100
+    keys = DISTRIBUTIONS[distribution](size, span)
+    payloads = [{'device': _, 'state': 'idle'} for _ in range(CARDINALITIES[cardinality](size))]
+    vectors = DEFAULT_FILTER_CONFIG.vectors_for_payloads(payloads)
+    choices = [random.randrange(len(payloads)) for _ in keys]
+    nodes = [FilterableIntervalTreeNode(key, payloads[_], vectors[_]) for key, _ in zip(keys, choices)]
+
+    # queries are placed on the data and filtered on the payload of one of its nodes
+    overlap_queries = []
+    contain_queries = []
+    for _ in range(query_count):
+        node = random.choice(nodes)
+        key = node.key
+        overlap_queries.append(generate_query_node(key.begin, key.begin + 100, node.payload))
+        point = random.randrange(key.begin, key.end)
+        contain_queries.append(generate_query_node(point, point + 1, node.payload))
+
+    tree = FilterableIntervalTree()
+    results = {}
+
+    def add_all():
+        for node in nodes:
+            add_node(tree, node)
+        return len(nodes)
+
+    def query(queries, must_contain):
+        for query_node in queries:
+            for _ in query_tree(tree, query_node, must_contain):
+                pass
+        return len(queries)
+
+    def neighbors(search):
+        sample = [random_node(tree) for _ in range(query_count)]
+        started = perf_counter()
+        for node in sample:
+            search(tree, node)
+        return len(sample), perf_counter() - started
+
+    def adjust():
+        adjusted = 0
+        for _ in range(query_count):
+            # adjust_payload replaces nodes, so each one is picked from the tree as it is now
+            node = random_node(tree)
+            key = node.key
+            if key.end - key.begin < 3:
+                continue
+            adjust_payload(tree, node, Interval(key.begin + 1, key.end - 1), {'state': 'busy'})
+            adjusted += 1
+        return adjusted
+
+    def walk():
+        count = 0
+        for _ in inorder_walk(tree.root):
+            count += 1
+        return count
+
+    def delete_all():
+        remaining = list(inorder_walk(tree.root))
+        random.shuffle(remaining)
+        for node in remaining:
+            delete_node(tree, node)
+        return len(remaining)
+
+    # the tree is built even when add_node is not timed, every other operation needs it
+    count, seconds = timed(add_all)
+    if 'add_node' in operations:
+        results['add_node'] = (count, seconds)
+    if 'query_overlap' in operations:
+        results['query_overlap'] = timed(lambda: query(overlap_queries, False))
+    if 'query_contain' in operations:
+        results['query_contain'] = timed(lambda: query(contain_queries, True))
+    if 'predecessor' in operations:
+        results['predecessor'] = neighbors(get_predecessor_for_node)
+    if 'successor' in operations:
+        results['successor'] = neighbors(get_successor_for_node)
+    if 'adjust_payload' in operations:
+        results['adjust_payload'] = timed(adjust)
+    if 'inorder_walk' in operations:
+        results['inorder_walk'] = timed(walk)
+    if 'delete_node' in operations:
+        results['delete_node'] = timed(delete_all)
+    return results
+
+
+def run(sizes: List[int], distributions: List[str], cardinalities: List[str], operations: List[str],
+        query_count: int, repeat: int, seed: str) -> dict:
+    """
+    Runs every scenario repeat times, keeping the fastest time of each operation
+    :return: the report, with the environment under metadata and one entry per measurement under results
+    """
+    results = []
+    print('%-15s %-10s %-5s %9s %10s %12s' % ('operation', 'dist', 'card', 'size', 'operations', 'us per op'),
+          file=sys.stderr)
+    for size in sizes:
+        for distribution in distributions:
+            for cardinality in cardinalities:
+                best = {}
+                for _ in range(repeat):
+                    for operation, (count, seconds) in run_scenario(
+                            distribution, cardinality, size, operations, query_count, seed).items():
+                        if operation not in best or seconds < best[operation][1]:
+                            best[operation] = (count, seconds)
+                for operation in operations:
+                    count, seconds = best[operation]
+                    entry = {
+                        'operation': operation,
+                        'distribution': distribution,
+                        'cardinality': cardinality,
+                        'size': size,
+                        'operations': count,
+                        'seconds': seconds,
+                        'us_per_operation': 1e6 * seconds / count if count else None,
+                    }
+                    results.append(entry)
+                    print_entry(entry)
+    return {
+        'metadata': {
+            'version': library_version(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'seed': seed,
+            'repeat': repeat,
+            'queries': query_count,
+            'created': datetime.now(timezone.utc).isoformat(),
+        },
+        'results': results,
+    }
+
+
+def library_version():
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        return version('filtered-intervaltree')
+    except PackageNotFoundError:
+        return None
+
+
+def result_key(entry: dict) -> tuple:
+    return entry['operation'], entry['distribution'], entry['cardinality'], entry['size']
+
+
+def print_entry(entry: dict):
+    us = entry['us_per_operation']
+    print('%-15s %-10s %-5s %9d %10d %12s' % (
+        entry['operation'], entry['distribution'], entry['cardinality'], entry['size'], entry['operations'],
+        '-' if us is None else '%.2f' % us), file=sys.stderr)
+
+
+def compare(report: dict, baseline: dict):
+    """
+    prints the time per operation of each measurement against the same measurement in a baseline report
+    """
+    previous = {result_key(_): _ for _ in baseline['results']}
+    print('%-15s %-10s %-5s %9s %12s %12s %8s' % (
+        'operation', 'dist', 'card', 'size', 'baseline us', 'current us', 'ratio'))
+    for entry in report['results']:
+        old = previous.get(result_key(entry))
+        if old is None or not old['us_per_operation'] or entry['us_per_operation'] is None:
+            continue
+        print('%-15s %-10s %-5s %9d %12.2f %12.2f %8.2f' % (
+            entry['operation'], entry['distribution'], entry['cardinality'], entry['size'],
+            old['us_per_operation'], entry['us_per_operation'], entry['us_per_operation'] / old['us_per_operation']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--distributions', nargs='+', choices=list(DISTRIBUTIONS), default=list(DISTRIBUTIONS))
+    parser.add_argument('--cardinalities', nargs='+', choices=list(CARDINALITIES), default=list(CARDINALITIES))
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='queries, neighbor lookups and payload adjustments made per scenario')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each scenario, the fastest is kept')
+    parser.add_argument('--seed', default='benchmark')
+    parser.add_argument('--output', help='file to write the JSON report to, standard output when not provided')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    args = parser.parse_args()
+
+    operations = [_ for _ in OPERATIONS if _ in args.operations]
+    report = run(args.sizes, args.distributions, args.cardinalities, operations, args.queries, args.repeat,
+                 args.seed)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    elif not args.baseline:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(report, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,605 @@
+"""
+FilterableIntervalTree laid out as a struct of numpy arrays, for trees too large to hold as one object per node.
+
+Compared with the object tree it has these limits:
+
+* bounds are stored as int64, so begins and ends must be integers between -2**63 and 2**63 - 1.  Floats, including
+  infinities, are rejected rather than truncated.
+* filter vectors are stored as uint64, so only a FilterConfig of width 64 can be used.
+* it holds about a quarter of the memory per interval of the object tree, not counting payloads.
+"""
+from intervaltree.interval import Interval
+from .i_tree_funcs import FilterableIntervalTreeNode
+from .filter_config import FilterConfig, DEFAULT_FILTER_CONFIG
+from typing import Generator, Callable, Any
+import numbers
+import numpy as np
+
+
+# index 0 is reserved for the nil sentinel, every other index is a node slot
+NIL = 0
+_INT64_MIN = np.iinfo(np.int64).min
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+class ArrayFilterableIntervalTree:
+    """
+    FilterableIntervalTree stored as a struct of arrays.  Nodes are addressed by integer index, begins, ends, subtree
+    maxima and filter vectors live in int64/uint64 arrays, links are int32 indexes and payloads sit in a side list.
+    Filter vectors are limited to 64 bits.
+    """
+
+    def __init__(self, capacity: int=16, filter_config: FilterConfig=None):
+        filter_config = filter_config or DEFAULT_FILTER_CONFIG
+        if filter_config.width != 64:
+            raise ValueError('ArrayFilterableIntervalTree stores 64 bit filter vectors, the FilterConfig is %d bits wide'
+                             % filter_config.width)
+        self.filter_config = filter_config
+        capacity = max(capacity, 2)
+        self.begins = np.zeros(capacity, dtype=np.int64)
+        self.ends = np.zeros(capacity, dtype=np.int64)
+        self.subtree_maximums = np.full(capacity, _INT64_MIN, dtype=np.int64)
+        self.filter_vectors = np.zeros(capacity, dtype=np.uint64)
+        self.subtree_filter_vectors = np.zeros(capacity, dtype=np.uint64)
+        self.parents = np.zeros(capacity, dtype=np.int32)
+        self.left_children = np.zeros(capacity, dtype=np.int32)
+        self.right_children = np.zeros(capacity, dtype=np.int32)
+        self.blacks = np.ones(capacity, dtype=np.bool_)
+        self.payloads = [None] * capacity
+        self.root = NIL
+        self.free_slots = []
+        self.high_water = 1
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self) -> int:
+        return len(self.begins)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        bytes held by the arrays and the payload list, not counting the payload objects themselves
+        """
+        arrays = [
+            self.begins, self.ends, self.subtree_maximums, self.filter_vectors, self.subtree_filter_vectors,
+            self.parents, self.left_children, self.right_children, self.blacks
+        ]
+        return sum(_.nbytes for _ in arrays) + 8 * len(self.payloads)
+
+    def key(self, index: int) -> Interval:
+        return Interval(self.begins.item(index), self.ends.item(index))
+
+    def payload(self, index: int):
+        return self.payloads[index]
+
+    def filter_vector(self, index: int) -> int:
+        return self.filter_vectors.item(index)
+
+    def inorder_walk(self) -> Generator[int, None, None]:
+        yield from inorder_walk(self)
+
+
+def _grow(tree: ArrayFilterableIntervalTree):
+    old_capacity = tree.capacity
+    new_capacity = old_capacity * 2
+    for name in ['begins', 'ends', 'subtree_maximums', 'filter_vectors', 'subtree_filter_vectors',
+                 'parents', 'left_children', 'right_children', 'blacks']:
+        old_array = getattr(tree, name)
+        new_array = np.empty(new_capacity, dtype=old_array.dtype)
+        new_array[:old_capacity] = old_array
+        setattr(tree, name, new_array)
+    tree.payloads.extend([None] * (new_capacity - old_capacity))
+
+
+def _allocate(tree: ArrayFilterableIntervalTree) -> int:
+    if tree.free_slots:
+        return tree.free_slots.pop()
+    if tree.high_water == tree.capacity:
+        _grow(tree)
+    index = tree.high_water
+    tree.high_water += 1
+    return index
+
+
+def update_statistics(tree: ArrayFilterableIntervalTree, index: int):
+    left = tree.left_children.item(index)
+    right = tree.right_children.item(index)
+    sm = tree.subtree_maximums
+    sfv = tree.subtree_filter_vectors
+    sm[index] = max(tree.ends.item(index), sm.item(left), sm.item(right))
+    sfv[index] = tree.filter_vectors.item(index) | sfv.item(left) | sfv.item(right)
+
+
+def left_rotate(tree: ArrayFilterableIntervalTree, x: int):
+    left = tree.left_children
+    right = tree.right_children
+    parents = tree.parents
+
+    y = right.item(x)
+    y_left = left.item(y)
+    right[x] = y_left
+    if y_left != NIL:
+        parents[y_left] = x
+    x_parent = parents.item(x)
+    parents[y] = x_parent
+    if x_parent == NIL:
+        tree.root = y
+    elif x == left.item(x_parent):
+        left[x_parent] = y
+    else:
+        right[x_parent] = y
+    left[y] = x
+    parents[x] = y
+
+    # y now spans exactly the nodes x used to span
+    tree.subtree_maximums[y] = tree.subtree_maximums.item(x)
+    tree.subtree_filter_vectors[y] = tree.subtree_filter_vectors.item(x)
+    update_statistics(tree, x)
+
+
+def right_rotate(tree: ArrayFilterableIntervalTree, y: int):
+    left = tree.left_children
+    right = tree.right_children
+    parents = tree.parents
+
+    x = left.item(y)
+    x_right = right.item(x)
+    left[y] = x_right
+    if x_right != NIL:
+        parents[x_right] = y
+    y_parent = parents.item(y)
+    parents[x] = y_parent
+    if y_parent == NIL:
+        tree.root = x
+    elif y == right.item(y_parent):
+        right[y_parent] = x
+    else:
+        left[y_parent] = x
+    right[x] = y
+    parents[y] = x
+
+    tree.subtree_maximums[x] = tree.subtree_maximums.item(y)
+    tree.subtree_filter_vectors[x] = tree.subtree_filter_vectors.item(y)
+    update_statistics(tree, y)
+
+
+def _insert_fixup(tree: ArrayFilterableIntervalTree, z: int):
+    parents = tree.parents
+    left = tree.left_children
+    right = tree.right_children
+    blacks = tree.blacks
+
+    while not blacks.item(parents.item(z)):
+        z_parent = parents.item(z)
+        grandparent = parents.item(z_parent)
+        if z_parent == left.item(grandparent):
+            uncle = right.item(grandparent)
+            if not blacks.item(uncle):
+                blacks[z_parent] = True
+                blacks[uncle] = True
+                blacks[grandparent] = False
+                z = grandparent
+            else:
+                if z == right.item(z_parent):
+                    z = z_parent
+                    left_rotate(tree, z)
+                    z_parent = parents.item(z)
+                    grandparent = parents.item(z_parent)
+                blacks[z_parent] = True
+                blacks[grandparent] = False
+                right_rotate(tree, grandparent)
+        else:
+            uncle = left.item(grandparent)
+            if not blacks.item(uncle):
+                blacks[z_parent] = True
+                blacks[uncle] = True
+                blacks[grandparent] = False
+                z = grandparent
+            else:
+                if z == left.item(z_parent):
+                    z = z_parent
+                    right_rotate(tree, z)
+                    z_parent = parents.item(z)
+                    grandparent = parents.item(z_parent)
+                blacks[z_parent] = True
+                blacks[grandparent] = False
+                left_rotate(tree, grandparent)
+    blacks[tree.root] = True
+
+
+def add_node(tree: ArrayFilterableIntervalTree,
+             interval: Interval,
+             payload=None,
+             filter_vector: int=None) -> int:
+    """
+    Adds an interval to the tree
+    :param tree: tree to add to
+    :param interval: interval of the new node
+    :param payload: payload of the new node
+    :param filter_vector: filter vector for the payload, generated from the payload when omitted
+    :return: the index of the new node
+    """
+    begin = interval.begin
+    end = interval.end
+    for bound in (begin, end):
+        if not isinstance(bound, numbers.Integral) or not _INT64_MIN <= bound <= _INT64_MAX:
+            raise ValueError('ArrayFilterableIntervalTree only stores int64 bounds, got %r' % (bound,))
+    if filter_vector is None:
+        filter_vector = tree.filter_config.vector_for_payload(payload)
+
+    z = _allocate(tree)
+    tree.begins[z] = begin
+    tree.ends[z] = end
+    tree.subtree_maximums[z] = end
+    tree.filter_vectors[z] = filter_vector
+    tree.subtree_filter_vectors[z] = filter_vector
+    tree.left_children[z] = NIL
+    tree.right_children[z] = NIL
+    tree.blacks[z] = False
+    tree.payloads[z] = payload
+
+    begins = tree.begins
+    sm = tree.subtree_maximums
+    sfv = tree.subtree_filter_vectors
+    left = tree.left_children
+    right = tree.right_children
+
+    last_parent = NIL
+    current = tree.root
+    going_left = False
+    while current != NIL:
+        last_parent = current
+        going_left = begin <= begins.item(current)
+        if end > sm.item(current):
+            sm[current] = end
+        sfv[current] = sfv.item(current) | filter_vector
+        current = left.item(current) if going_left else right.item(current)
+
+    tree.parents[z] = last_parent
+    if last_parent == NIL:
+        tree.root = z
+    elif going_left:
+        left[last_parent] = z
+    else:
+        right[last_parent] = z
+
+    _insert_fixup(tree, z)
+    tree.size += 1
+    return z
+
+
+def _transplant(tree: ArrayFilterableIntervalTree, u: int, v: int):
+    parents = tree.parents
+    u_parent = parents.item(u)
+    if u_parent == NIL:
+        tree.root = v
+    elif u == tree.left_children.item(u_parent):
+        tree.left_children[u_parent] = v
+    else:
+        tree.right_children[u_parent] = v
+    parents[v] = u_parent
+
+
+def tree_minimum(tree: ArrayFilterableIntervalTree, index: int) -> int:
+    left = tree.left_children
+    while left.item(index) != NIL:
+        index = left.item(index)
+    return index
+
+
+def tree_maximum(tree: ArrayFilterableIntervalTree, index: int) -> int:
+    right = tree.right_children
+    while right.item(index) != NIL:
+        index = right.item(index)
+    return index
+
+
+def _delete_fixup(tree: ArrayFilterableIntervalTree, x: int):
+    parents = tree.parents
+    left = tree.left_children
+    right = tree.right_children
+    blacks = tree.blacks
+
+    while x != tree.root and blacks.item(x):
+        x_parent = parents.item(x)
+        if x == left.item(x_parent):
+            w = right.item(x_parent)
+            if not blacks.item(w):
+                blacks[w] = True
+                blacks[x_parent] = False
+                left_rotate(tree, x_parent)
+                w = right.item(x_parent)
+            if blacks.item(left.item(w)) and blacks.item(right.item(w)):
+                blacks[w] = False
+                x = x_parent
+            else:
+                if blacks.item(right.item(w)):
+                    blacks[left.item(w)] = True
+                    blacks[w] = False
+                    right_rotate(tree, w)
+                    w = right.item(x_parent)
+                blacks[w] = blacks.item(x_parent)
+                blacks[x_parent] = True
+                blacks[right.item(w)] = True
+                left_rotate(tree, x_parent)
+                x = tree.root
+        else:
+            w = left.item(x_parent)
+            if not blacks.item(w):
+                blacks[w] = True
+                blacks[x_parent] = False
+                right_rotate(tree, x_parent)
+                w = left.item(x_parent)
+            if blacks.item(right.item(w)) and blacks.item(left.item(w)):
+                blacks[w] = False
+                x = x_parent
+            else:
+                if blacks.item(left.item(w)):
+                    blacks[right.item(w)] = True
+                    blacks[w] = False
+                    left_rotate(tree, w)
+                    w = left.item(x_parent)
+                blacks[w] = blacks.item(x_parent)
+                blacks[x_parent] = True
+                blacks[left.item(w)] = True
+                right_rotate(tree, x_parent)
+                x = tree.root
+    blacks[x] = True
+
+
+def update_statistics_in_chain(tree: ArrayFilterableIntervalTree, index: int):
+    parents = tree.parents
+    while index != NIL:
+        update_statistics(tree, index)
+        index = parents.item(index)
+
+
+def delete_node(tree: ArrayFilterableIntervalTree, z: int):
+    """
+    Removes a node from the tree and releases its slot for reuse
+    :param tree: tree to remove from
+    :param z: index of the node to remove
+    """
+    parents = tree.parents
+    left = tree.left_children
+    right = tree.right_children
+    blacks = tree.blacks
+
+    y_black = blacks.item(z)
+    if left.item(z) == NIL:
+        x = right.item(z)
+        repair_from = parents.item(z)
+        _transplant(tree, z, x)
+    elif right.item(z) == NIL:
+        x = left.item(z)
+        repair_from = parents.item(z)
+        _transplant(tree, z, x)
+    else:
+        y = tree_minimum(tree, right.item(z))
+        y_black = blacks.item(y)
+        x = right.item(y)
+        if parents.item(y) == z:
+            parents[x] = y
+            repair_from = y
+        else:
+            repair_from = parents.item(y)
+            _transplant(tree, y, x)
+            right[y] = right.item(z)
+            parents[right.item(y)] = y
+        _transplant(tree, z, y)
+        left[y] = left.item(z)
+        parents[left.item(y)] = y
+        blacks[y] = blacks.item(z)
+
+    # the aggregates have to be right before the fixup rotations rely on them
+    update_statistics_in_chain(tree, repair_from)
+    if y_black:
+        _delete_fixup(tree, x)
+
+    parents[NIL] = NIL
+    blacks[NIL] = True
+    tree.payloads[z] = None
+    tree.free_slots.append(z)
+    tree.size -= 1
+
+
+def _overlaps(begin, end, query_begin, query_end) -> bool:
+    # mirrors interval_overlaps(node.key, query_interval)
+    if begin <= query_begin:
+        return query_end > begin and query_begin < end
+    return end > query_begin and begin < query_end
+
+
+def query_tree(
+        tree: ArrayFilterableIntervalTree,
+        query_node: FilterableIntervalTreeNode,
+        must_contain=True,
+        ) -> Generator[int, None, None]:
+    """
+    Finds the nodes matching a query node built with i_tree_funcs.generate_query_node
+    :param tree: tree to search
+    :param query_node: interval, payload and filter vector to look for
+    :param must_contain: when true nodes must contain the query interval, otherwise they only need to overlap it
+    :return: a generator of node indexes
+    """
+    if tree.root == NIL:
+        return
+
+    query_interval = query_node.key
+    query_interval_begin = query_interval.begin
+    query_interval_end = query_interval.end
+    query_fv = query_node.filter_vector
+    payload_qualifier = query_node.qualifies
+    maximum_threshold = query_interval_end if must_contain else query_interval_begin
+
+    begins = tree.begins
+    ends = tree.ends
+    sm = tree.subtree_maximums
+    fvs = tree.filter_vectors
+    sfv = tree.subtree_filter_vectors
+    left = tree.left_children
+    right = tree.right_children
+    payloads = tree.payloads
+
+    search_stack = [tree.root]
+    while search_stack:
+        current = search_stack.pop()
+        begin = begins.item(current)
+        end = ends.item(current)
+        if must_contain:
+            current_qualifies = begin <= query_interval_begin and end >= query_interval_end
+        else:
+            current_qualifies = _overlaps(begin, end, query_interval_begin, query_interval_end)
+
+        if current_qualifies:
+            payload_qualifies = payload_qualifier(payloads[current])
+            if payload_qualifies is NotImplemented:
+                payload_qualifies = query_fv & fvs.item(current) == query_fv
+            if payload_qualifies:
+                yield current
+
+        # every begin in the right subtree is at least the current begin
+        if must_contain:
+            right_possible = begin <= query_interval_begin
+        else:
+            right_possible = begin < query_interval_end
+        right_child = right.item(current)
+        if right_possible and right_child != NIL and sm.item(right_child) >= maximum_threshold \
+                and query_fv & sfv.item(right_child) == query_fv:
+            search_stack.append(right_child)
+
+        left_child = left.item(current)
+        if left_child != NIL and sm.item(left_child) >= maximum_threshold \
+                and query_fv & sfv.item(left_child) == query_fv:
+            search_stack.append(left_child)
+
+
+def inorder_walk(tree: ArrayFilterableIntervalTree) -> Generator[int, None, None]:
+    left = tree.left_children
+    right = tree.right_children
+    stack = []
+    current = tree.root
+    while True:
+        while current != NIL:
+            stack.append(current)
+            current = left.item(current)
+        if not stack:
+            break
+        current = stack.pop()
+        yield current
+        current = right.item(current)
+
+
+def get_predecessor_for_node(tree: ArrayFilterableIntervalTree, index: int,
+                             qualifier: Callable[[Any], bool]=None) -> int:
+    """
+    Finds the closest node before index in begin order whose payload satisfies qualifier
+    :return: the index of the node or NIL
+    """
+    if qualifier is None:
+        payload = tree.payloads[index]
+        qualifier = lambda x: payload == x
+    parents = tree.parents
+    left = tree.left_children
+    current = index
+    while True:
+        if left.item(current) != NIL:
+            current = tree_maximum(tree, left.item(current))
+        else:
+            parent = parents.item(current)
+            while parent != NIL and current == left.item(parent):
+                current = parent
+                parent = parents.item(current)
+            current = parent
+        if current == NIL or qualifier(tree.payloads[current]):
+            return current
+
+
+def get_successor_for_node(tree: ArrayFilterableIntervalTree, index: int,
+                           qualifier: Callable[[Any], bool]=None) -> int:
+    """
+    Finds the closest node after index in begin order whose payload satisfies qualifier
+    :return: the index of the node or NIL
+    """
+    if qualifier is None:
+        payload = tree.payloads[index]
+        qualifier = lambda x: payload == x
+    parents = tree.parents
+    right = tree.right_children
+    current = index
+    while True:
+        if right.item(current) != NIL:
+            current = tree_minimum(tree, right.item(current))
+        else:
+            parent = parents.item(current)
+            while parent != NIL and current == right.item(parent):
+                current = parent
+                parent = parents.item(current)
+            current = parent
+        if current == NIL or qualifier(tree.payloads[current]):
+            return current
+
+
+def adjust_payload(tree: ArrayFilterableIntervalTree,
+                   index: int,
+                   adjustment_interval: Interval,
+                   adjustments: dict,
+                   filter_vector_generator: Callable[[dict], int]=None) -> int:
+    """
+    Adjusts the payload of a node in its tree, mirroring i_tree_funcs.adjust_payload
+    :param tree: tree to be adjusted
+    :param index: node to adjust
+    :param adjustment_interval: the interval for which we would like to see the adjustments made
+    :param adjustments: the changes that we want to see made to the node's payload (only works for dictionaries)
+    :param filter_vector_generator: a function that returns a filter vector for each payload, the tree's
+        filter_config.vector_for_payload by default
+    :return: the index of the adjusted node
+    """
+    old_payload = tree.payloads[index]
+    old_filter_vector = tree.filter_vectors.item(index)
+    if filter_vector_generator is None:
+        filter_vector_generator = tree.filter_config.vector_for_payload
+
+    old_interval = tree.key(index)
+    remaining_intervals = old_interval.remove(adjustment_interval)
+
+    new_payload = old_payload.copy()
+    for key in adjustments.keys():
+        old_property_value = new_payload.get(key)
+        if isinstance(old_property_value, numbers.Number):
+            new_payload[key] += adjustments[key]
+        else:
+            new_payload[key] = adjustments[key]
+
+    pieces = [(adjustment_interval, new_payload, filter_vector_generator(new_payload))]
+    pieces += [(_, old_payload.copy(), old_filter_vector) for _ in remaining_intervals]
+    pieces = sorted(pieces, key=lambda piece: piece[0].begin)
+
+    first_interval, first_payload, _ = pieces[0]
+    last_interval, last_payload, _ = pieces[-1]
+
+    pre_index = get_predecessor_for_node(tree, index, qualifier=lambda x: x == first_payload)
+    post_index = get_successor_for_node(tree, index, qualifier=lambda x: x == last_payload)
+
+    delete_node(tree, index)
+
+    # slots freed by delete_node are only reused by later additions, so the neighbour indexes stay valid here
+    if pre_index != NIL and Interval.touches(tree.key(pre_index), first_interval):
+        pieces[0] = (Interval(tree.begins.item(pre_index), first_interval.end), first_payload,
+                     tree.filter_vectors.item(pre_index))
+        delete_node(tree, pre_index)
+
+    if post_index != NIL and Interval.touches(tree.key(post_index), last_interval):
+        last_interval = pieces[-1][0]
+        pieces[-1] = (Interval(last_interval.begin, tree.ends.item(post_index)), pieces[-1][1], pieces[-1][2])
+        delete_node(tree, post_index)
+
+    result = NIL
+    for interval, payload, filter_vector in pieces:
+        added = add_node(tree, interval, payload, filter_vector)
+        if payload is new_payload:
+            result = added
+    return result
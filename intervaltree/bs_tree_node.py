@@ -2,9 +2,7 @@ from queue import LifoQueue
 
 
 class BSTreeNode():
-    # __slots__ = ()
-
-    # TODO refactor into namedtuple for better memory usage
+    __slots__ = ('key', 'parent', 'left_child', 'right_child', 'tree')
 
     def __init__(self,
                  key=None,
@@ -1,25 +1,75 @@
 import struct
 import hashlib
-from typing import Callable, List
+from typing import Callable, List, Sequence
 import mmh3
+import numpy as np
 
 
 def hash_to_64(value: str, count:int=1) -> List[int]:
     """
     gets a list of numbers between 0 and 63 for use in a filter vector
     :param value: string to be hashed
-    :param count: must be less than 6
+    :param count: number of indexes
+    :return:
+    """
+    return hash_to_width(value, count, 64)
+
+
+def hash_to_width(value: str, count: int=1, width: int=64) -> List[int]:
+    """
+    gets a list of numbers between 0 and width - 1 for use in a filter vector
+    :param value: string to be hashed
+    :param count: number of indexes, every 8 indexes take another digest with the next seed
+    :param width: a power of two no larger than 65536, so each 16 bit slice maps onto it evenly
     :return:
     """
-    digest = mmh3.hash_bytes(value)
     results = []
+    digest = b''
     for i in range(0, count):
-        bytes = digest[i * 2:i * 2 + 2]
-        value = struct.unpack("h", bytes)
-        results.append(value[0] % 64)
+        offset = i % 8
+        if not offset:
+            digest = mmh3.hash_bytes(value, i // 8)
+        bytes = digest[offset * 2:offset * 2 + 2]
+        index = struct.unpack("<H", bytes)
+        results.append(index[0] % width)
     return results
 
 
+def hash_batch_to_width(values: Sequence[str], count: int=1, width: int=64) -> np.ndarray:
+    """
+    hash_to_width for many values at once, the slicing and reduction of the digests is done on arrays
+    :param values: strings to be hashed
+    :param count: number of indexes per value
+    :param width: a power of two no larger than 65536
+    :return: an array of shape (len(values), count) holding the same indexes hash_to_width returns
+    """
+    value_count = len(values)
+    digest_count = (count + 7) // 8
+    columns = []
+    for seed in range(digest_count):
+        digests = b''.join([mmh3.hash_bytes(value, seed) for value in values])
+        columns.append(np.frombuffer(digests, dtype='<u2').reshape(value_count, 8))
+    slices = np.concatenate(columns, axis=1) if digest_count > 1 else columns[0]
+    return slices[:, :count].astype(np.int64) % width
+
+
+def indexes_to_words(indexes: np.ndarray, width: int=64) -> np.ndarray:
+    """
+    ORs each row of bit indexes into a filter vector
+    :param indexes: array of shape (n, count) of bit indexes below width
+    :param width: a multiple of 64
+    :return: an array of shape (n, width // 64) of uint64 words, least significant word first
+    """
+    word_count = width // 64
+    word_indexes = indexes // 64
+    bits = np.left_shift(np.uint64(1), (indexes % 64).astype(np.uint64))
+    words = np.zeros((indexes.shape[0], word_count), dtype=np.uint64)
+    for word in range(word_count):
+        in_word = np.where(word_indexes == word, bits, np.uint64(0))
+        words[:, word] = np.bitwise_or.reduce(in_word, axis=1)
+    return words
+
+
 def hashalg_to_64(value: str, func: Callable[[bytes], hashlib._hashlib.HASH]=hashlib.sha256, count=1):
     t_value = value.encode('utf8')
     digest = func(t_value).digest()
@@ -0,0 +1,307 @@
+from .easy_hashes import hash_to_width, hash_batch_to_width, indexes_to_words
+from typing import List, Any, Callable, Hashable, Optional, Sequence
+from collections import deque, OrderedDict
+import math
+import random
+import threading
+import numpy as np
+
+
+# types whose equal values always have equal str()
+_EXACT_TYPES = frozenset([str, int, bool, bytes, type(None)])
+# tags the cache keys of field level vectors, which no canonicalizer can return
+_FIELDS = object()
+
+
+def default_canonicalizer(payload) -> Hashable:
+    """
+    Cache key for a payload, built so that equal keys imply equal str(payload) and cached vectors match uncached
+    ones.  Values are tagged with their exact type, floats also with their sign so that 0.0 and -0.0 differ, and
+    dicts and tuples are keyed on their items in order, which avoids formatting them.  Other values are keyed on
+    their str(); unhashable values inside a dict or tuple raise TypeError.
+    """
+    payload_type = type(payload)
+    if payload_type is str:
+        return payload
+    if payload_type is dict:
+        exact_types = _EXACT_TYPES
+        return dict, tuple([(key if type(key) is str else _canonical_value(key),
+                             (type(value), value) if type(value) in exact_types else _canonical_value(value))
+                            for key, value in payload.items()])
+    return _canonical_value(payload)
+
+
+def _canonical_value(value) -> Hashable:
+    value_type = type(value)
+    if value_type in _EXACT_TYPES:
+        return value_type, value
+    if value_type is float:
+        return float, value, math.copysign(1.0, value)
+    if value_type is tuple:
+        return tuple, tuple(_canonical_value(_) for _ in value)
+    if value_type is dict:
+        return default_canonicalizer(value)
+    if value_type.__hash__ is None:
+        raise TypeError('unhashable type: %r' % value_type.__name__)
+    return value_type, str(value)
+
+
+class FilterVectorCache:
+    """
+    Bounded, thread-safe LRU cache of filter vectors
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[int]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return vector
+
+    def put(self, key: Hashable, vector: int):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_size': self.max_size}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FilterConfig:
+    """
+    Width and hash count of the filter vectors in a tree.  Every query node used with a tree has to be built with
+    that tree's configuration, or the bloom pruning in query_tree will skip matching subtrees.  Nodes are brought in
+    line when they are added, see conform_filter_vector.
+
+    Payload vectors are memoized in an LRU cache of cache_size entries, 0 disables it.  A custom canonicalizer maps
+    payloads to hashable cache keys, and the vector is then derived from str() of that key, so payloads with equal
+    keys always share a vector.
+
+    With field_level set, the vector of a dict payload is the union of the vectors of its key=value pairs instead of
+    the vector of the whole dict.  It no longer depends on key order, and a FieldMatch for some of the fields has a
+    vector contained in it, which lets query_tree prune on partial matches.  Those vectors are cached on the set of
+    key=value strings they are derived from, the canonicalizer only keys payloads that are not dicts.
+    """
+
+    def __init__(self, width: int=64, hash_count: int=5, cache_size: int=4096,
+                 canonicalizer: Callable[[Any], Hashable]=None, field_level: bool=False):
+        if width < 64 or width > 65536 or width & (width - 1):
+            raise ValueError('width must be a power of two between 64 and 65536')
+        if hash_count < 1:
+            raise ValueError('hash_count must be at least 1')
+        self.width = width
+        self.hash_count = hash_count
+        self.cache = FilterVectorCache(cache_size) if cache_size > 0 else None
+        self.canonicalizer = canonicalizer
+        self.field_level = field_level
+
+    def vector_for_string(self, value: str) -> int:
+        result = 0
+        for i in hash_to_width(value, self.hash_count, self.width):
+            result |= 1 << i
+        return result
+
+    def vector_for_payload(self, payload) -> int:
+        if hasattr(payload, 'filter_vector'):
+            return payload.filter_vector
+
+        cache = self.cache
+        if self.field_level and type(payload) is dict:
+            key = _FIELDS, frozenset(field_strings(payload))
+            cached = cache.get(key) if cache is not None else None
+            if cached is not None:
+                return cached
+            vector = self.vector_for_fields(payload)
+        else:
+            canonicalizer = self.canonicalizer
+            try:
+                key = canonicalizer(payload) if canonicalizer else default_canonicalizer(payload)
+                cached = cache.get(key) if cache is not None else None
+            except TypeError:
+                return self.vector_for_string(str(payload))
+            if cached is not None:
+                return cached
+            vector = self.vector_for_string(str(key if canonicalizer else payload))
+        if cache is not None:
+            cache.put(key, vector)
+        return vector
+
+    def vector_for_fields(self, fields: dict) -> int:
+        """
+        the union of the vectors of each key=value pair
+        """
+        result = 0
+        for field in field_strings(fields):
+            result |= self.vector_for_string(field)
+        return result
+
+    def vectors_for_strings(self, values: Sequence[str]) -> np.ndarray:
+        """
+        vector_for_string for a batch of values, each distinct value is hashed once
+        :param values: strings to generate vectors for
+        :return: a uint64 array of vectors when the width is 64, otherwise an array of shape (len(values), width // 64)
+            of uint64 words, least significant word first
+        """
+        positions = {}
+        inverse = np.fromiter((positions.setdefault(_, len(positions)) for _ in values), dtype=np.int64,
+                              count=len(values))
+        indexes = hash_batch_to_width(list(positions), self.hash_count, self.width)
+        words = indexes_to_words(indexes, self.width)[inverse]
+        return words[:, 0] if self.width == 64 else words
+
+    def vectors_for_payloads(self, payloads: Sequence[Any]) -> List[int]:
+        """
+        vector_for_payload for a batch of payloads, for building nodes in bulk
+        :param payloads: payloads to generate vectors for
+        :return: a list of filter vectors
+        """
+        canonicalizer = self.canonicalizer
+        field_level = self.field_level
+        strings = []
+        # the rows of strings each payload's vector is the union of
+        owners = []
+        for i, payload in enumerate(payloads):
+            if field_level and type(payload) is dict:
+                fields = field_strings(payload)
+                strings.extend(fields)
+                owners.extend([i] * len(fields))
+                continue
+            if canonicalizer:
+                strings.append(str(canonicalizer(payload)))
+            else:
+                strings.append(str(payload))
+            owners.append(i)
+        words = self.vectors_for_strings(strings)
+        if self.width == 64:
+            vectors = words.tolist()
+        else:
+            vectors = [sum(word << (64 * i) for i, word in enumerate(row)) for row in words.tolist()]
+
+        results = [0] * len(payloads)
+        for owner, vector in zip(owners, vectors):
+            results[owner] |= vector
+        for i, payload in enumerate(payloads):
+            if hasattr(payload, 'filter_vector'):
+                results[i] = payload.filter_vector
+        return results
+
+    def expected_false_positive_rate(self, distinct_payloads: int) -> float:
+        """
+        the classic bloom filter estimate for a subtree holding a number of distinct payloads
+        :param distinct_payloads: number of distinct payloads in the subtree
+        :return: probability that an absent payload passes the subtree filter vector
+        """
+        k = self.hash_count
+        return (1 - math.exp(-k * distinct_payloads / self.width)) ** k
+
+    def __repr__(self):
+        return 'FilterConfig(width=%d, hash_count=%d)' % (self.width, self.hash_count)
+
+
+DEFAULT_FILTER_CONFIG = FilterConfig()
+
+
+def field_strings(fields: dict) -> List[str]:
+    return ['%r=%r' % item for item in fields.items()]
+
+
+class FieldMatch:
+    """
+    A query payload matching every dict payload that has the given values for the given keys, whatever its other
+    fields are.  Its filter vector is only contained in node vectors built with a field_level configuration.
+    """
+    __slots__ = ('fields', 'filter_vector')
+
+    def __init__(self, fields: dict, filter_config: FilterConfig=None):
+        filter_config = filter_config or DEFAULT_FILTER_CONFIG
+        if not filter_config.field_level:
+            raise ValueError('partial matches need a filter configuration with field_level set')
+        self.fields = dict(fields)
+        self.filter_vector = filter_config.vector_for_fields(self.fields)
+
+    def qualifies(self, payload) -> bool:
+        if not isinstance(payload, dict):
+            return False
+        for key, value in self.fields.items():
+            if key not in payload or payload[key] != value:
+                return False
+        return True
+
+    def __repr__(self):
+        return 'FieldMatch(%r)' % self.fields
+
+
+def false_positive_report(tree, probe_count: int=64, sample_size: int=256, seed='report') -> List[dict]:
+    """
+    Reports how saturated the subtree filter vectors are at each depth of a tree
+    :param tree: a FilterableIntervalTree
+    :param probe_count: number of payloads known to be absent from the tree that are tested against each subtree
+    :param sample_size: largest number of subtrees probed per depth
+    :param seed: seed for sampling subtrees
+    :return: one entry per depth with the node count, the mean fraction of bits set, the false positive rate
+        expected from that fill, and the rate observed with the absent probes
+    """
+    config = tree.filter_config
+    tree_nil = tree.nil
+    k = config.hash_count
+    rng = random.Random(seed)
+
+    levels = []
+    payload_strings = set()
+    queue = deque([tree.root] if tree.root is not tree_nil else [])
+    while queue:
+        level = list(queue)
+        queue.clear()
+        levels.append(level)
+        for node in level:
+            payload_strings.add(str(node.payload))
+            for child in [node.left_child, node.right_child]:
+                if child is not tree_nil:
+                    queue.append(child)
+
+    probes = []
+    probe_id = 0
+    while len(probes) < probe_count:
+        candidate = 'false-positive-probe:%d' % probe_id
+        probe_id += 1
+        if candidate not in payload_strings:
+            probes.append(config.vector_for_string(candidate))
+
+    report = []
+    for depth, level in enumerate(levels):
+        fills = [bin(_.subtree_filter_vector).count('1') / config.width for _ in level]
+        sample = level if len(level) <= sample_size else rng.sample(level, sample_size)
+        passes = 0
+        for node in sample:
+            subtree_vector = node.subtree_filter_vector
+            passes += sum(1 for probe in probes if probe & subtree_vector == probe)
+        report.append({
+            'depth': depth,
+            'nodes': len(level),
+            'mean_fill': sum(fills) / len(fills),
+            'expected_false_positive_rate': sum(fill ** k for fill in fills) / len(fills),
+            'observed_false_positive_rate': passes / (len(sample) * len(probes)) if probes else 0.0,
+        })
+    return report
@@ -1,13 +1,16 @@
 from intervaltree.interval import Interval, interval_overlaps, interval_contains
 from .rb_tree import RBTree
 from .rb_tree import RBTreeNode
-from .rb_tree_funcs import redblack_insert_fixup, left_rotate as rb_lr, right_rotate as rb_rr, \
-    rb_delete_fixup as rb_df, tree_successor
-from .easy_hashes import hash_to_64
+from .rb_tree_funcs import tree_successor
+from .filter_config import FilterConfig, FieldMatch, DEFAULT_FILTER_CONFIG
 import math
-from typing import Generator, Callable, List, Any
+from typing import Generator, Callable, List, Any, Iterable, Tuple
 import numbers
 from collections import deque
+import copy
+import heapq
+from time import perf_counter
+from .query_stats import QueryStats, query_stats_aggregator
 
 
 def check_contains(node: 'FilterableIntervalTreeNode', content: 'FilterableIntervalTreeNode'):
@@ -23,7 +26,20 @@ def check_contains(node: 'FilterableIntervalTreeNode', content: 'FilterableInter
     return is_contained
 
 
-def generate_query_node(begin: int=-math.inf, end: int=math.inf, payload=None, filter_vector: int=None):
+def generate_query_node(begin: int=-math.inf, end: int=math.inf, payload=None, filter_vector: int=None,
+                        filter_config: FilterConfig=None, partial: bool=False):
+    """
+    Builds a node to pass to query_tree
+    :param begin: begin of the query interval
+    :param end: end of the query interval
+    :param payload: payload to match
+    :param filter_vector: filter vector to use instead of the payload's
+    :param filter_config: the filter configuration of the tree to query
+    :param partial: matches the dict payload on its fields only, the configuration has to have field_level set
+    :return: the query node
+    """
+    if partial and isinstance(payload, dict):
+        payload = FieldMatch(payload, filter_config)
     tmp_interval = Interval(begin, end)
     vector = None
     if filter_vector is None:
@@ -31,54 +47,171 @@ def generate_query_node(begin: int=-math.inf, end: int=math.inf, payload=None, f
             vector = payload.filter_vector
     elif isinstance(filter_vector, int):
         vector = filter_vector
-    tmp_node = FilterableIntervalTreeNode(tmp_interval, payload, vector)
+    tmp_node = FilterableIntervalTreeNode(tmp_interval, payload, vector, filter_config)
     return tmp_node
 
 
 class FilterableIntervalTreeNode(RBTreeNode):
+    __slots__ = ('payload', 'subtree_maximum', 'filter_vector', 'filter_config', 'subtree_filter_vector',
+                 'subtree_size')
 
-    def __init__(self, key: Interval, payload=None, filter_vector: int = None):
-        self.key = key,
+    def __init__(self, key: Interval, payload=None, filter_vector: int = None, filter_config: FilterConfig=None):
         self.payload = payload or None
-        if key is not None:
-            self.subtree_maximum = key.end
-
-        if hasattr(payload, 'qualifies'):
-            self.qualifies = payload.qualifies
-        else:
-            self.qualifies = payload.__eq__
+        self.subtree_maximum = -math.inf if key is None else key.end
+        self.subtree_size = 0 if key is None else 1
 
+        # the configuration the vector was derived under, None when it was given explicitly
         if filter_vector is None:
-            if hasattr(payload, 'filter_vector'):
-                self.filter_vector = payload.filter_vector
-            else:
-                self.filter_vector = generate_basic_filter_vector(str(payload))
+            self.filter_config = filter_config or DEFAULT_FILTER_CONFIG
+            self.filter_vector = self.filter_config.vector_for_payload(payload)
         else:
+            self.filter_config = None
             self.filter_vector = filter_vector
         self.subtree_filter_vector = self.filter_vector
         super().__init__(key)
 
+    @property
+    def qualifies(self) -> Callable[[Any], bool]:
+        """
+        the payload's own qualifies method when it has one, otherwise payload equality
+        """
+        qualifier = getattr(self.payload, 'qualifies', None)
+        return self.payload.__eq__ if qualifier is None else qualifier
+
     def __contains__(self, item: 'FilterableIntervalTreeNode'):
         return check_contains(self, item)
 
 
+class GapTrackingIntervalTreeNode(FilterableIntervalTreeNode):
+    """
+    A node with the gap aggregates of update_gap_statistics, the only kind of node trees built with track_gaps hold.
+    Other trees hold FilterableIntervalTreeNode, which has no slots for them.
+    """
+    __slots__ = ('subtree_minimum', 'subtree_last_end', 'subtree_largest_gap')
+
+    def __init__(self, key: Interval, payload=None, filter_vector: int = None, filter_config: FilterConfig=None):
+        self.subtree_minimum = math.inf if key is None else key.begin
+        self.subtree_last_end = -math.inf if key is None else key.end
+        self.subtree_largest_gap = 0
+        super().__init__(key, payload, filter_vector, filter_config)
+
+
 class FilterableIntervalTree(RBTree):
 
-    def __init__(self):
+    def __init__(self, filter_config: FilterConfig=None, coalesce: bool=False, track_gaps: bool=False):
+        """
+        :param filter_config: width and hash count of the filter vectors, DEFAULT_FILTER_CONFIG when not provided
+        :param coalesce: when true add_node merges a node into equal-payload nodes it touches or overlaps
+        :param track_gaps: maintains the gap aggregates find_gaps prunes with, see update_gap_statistics.  They make
+            inserts and deletes slower and nodes larger, so they are only kept when asked for, and the tree then
+            holds GapTrackingIntervalTreeNode nodes, built with create_node.
+        """
         super().__init__()
-        self.nil = FilterableIntervalTreeNode(None, None, 0)
+        self.filter_config = filter_config or DEFAULT_FILTER_CONFIG
+        self.coalesce = coalesce
+        self.track_gaps = track_gaps
+        self.node_class = GapTrackingIntervalTreeNode if track_gaps else FilterableIntervalTreeNode
+        self.nil = self.node_class(None, None, 0)
         self.nil.black = True
         self.nil.tree = self
         self.nil.subtree_maximum = -math.inf
         self.root = self.nil
 
+    def __len__(self):
+        return self.root.subtree_size
+
+    def create_node(self, key: Interval, payload=None, filter_vector: int=None) -> FilterableIntervalTreeNode:
+        """
+        Builds a node of the class this tree holds, whose filter vector follows this tree's filter configuration
+        """
+        return self.node_class(key, payload, filter_vector, self.filter_config)
+
+    @classmethod
+    def from_sorted(cls, nodes: Iterable[FilterableIntervalTreeNode], filter_config: FilterConfig=None,
+                    coalesce: bool=False, track_gaps: bool=False) -> 'FilterableIntervalTree':
+        """
+        Builds a balanced tree in O(n) from nodes that are already ordered by key.begin
+        :param nodes: nodes ordered by key.begin
+        :param filter_config: the filter configuration the nodes were built with
+        :param coalesce: builds a coalescing tree, merging the runs among the nodes
+        :param track_gaps: maintains the gap aggregates of find_gaps, the nodes must then be GapTrackingIntervalTreeNode
+        :return: a new tree containing the nodes
+        """
+        tree = cls(filter_config, coalesce, track_gaps)
+        load_sorted_nodes(tree, list(nodes))
+        if coalesce:
+            compact(tree)
+        return tree
+
+    @classmethod
+    def from_iterable(cls, nodes: Iterable[FilterableIntervalTreeNode], filter_config: FilterConfig=None,
+                      coalesce: bool=False, track_gaps: bool=False) -> 'FilterableIntervalTree':
+        """
+        Builds a balanced tree from nodes in any order, sorting them once before loading
+        :param nodes: nodes to load
+        :param filter_config: the filter configuration the nodes were built with
+        :param coalesce: builds a coalescing tree, merging the runs among the nodes
+        :param track_gaps: maintains the gap aggregates of find_gaps, the nodes must then be GapTrackingIntervalTreeNode
+        :return: a new tree containing the nodes
+        """
+        return cls.from_sorted(sorted(nodes, key=lambda node: node.key.begin), filter_config, coalesce, track_gaps)
+
+
+def load_sorted_nodes(tree: FilterableIntervalTree, nodes: List[FilterableIntervalTreeNode]) -> FilterableIntervalTree:
+    """
+    Replaces the contents of a tree with a perfectly balanced red-black tree built from the nodes.  Every node at
+    the deepest level is red when the tree is not perfect, every other node is black, which keeps the black height
+    equal on every path.  The aggregates are computed bottom-up while linking.
+    :param tree: tree to load, its current contents are discarded
+    :param nodes: nodes ordered by key.begin
+    :return: the loaded tree
+    """
+    tree_nil = tree.nil
+    track_gaps = tree.track_gaps
+    count = len(nodes)
+
+    for i in range(1, count):
+        if nodes[i].key.begin < nodes[i - 1].key.begin:
+            raise ValueError('nodes must be ordered by key.begin')
+    if track_gaps:
+        for node in nodes:
+            _check_gap_tracking(node)
+
+    # a tree of 2^k - 1 nodes is perfect and can be entirely black
+    red_depth = count.bit_length() - 1 if count & (count + 1) else -1
+
+    def link(low: int, high: int, depth: int) -> FilterableIntervalTreeNode:
+        if low > high:
+            return tree_nil
+        middle = (low + high) // 2
+        node = nodes[middle]
+        conform_filter_vector(tree, node)
+        left_child = link(low, middle - 1, depth + 1)
+        right_child = link(middle + 1, high, depth + 1)
+
+        node.tree = tree
+        node.black = depth != red_depth
+        node.left_child = left_child
+        node.right_child = right_child
+        if left_child is not tree_nil:
+            left_child.parent = node
+        if right_child is not tree_nil:
+            right_child.parent = node
+
+        update_node_statistics(node)
+        if track_gaps:
+            update_gap_statistics(node)
+        return node
+
+    root = link(0, count - 1, 0)
+    root.parent = tree_nil
+    tree.root = root
+    tree_nil.parent = None
+    return tree
 
-def generate_basic_filter_vector(value: str):
-    bit_indexes = hash_to_64(value, 5)
-    result = 0
-    for i in bit_indexes:
-        result |= 1 << i
-    return result
+
+def generate_basic_filter_vector(value: str, filter_config: FilterConfig=None):
+    return (filter_config or DEFAULT_FILTER_CONFIG).vector_for_string(value)
 
 
 def update_subtree_filter_vector(node: FilterableIntervalTreeNode):
@@ -87,40 +220,268 @@ def update_subtree_filter_vector(node: FilterableIntervalTreeNode):
     node.subtree_filter_vector = a.subtree_filter_vector | b.subtree_filter_vector | node.filter_vector
 
 
-def update_subtree_max_after_rotate(node: FilterableIntervalTreeNode):
-    pm = node.parent.subtree_maximum
-    p_less = pm < node.subtree_maximum
-    if p_less:
-        node.parent.subtree_maximum = node.subtree_maximum
+def update_node_statistics(node: FilterableIntervalTreeNode):
+    """
+    Recomputes subtree_maximum, subtree_filter_vector and subtree_size of a node from its own values and those of its
+    children.  update_statistics_in_chain inlines the same computation.
+    """
+    left_child = node.left_child
+    right_child = node.right_child
+    key = node.key
+    maximum = key.end
+    if left_child.subtree_maximum > maximum:
+        maximum = left_child.subtree_maximum
+    if right_child.subtree_maximum > maximum:
+        maximum = right_child.subtree_maximum
+    node.subtree_maximum = maximum
+    node.subtree_filter_vector = \
+        left_child.subtree_filter_vector | right_child.subtree_filter_vector | node.filter_vector
+    node.subtree_size = left_child.subtree_size + right_child.subtree_size + 1
+
+
+def update_gap_statistics(node: GapTrackingIntervalTreeNode) -> bool:
+    """
+    Recomputes the gap aggregates of a node, kept in trees built with track_gaps: the first begin and the last end
+    of the subtree in key order, and subtree_largest_gap, the largest distance from the end of a node to the begin of
+    the next one.  Taken between neighbours in key order, the gap does not depend on the shape of the tree, and it
+    bounds every uncovered stretch in the subtree that ends at one of its begins, which lets find_gaps skip subtrees
+    holding no gap long enough.
+    :return: whether any of them changed
+    """
+    left_child = node.left_child
+    right_child = node.right_child
+    key = node.key
+    gap = left_child.subtree_largest_gap
+    if right_child.subtree_largest_gap > gap:
+        gap = right_child.subtree_largest_gap
+    if left_child.subtree_size:
+        minimum = left_child.subtree_minimum
+        if key.begin - left_child.subtree_last_end > gap:
+            gap = key.begin - left_child.subtree_last_end
     else:
-        gsm = node.left_child.subtree_maximum
-        asm = node.right_child.subtree_maximum
-        node.subtree_maximum = max(
-            node.key.end,
-            gsm,
-            asm
-        )
+        minimum = key.begin
+    if right_child.subtree_size:
+        last_end = right_child.subtree_last_end
+        if right_child.subtree_minimum - key.end > gap:
+            gap = right_child.subtree_minimum - key.end
+    else:
+        last_end = key.end
+    if minimum == node.subtree_minimum and last_end == node.subtree_last_end and gap == node.subtree_largest_gap:
+        return False
+    node.subtree_minimum = minimum
+    node.subtree_last_end = last_end
+    node.subtree_largest_gap = gap
+    return True
+
+
+def _check_gap_tracking(node: FilterableIntervalTreeNode):
+    if not isinstance(node, GapTrackingIntervalTreeNode):
+        raise TypeError('trees built with track_gaps hold GapTrackingIntervalTreeNode nodes, see '
+                        'FilterableIntervalTree.create_node')
 
 
 def left_rotate(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
-    rb_lr(tree, node)
-    update_subtree_filter_vector(node)
-    update_subtree_filter_vector(node.parent)
-    update_subtree_max_after_rotate(node)
+    x = node
+    y = x.right_child
+    tree_nil = tree.nil
+    y_left = y.left_child
+    x.right_child = y_left
+    if y_left is not tree_nil:
+        y_left.parent = x
+    x_parent = x.parent
+    y.parent = x_parent
+    if x_parent is tree_nil:
+        tree.root = y
+    elif x is x_parent.left_child:
+        x_parent.left_child = y
+    else:
+        x_parent.right_child = y
+    y.left_child = x
+    x.parent = y
+    # y now holds exactly the nodes x held, so it takes over x's aggregates
+    y.subtree_maximum = x.subtree_maximum
+    y.subtree_filter_vector = x.subtree_filter_vector
+    y.subtree_size = x.subtree_size
+    update_node_statistics(x)
+    if tree.track_gaps:
+        y.subtree_minimum = x.subtree_minimum
+        y.subtree_last_end = x.subtree_last_end
+        y.subtree_largest_gap = x.subtree_largest_gap
+        update_gap_statistics(x)
     return node
 
 
 def right_rotate(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
-    rb_rr(tree, node)
-    update_subtree_filter_vector(node)
-    update_subtree_filter_vector(node.parent)
-    update_subtree_max_after_rotate(node)
+    x = node
+    y = x.left_child
+    tree_nil = tree.nil
+    y_right = y.right_child
+    x.left_child = y_right
+    if y_right is not tree_nil:
+        y_right.parent = x
+    x_parent = x.parent
+    y.parent = x_parent
+    if x_parent is tree_nil:
+        tree.root = y
+    elif x is x_parent.right_child:
+        x_parent.right_child = y
+    else:
+        x_parent.left_child = y
+    y.right_child = x
+    x.parent = y
+    y.subtree_maximum = x.subtree_maximum
+    y.subtree_filter_vector = x.subtree_filter_vector
+    y.subtree_size = x.subtree_size
+    update_node_statistics(x)
+    if tree.track_gaps:
+        y.subtree_minimum = x.subtree_minimum
+        y.subtree_last_end = x.subtree_last_end
+        y.subtree_largest_gap = x.subtree_largest_gap
+        update_gap_statistics(x)
     return node
 
 
+def insert_fixup(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    """
+    rb_tree_funcs.redblack_insert_fixup, specialized to read and write node.black directly
+    """
+    z = node
+    parent = z.parent
+    while not parent.black:
+        grandparent = parent.parent
+        if parent is grandparent.left_child:
+            uncle = grandparent.right_child
+            if not uncle.black:
+                parent.black = True
+                uncle.black = True
+                grandparent.black = False
+                z = grandparent
+            else:
+                if z is parent.right_child:
+                    z = parent
+                    left_rotate(tree, z)
+                    parent = z.parent
+                parent.black = True
+                grandparent.black = False
+                right_rotate(tree, grandparent)
+        else:
+            uncle = grandparent.left_child
+            if not uncle.black:
+                parent.black = True
+                uncle.black = True
+                grandparent.black = False
+                z = grandparent
+            else:
+                if z is parent.left_child:
+                    z = parent
+                    right_rotate(tree, z)
+                    parent = z.parent
+                parent.black = True
+                grandparent.black = False
+                left_rotate(tree, grandparent)
+        parent = z.parent
+    tree.root.black = True
+
+
+def delete_fixup(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    """
+    rb_tree_funcs.rb_delete_fixup, specialized to read and write node.black directly
+    """
+    x = node
+    while x is not tree.root and x.black:
+        parent = x.parent
+        if x is parent.left_child:
+            w = parent.right_child
+            if not w.black:
+                w.black = True
+                parent.black = False
+                left_rotate(tree, parent)
+                w = parent.right_child
+            if w.left_child.black and w.right_child.black:
+                w.black = False
+                x = parent
+            else:
+                if w.right_child.black:
+                    w.left_child.black = True
+                    w.black = False
+                    right_rotate(tree, w)
+                    w = parent.right_child
+                w.black = parent.black
+                parent.black = True
+                w.right_child.black = True
+                left_rotate(tree, parent)
+                x = tree.root
+        else:
+            w = parent.left_child
+            if not w.black:
+                w.black = True
+                parent.black = False
+                right_rotate(tree, parent)
+                w = parent.left_child
+            if w.right_child.black and w.left_child.black:
+                w.black = False
+                x = parent
+            else:
+                if w.left_child.black:
+                    w.right_child.black = True
+                    w.black = False
+                    left_rotate(tree, w)
+                    w = parent.left_child
+                w.black = parent.black
+                parent.black = True
+                w.left_child.black = True
+                right_rotate(tree, parent)
+                x = tree.root
+    x.black = True
+
+
 def add_node(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode) -> FilterableIntervalTreeNode:
+    """
+    Adds a node to a tree.  In a coalescing tree the node is merged into any equal-payload nodes it touches or
+    overlaps, see add_node_coalescing.
+    :param tree: tree to add to
+    :param node: node to add
+    :return: the node holding the node's interval in the tree
+    """
+    if tree.coalesce:
+        return add_node_coalescing(tree, node)
+    return insert_node(tree, node)
+
+
+def conform_filter_vector(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    """
+    Makes a node's filter vector follow the tree's filter configuration.  A vector derived under another
+    configuration, such as DEFAULT_FILTER_CONFIG for a node built without one, is derived again from the payload.
+    A vector given explicitly is kept, but raises ValueError when it is wider than the tree's configuration.
+    """
+    filter_config = tree.filter_config
+    if node.filter_config is None:
+        if node.filter_vector >> filter_config.width:
+            raise ValueError('filter vector is wider than the %d bits of the tree\'s filter configuration'
+                             % filter_config.width)
+    elif node.filter_config is not filter_config:
+        node.filter_config = filter_config
+        node.filter_vector = filter_config.vector_for_payload(node.payload)
+
+
+def insert_node(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode) -> FilterableIntervalTreeNode:
+    """
+    Inserts a node as it is, even into a coalescing tree
+    """
+    track_gaps = tree.track_gaps
+    if track_gaps:
+        _check_gap_tracking(node)
+    conform_filter_vector(tree, node)
     node.tree = tree
     node.left_child = node.right_child = tree.nil
+    node.black = False
+    node.subtree_maximum = node.key.end
+    node.subtree_filter_vector = node.filter_vector
+    node.subtree_size = 1
+    if track_gaps:
+        node.subtree_minimum = node.key.begin
+        node.subtree_last_end = node.key.end
+        node.subtree_largest_gap = 0
     end = node.key.end
     begin = node.key.begin
     if tree.root is tree.nil:
@@ -137,6 +498,7 @@ def add_node(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode) ->
         if end > current_node.subtree_maximum:
             current_node.subtree_maximum = end
         current_node.subtree_filter_vector |= node.filter_vector
+        current_node.subtree_size += 1
         current_node = last_parent.left_child if going_left else last_parent.right_child
 
     if going_left:
@@ -144,17 +506,25 @@ def add_node(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode) ->
     else:
         last_parent.right_child = node
     node.parent = last_parent
-    redblack_insert_fixup(tree, node, left_rotate_func=left_rotate, right_rotate_func=right_rotate)
+
+    # the gap aggregates depend on the neighbours of the new node, so they are repaired from the bottom up, until a
+    # node whose aggregates stay the same leaves everything above it as it was
+    if track_gaps:
+        tree_nil = tree.nil
+        current_node = last_parent
+        while current_node is not tree_nil and update_gap_statistics(current_node):
+            current_node = current_node.parent
+    insert_fixup(tree, node)
+    return node
 
 
 def transplant(tree, a_node: FilterableIntervalTreeNode, a_replacement: FilterableIntervalTreeNode):
+    """
+    puts a_replacement where a_node is, the aggregates above it are left for update_statistics_in_chain to repair
+    """
     u = a_node
     u_parent = u.parent
     v = a_replacement
-    if u.subtree_maximum == u.key.end:
-        v.subtree_maximum = max(u.left_child.subtree_maximum, u.right_child.subtree_maximum, v.subtree_maximum)
-    else:
-        v.subtree_maximum = max(u.subtree_maximum, v.subtree_maximum)
     if u is tree.root:
         tree.root = v
     elif u is u_parent.left_child:
@@ -162,70 +532,98 @@ def transplant(tree, a_node: FilterableIntervalTreeNode, a_replacement: Filterab
     else:
         u_parent.right_child = v
     v.parent = u_parent
-    if u_parent is not tree.nil:
-        update_subtree_filter_vector(u_parent)
 
 
-def update_statistics_in_chain(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
-    parent = node.parent
-    no_updates = 0
-    while parent is not tree.nil and no_updates < 400:
-        expected_max = max(
-            parent.key.end,
-            parent.left_child.subtree_maximum,
-            parent.right_child.subtree_maximum
-        )
-
-        expected_sfv = \
-            parent.left_child.subtree_filter_vector | \
-            parent.right_child.subtree_filter_vector | \
-            parent.filter_vector
-
-        needs_update = (expected_max != parent.subtree_maximum) or \
-                       (expected_sfv != parent.subtree_filter_vector)
-
-        if needs_update:
-            parent.subtree_maximum = expected_max
-            parent.subtree_filter_vector = expected_sfv
-        else:
-            no_updates += 1
-
-        parent = parent.parent
+def update_statistics_in_chain(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode,
+                               stop: FilterableIntervalTreeNode=None):
+    """
+    Repairs the aggregates of a node and its ancestors after the contents of its subtree shrank.  The walk ends at the
+    first node whose recomputed aggregates equal the stored ones: every ancestor above it is computed from the same
+    values it was before, so it is already correct.
+    :param tree: tree containing the node
+    :param node: lowest node whose aggregates may be stale
+    :param stop: ancestor at which to end the walk without repairing it
+    """
+    tree_nil = tree.nil
+    track_gaps = tree.track_gaps
+    while node is not tree_nil and node is not stop:
+        left_child = node.left_child
+        right_child = node.right_child
+        key = node.key
+        maximum = key.end
+        if left_child.subtree_maximum > maximum:
+            maximum = left_child.subtree_maximum
+        if right_child.subtree_maximum > maximum:
+            maximum = right_child.subtree_maximum
+        vector = left_child.subtree_filter_vector | right_child.subtree_filter_vector | node.filter_vector
+        gaps_changed = track_gaps and update_gap_statistics(node)
+        if not gaps_changed and maximum == node.subtree_maximum and vector == node.subtree_filter_vector:
+            return
+        node.subtree_maximum = maximum
+        node.subtree_filter_vector = vector
+        node = node.parent
+
+
+def decrement_sizes_in_chain(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
+    """
+    every subtree from a node up to the root lost one node, unlike the other aggregates its size always changes
+    """
+    tree_nil = tree.nil
+    while node is not tree_nil:
+        node.subtree_size -= 1
+        node = node.parent
 
 
 def delete_node(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode):
     z = node
     y = z
-    y_original_color = y.color
+    y_original_black = y.black
 
     if z.left_child is tree.nil:
         x = z.right_child
-        transplant(tree, z, z.right_child)
+        transplant(tree, z, x)
+        decrement_sizes_in_chain(tree, z.parent)
+        update_statistics_in_chain(tree, z.parent)
     elif z.right_child is tree.nil:
         x = z.left_child
-        transplant(tree, z, z.left_child)
+        transplant(tree, z, x)
+        decrement_sizes_in_chain(tree, z.parent)
+        update_statistics_in_chain(tree, z.parent)
     else:
         y = tree_successor(tree, z)
-        y_original_color = y.color
+        y_original_black = y.black
         x = y.right_child
-        if y.parent is z:
+        y_parent = y.parent
+        if y_parent is z:
             x.parent = y
         else:
-            transplant(tree, y, y.right_child)
+            transplant(tree, y, x)
             y.right_child = z.right_child
             y.right_child.parent = y
-            # TODO figure out how to update SFV and max only when a node is removed from a particular subtree
-            # y.subtree_filter_vector = z.right_child.subtree_filter_vector | y.filter_vector
 
         y.left_child = z.left_child
         y.left_child.parent = y
-        # y.subtree_filter_vector |= z.left_child.subtree_filter_vector
         transplant(tree, z, y)
-        y.color = z.color
-    if y_original_color is "black":
-        rb_df(tree, x, left_rotate, right_rotate)
+        y.black = z.black
+        # y now roots everything z did, less y's old position and z itself.  The nodes between them only lost y,
+        # so they are repaired first, then y and its ancestors, which also lost z
+        y.subtree_maximum = z.subtree_maximum
+        y.subtree_filter_vector = z.subtree_filter_vector
+        y.subtree_size = z.subtree_size
+        if tree.track_gaps:
+            y.subtree_minimum = z.subtree_minimum
+            y.subtree_last_end = z.subtree_last_end
+            y.subtree_largest_gap = z.subtree_largest_gap
+        if y_parent is not z:
+            decrement_sizes_in_chain(tree, y_parent)
+            update_statistics_in_chain(tree, y_parent, y)
+        else:
+            decrement_sizes_in_chain(tree, y)
+        update_statistics_in_chain(tree, y)
 
-    update_statistics_in_chain(tree, x)
+    # the rotations in the fixup rely on the aggregates being right
+    if y_original_black:
+        delete_fixup(tree, x)
     tree.nil.parent = None
 
 
@@ -234,6 +632,9 @@ def search_interval(tree: FilterableIntervalTree, interval: Interval) -> Filtera
     while x and not interval.overlaps(x.key):
         if x.left_child and x.left_child.subtree_maximum > interval.begin:
             x = x.left_child
+        elif x.key.begin >= interval.end:
+            # every begin in the right subtree is past the end of the interval
+            return tree.nil
         else:
             x = x.right_child
     return x
@@ -243,62 +644,308 @@ def query_tree(
         tree: FilterableIntervalTree,
         query_node: FilterableIntervalTreeNode,
         must_contain=True,
+        stats: QueryStats=None
+        ) -> Generator[FilterableIntervalTreeNode, None, None]:
+    """
+    Finds the nodes matching a query node
+    :param tree: tree to search
+    :param query_node: interval, payload and filter vector to look for
+    :param must_contain: when true nodes must contain the query interval, otherwise they only need to overlap it
+    :param stats: collects traversal counters when provided, see query_stats.  Time spent by the consumer between
+        results is not included in stats.wall_time.
+    :return: a generator of matching nodes
+    """
+    if stats is None and query_stats_aggregator.enabled:
+        stats = QueryStats()
+    started = None if stats is None else perf_counter()
+    try:
+        tree_root = tree.root
+        tree_nil = tree.nil
+        if tree_root is tree_nil:
+            return
+
+        query_interval = query_node.key
+        query_interval_begin = query_interval.begin
+        query_interval_end = query_interval.end
+        query_fv = query_node.filter_vector
+
+        payload_qualifier = query_node.qualifies
+
+        # a containing node has to end at or after the query end, an overlapping one after the query begin
+        maximum_threshold = query_interval_end if must_contain else query_interval_begin
+
+        search_queue = deque()
+        search_queue.append(tree_root)
+        interval_operation = interval_contains if must_contain else interval_overlaps
+        while search_queue:
+            current_node = search_queue.pop()
+            current_node_key = current_node.key
+            if stats is not None:
+                stats.nodes_visited += 1
+
+            if interval_operation(current_node_key, query_interval):
+                payload_qualifies = payload_qualifier(current_node.payload)
+                if payload_qualifies is NotImplemented:
+                    payload_qualifies = query_fv & current_node.filter_vector == query_fv
+                elif stats is not None and not payload_qualifies and \
+                        query_fv & current_node.filter_vector == query_fv:
+                    stats.rejected_by_qualifier += 1
+                if payload_qualifies:
+                    if stats is None:
+                        yield current_node
+                    else:
+                        stats.results += 1
+                        stats.wall_time += perf_counter() - started
+                        started = None
+                        yield current_node
+                        started = perf_counter()
+
+            left_child = current_node.left_child
+            right_child = current_node.right_child
+
+            left_ok = left_child is not tree_nil and \
+                left_child.subtree_maximum >= maximum_threshold
+
+            left_ok &= (query_fv & left_child.subtree_filter_vector == query_fv)
+
+            # every begin in the right subtree is at least current_node_key.begin
+            if must_contain:
+                right_possible = current_node_key.begin <= query_interval_begin
+            else:
+                right_possible = current_node_key.begin < query_interval_end
+
+            right_ok = right_possible and right_child is not tree_nil and \
+                right_child.subtree_maximum >= maximum_threshold
+
+            right_ok &= (query_fv & right_child.subtree_filter_vector == query_fv)
+
+            if right_ok:
+                search_queue.append(right_child)
+            elif stats is not None and right_child is not tree_nil:
+                _count_pruned(stats, right_child, right_possible, maximum_threshold, query_fv)
+
+            if left_ok:
+                search_queue.append(left_child)
+            elif stats is not None and left_child is not tree_nil:
+                _count_pruned(stats, left_child, True, maximum_threshold, query_fv)
+    finally:
+        if stats is not None:
+            if started is not None:
+                stats.wall_time += perf_counter() - started
+            if query_stats_aggregator.enabled:
+                query_stats_aggregator.record(stats)
+
+
+def _count_pruned(stats: QueryStats, child: FilterableIntervalTreeNode, begin_possible: bool, maximum_threshold,
+                  query_fv: int):
+    """
+    counts a subtree query_tree skipped under the first check that rules it out
+    """
+    if not begin_possible:
+        stats.pruned_by_begin += 1
+    elif child.subtree_maximum < maximum_threshold:
+        stats.pruned_by_maximum += 1
+    else:
+        stats.pruned_by_filter += 1
+
+
+def query_tree_ordered(
+        tree: FilterableIntervalTree,
+        query_node: FilterableIntervalTreeNode,
+        must_contain=True,
+        limit: int=None,
+        descending: bool=False
         ) -> Generator[FilterableIntervalTreeNode, None, None]:
+    """
+    Finds the nodes matching a query node lazily in key order, with the pruning of query_tree.  Ascending, the
+    traversal ends at the first node beginning past the query's bound, so reading the first few results costs
+    about as much as finding them.
+    :param tree: tree to search
+    :param query_node: interval, payload and filter vector to look for
+    :param must_contain: when true nodes must contain the query interval, otherwise they only need to overlap it
+    :param limit: largest number of nodes to yield, all of them when not provided
+    :param descending: yields the nodes with the latest begins first
+    :return: a generator of matching nodes
+    """
+    tree_nil = tree.nil
+    if limit is not None and limit <= 0:
+        return
+
+    query_interval = query_node.key
+    query_interval_begin = query_interval.begin
+    query_interval_end = query_interval.end
+    query_fv = query_node.filter_vector
+    payload_qualifier = query_node.qualifies
+    maximum_threshold = query_interval_end if must_contain else query_interval_begin
+    interval_operation = interval_contains if must_contain else interval_overlaps
+
+    def subtree_ok(node):
+        return node is not tree_nil and node.subtree_maximum >= maximum_threshold and \
+            query_fv & node.subtree_filter_vector == query_fv
 
+    def begin_ok(node):
+        # no node beginning after this bound can match, nor can any node after it in key order
+        if must_contain:
+            return node.key.begin <= query_interval_begin
+        return node.key.begin < query_interval_end
+
+    stack = []
+
+    def descend(node):
+        # stacks the nodes down the near edge of a subtree, the first of them in the order ends up on top
+        while True:
+            if not descending:
+                stack.append(node)
+                node = node.left_child
+            elif begin_ok(node):
+                stack.append(node)
+                node = node.right_child
+            else:
+                # neither the node nor anything to its right can match
+                node = node.left_child
+            if not subtree_ok(node):
+                return
+
+    if subtree_ok(tree.root):
+        descend(tree.root)
+
+    yielded = 0
+    while stack:
+        current_node = stack.pop()
+        if not descending and not begin_ok(current_node):
+            return
+
+        if interval_operation(current_node.key, query_interval):
+            payload_qualifies = payload_qualifier(current_node.payload)
+            if payload_qualifies is NotImplemented:
+                payload_qualifies = query_fv & current_node.filter_vector == query_fv
+            if payload_qualifies:
+                yield current_node
+                yielded += 1
+                if yielded == limit:
+                    return
+
+        far_child = current_node.left_child if descending else current_node.right_child
+        if subtree_ok(far_child):
+            descend(far_child)
+
+
+def count_query(tree: FilterableIntervalTree, query_node: FilterableIntervalTreeNode, must_contain=True) -> int:
+    """
+    Counts the nodes query_tree would yield, without yielding them.  For an unfiltered overlap query, a subtree whose
+    begins all lie strictly inside the query interval is counted from its subtree_size without being visited.
+    :param tree: tree to search
+    :param query_node: interval, payload and filter vector to look for
+    :param must_contain: when true nodes must contain the query interval, otherwise they only need to overlap it
+    :return: the number of matching nodes
+    """
     tree_root = tree.root
     tree_nil = tree.nil
     if tree_root is tree_nil:
-        return
+        return 0
 
     query_interval = query_node.key
     query_interval_begin = query_interval.begin
     query_interval_end = query_interval.end
     query_fv = query_node.filter_vector
-
     payload_qualifier = query_node.qualifies
+    unfiltered = query_node.payload is None and not query_fv
+    counts_subtrees = unfiltered and not must_contain
 
-    track = 0
-
-    search_queue = deque()
-    search_queue.append(tree_root)
+    maximum_threshold = query_interval_end if must_contain else query_interval_begin
     interval_operation = interval_contains if must_contain else interval_overlaps
-    not_root = False
-    while search_queue:
-        track += 1
-        current_node = search_queue.pop()
-        current_node_qualifies = interval_operation(current_node.key, query_interval)
-        payload_qualifies = payload_qualifier(current_node.payload)
-
-        if payload_qualifies is NotImplemented:
-            payload_qualifies = query_node.filter_vector & current_node.filter_vector == query_node.filter_vector
 
-        if current_node_qualifies and payload_qualifies:
-            yield current_node
+    count = 0
+    # nodes along with bounds on the begins in their subtrees
+    stack = [(tree_root, -math.inf, math.inf)]
+    while stack:
+        current_node, lowest_begin, highest_begin = stack.pop()
+        if counts_subtrees and lowest_begin > query_interval_begin and highest_begin < query_interval_end:
+            # a node beginning inside the query interval overlaps it, whatever its end
+            count += current_node.subtree_size
+            continue
+
+        current_node_key = current_node.key
+        current_begin = current_node_key.begin
+        if interval_operation(current_node_key, query_interval):
+            if unfiltered:
+                count += 1
+            else:
+                payload_qualifies = payload_qualifier(current_node.payload)
+                if payload_qualifies is NotImplemented:
+                    payload_qualifies = query_fv & current_node.filter_vector == query_fv
+                if payload_qualifies:
+                    count += 1
 
         left_child = current_node.left_child
         right_child = current_node.right_child
 
-        left_ok = left_child is not tree_nil and \
-            left_child.subtree_maximum >= query_interval_begin
+        if left_child is not tree_nil and left_child.subtree_maximum >= maximum_threshold and \
+                query_fv & left_child.subtree_filter_vector == query_fv:
+            stack.append((left_child, lowest_begin, current_begin))
 
-        left_ok &= (query_fv & left_child.subtree_filter_vector == query_fv)
+        if must_contain:
+            right_ok = current_begin <= query_interval_begin
+        else:
+            right_ok = current_begin < query_interval_end
+        if right_ok and right_child is not tree_nil and right_child.subtree_maximum >= maximum_threshold and \
+                query_fv & right_child.subtree_filter_vector == query_fv:
+            stack.append((right_child, current_begin, highest_begin))
 
-        right_ok = right_child is not tree_nil and \
-            right_child.subtree_maximum >= query_interval_begin
+    return count
 
-        if must_contain and not_root:
-            # TODO there's another relationship that can be used to filter here
-            right_ok &= right_child.subtree_maximum >= query_interval_end
 
-        right_ok &= (query_fv & right_child.subtree_filter_vector == query_fv)
+def exists_query(tree: FilterableIntervalTree, query_node: FilterableIntervalTreeNode, must_contain=True) -> bool:
+    """
+    Checks whether query_tree would yield anything, stopping at the first match
+    """
+    for _ in query_tree(tree, query_node, must_contain):
+        return True
+    return False
 
-        if right_ok:
-            search_queue.append(right_child)
 
-        if left_ok:
-            search_queue.append(left_child)
+def aggregate_query(tree: FilterableIntervalTree,
+                    query_node: FilterableIntervalTreeNode,
+                    field: str,
+                    aggregate: str='sum',
+                    must_contain=True):
+    """
+    Aggregates a numeric field of the payloads of the nodes query_tree would yield
+    :param tree: tree to search
+    :param query_node: interval, payload and filter vector to look for
+    :param field: key of the field in dict payloads, payloads without a numeric value for it are skipped
+    :param aggregate: one of 'sum', 'min' or 'max'
+    :param must_contain: when true nodes must contain the query interval, otherwise they only need to overlap it
+    :return: the aggregate, 0 for a sum and None for a minimum or maximum when nothing matched
+    """
+    if aggregate not in ('sum', 'min', 'max'):
+        raise ValueError("aggregate must be one of 'sum', 'min' or 'max'")
+
+    result = 0 if aggregate == 'sum' else None
+    for node in query_tree(tree, query_node, must_contain):
+        payload = node.payload
+        value = payload.get(field) if isinstance(payload, dict) else None
+        if not isinstance(value, numbers.Number):
+            continue
+        if aggregate == 'sum':
+            result += value
+        elif result is None or (value < result if aggregate == 'min' else value > result):
+            result = value
+    return result
+
 
-        not_root = True
+def adjusted_payload(payload: dict, adjustments: dict) -> dict:
+    """
+    a copy of the payload with the adjustments applied, numbers are added to and anything else is replaced
+    """
+    new_payload = payload.copy()
+    for key in adjustments.keys():
+        old_property_value = new_payload.get(key)
+        if isinstance(old_property_value, numbers.Number):
+            new_payload[key] += adjustments[key]
+        else:
+            new_payload[key] = adjustments[key]
+    return new_payload
 
 
 def adjust_payload(tree: FilterableIntervalTree,
@@ -313,29 +960,24 @@ def adjust_payload(tree: FilterableIntervalTree,
     :param a_node: node to adjust
     :param adjustment_interval: the interval for which we would like to see the adjustments made
     :param adjustments: the changes that we want to see made to the node's payload (only works for dictionaries)
-    :param filter_vector_generator: a function that returns a filter vector for each payload
-    :return: None
+    :param filter_vector_generator: a function that returns a filter vector for each payload, the vector under the
+        tree's filter configuration by default.  The adjusted payload gets a vector of its own, so that queries and
+        neighbor searches for it are not pruned away from it.
+    :return: the node holding the adjusted payload
     """
 
     if filter_vector_generator is None:
-        filter_vector_generator = lambda x: a_node.filter_vector
+        filter_vector_generator = tree.filter_config.vector_for_payload
 
     old_interval = a_node.key
     remaining_intervals = old_interval.remove(adjustment_interval)
 
-    new_payload = a_node.payload.copy()
-    relevant_keys = adjustments.keys()
-    for key in relevant_keys:
-        old_property_value = new_payload.get(key)
-        if isinstance(old_property_value, numbers.Number):
-            new_payload[key] += adjustments[key]
-        else:
-            new_payload[key] = adjustments[key]
+    new_payload = adjusted_payload(a_node.payload, adjustments)
 
     filter_vector = filter_vector_generator(new_payload)
     remaining_nodes = \
-        [FilterableIntervalTreeNode(_, a_node.payload.copy(), a_node.filter_vector) for _ in remaining_intervals]
-    new_node = FilterableIntervalTreeNode(adjustment_interval, new_payload, filter_vector)
+        [tree.create_node(_, a_node.payload.copy(), a_node.filter_vector) for _ in remaining_intervals]
+    new_node = tree.create_node(adjustment_interval, new_payload, filter_vector)
 
     result_list = [new_node] + remaining_nodes
     result_list = sorted(result_list, key=lambda node: node.key)
@@ -347,8 +989,8 @@ def adjust_payload(tree: FilterableIntervalTree,
     first_payload = first_item.payload
     last_payload = last_item.payload
 
-    pre_node = get_predecessor_for_node(tree, a_node, qualifier=lambda x: x == first_payload)
-    post_node = get_successor_for_node(tree, a_node, qualifier=lambda x: x == last_payload)
+    pre_node = get_predecessor_for_node(tree, a_node, lambda x: x == first_payload, first_item.filter_vector)
+    post_node = get_successor_for_node(tree, a_node, lambda x: x == last_payload, last_item.filter_vector)
 
     delete_node(tree, a_node)
 
@@ -362,7 +1004,7 @@ def adjust_payload(tree: FilterableIntervalTree,
 
     for node in result_list:
         if node not in added_nodes:
-            add_node(tree, node)
+            insert_node(tree, node)
 
     return new_node
 
@@ -371,50 +1013,47 @@ def adjust_payload(tree: FilterableIntervalTree,
 #     2(b)  4(a)
 
 
+def _neighbor_filter(node: FilterableIntervalTreeNode, qualifier, filter_vector):
+    """
+    the default qualifier and filter vector for a neighbor search.  Payloads are compared on every node the search
+    reaches, the node's filter vector only prunes subtrees, on the assumption that nodes with equal payloads were
+    given vectors under the same filter configuration.
+    """
+    if qualifier is None:
+        qualifier = lambda x: node.payload == x
+        if filter_vector is None:
+            filter_vector = node.filter_vector
+    return qualifier, filter_vector or 0
+
+
 def get_predecessor_for_node(
         tree: FilterableIntervalTree,
         node: FilterableIntervalTreeNode,
         qualifier: Callable[[Any], bool]=None,
         filter_vector=None) -> FilterableIntervalTreeNode:
-
+    """
+    Finds the closest node before a node, in key order, whose payload the qualifier accepts
+    :param tree: tree containing the node
+    :param node: node to start from
+    :param qualifier: accepts payloads, payload equality with the node by default
+    :param filter_vector: subtrees whose filter vectors do not include it are skipped, defaults to the node's filter
+        vector when the qualifier is the default
+    :return: the matching node, None when there is none
+    """
     tree_nil = tree.nil
-    if qualifier is None:
-        qualifier = lambda x: node.payload == x
+    qualifier, filter_vector = _neighbor_filter(node, qualifier, filter_vector)
 
+    result = get_maximum_node(tree, node.left_child, qualifier, filter_vector)
     current = node
-    exhausted = False
-
-    while not exhausted:
-        if current.left_child is not tree_nil:
-            inspect_left_child = True
-            if filter_vector:
-                collision = filter_vector & current.left_child.subtree_filter_vector
-                inspect_left_child = filter_vector == collision
-
-            if inspect_left_child:
-                result = get_maximum_node(tree, current.left_child, qualifier)
-                if result:
-                    return result
-
-        if current.parent is not tree_nil and current is current.parent.right_child:
-            if qualifier(current.parent.payload):
-                return current.parent
-            if current.parent.left_child is not tree_nil:
-                result = get_maximum_node(tree, current.parent.left_child, qualifier)
-                if result:
-                    return result
-
-        while current.parent is not tree_nil and current.parent.left_child is current:
-            current = current.parent
-
-        if current.parent is tree_nil:
-            exhausted = True
-        # I am the right child
-        current = current.parent
-        if qualifier(current.payload):
-            return current
-
-    return None
+    parent = node.parent
+    while result is None and parent is not tree_nil:
+        if current is parent.right_child:
+            if qualifier(parent.payload):
+                return parent
+            result = get_maximum_node(tree, parent.left_child, qualifier, filter_vector)
+        current = parent
+        parent = parent.parent
+    return result
 
 #           5(a)
 #       3(b)    6(c)
@@ -426,27 +1065,32 @@ def get_predecessor_for_node(
 def get_maximum_node(
         tree: FilterableIntervalTree,
         node: FilterableIntervalTreeNode,
-        qualifier: Callable[[Any], bool]
+        qualifier: Callable[[Any], bool],
+        filter_vector: int=None
 ) -> FilterableIntervalTreeNode:
-    stack = deque([node])
-    while node.right_child is not tree.nil:
-        stack.append(node.right_child)
-        node = node.right_child
-
-    candidate = stack.pop()
-    while not qualifier(candidate.payload):
-        if candidate.left_child is not tree.nil:
-            stack.append(candidate.left_child)
-            node = candidate.left_child
-            while node.right_child is not tree.nil:
-                stack.append(node.right_child)
-                node = node.right_child
-        if stack:
-            candidate = stack.pop()
-        else:
+    """
+    Finds the last node of a subtree, in key order, whose payload the qualifier accepts
+    :param tree: tree containing the subtree
+    :param node: root of the subtree
+    :param qualifier: accepts payloads
+    :param filter_vector: subtrees whose filter vectors do not include it are skipped, the qualifier decides on
+        every node that is reached
+    :return: the matching node, None when there is none
+    """
+    tree_nil = tree.nil
+    filter_vector = filter_vector or 0
+    stack = []
+    current = node
+    while True:
+        while current is not tree_nil and filter_vector & current.subtree_filter_vector == filter_vector:
+            stack.append(current)
+            current = current.right_child
+        if not stack:
             return None
-
-    return candidate
+        current = stack.pop()
+        if qualifier(current.payload):
+            return current
+        current = current.left_child
 
 
 def get_successor_for_node(
@@ -455,72 +1099,60 @@ def get_successor_for_node(
         qualifier: Callable[[Any], bool]=None,
         filter_vector=None) \
         -> FilterableIntervalTreeNode:
-
+    """
+    Finds the closest node after a node, in key order, whose payload the qualifier accepts
+    :param tree: tree containing the node
+    :param node: node to start from
+    :param qualifier: accepts payloads, payload equality with the node by default
+    :param filter_vector: subtrees whose filter vectors do not include it are skipped, defaults to the node's filter
+        vector when the qualifier is the default
+    :return: the matching node, None when there is none
+    """
     tree_nil = tree.nil
-    if qualifier is None:
-        qualifier = lambda x: node.payload == x
+    qualifier, filter_vector = _neighbor_filter(node, qualifier, filter_vector)
 
+    result = get_minimum_node(tree, node.right_child, qualifier, filter_vector)
     current = node
-    exhausted = False
-    result = None
-
-    while not exhausted:
-        if current.right_child is not tree_nil:
-            inspect_right_child = True
-            if filter_vector:
-                collision = filter_vector & current.left_child.subtree_filter_vector
-                inspect_right_child = filter_vector == collision
-
-            if inspect_right_child:
-                result = get_maximum_node(tree, current.right_child, qualifier)
-                if result:
-                    return result
-
-            if result:
-                return result
-        if current.parent is not tree_nil and current is current.parent.left_child:
-            if qualifier(current.parent.payload):
-                return current.parent
-            if current.parent.right_child is not tree_nil:
-                result = get_maximum_node(tree, current.parent.right_child, qualifier)
-                if result:
-                    return result
-
-        while current.parent is not tree_nil and current.parent.right_child is current:
-            current = current.parent
-
-        if current.parent is tree_nil:
-            exhausted = True
-        # I am the left child
-        current = current.parent
-        if qualifier(current.payload):
-            return current
-
-    return None
+    parent = node.parent
+    while result is None and parent is not tree_nil:
+        if current is parent.left_child:
+            if qualifier(parent.payload):
+                return parent
+            result = get_minimum_node(tree, parent.right_child, qualifier, filter_vector)
+        current = parent
+        parent = parent.parent
+    return result
 
 
 def get_minimum_node(
-        tree: FilterableIntervalTree, node: FilterableIntervalTreeNode, qualifier: Callable[[Any], bool]
+        tree: FilterableIntervalTree,
+        node: FilterableIntervalTreeNode,
+        qualifier: Callable[[Any], bool],
+        filter_vector: int=None
 ) -> FilterableIntervalTreeNode:
-    stack = deque([node])
-    while node.left_child is not tree.nil:
-        stack.append(node.left_child)
-        node = node.left_child
-
-    candidate = stack.pop()
-    while not qualifier(candidate.payload):
-        if candidate.right_child is not tree.nil:
-            stack.append(candidate.right_child)
-            node = candidate.right_child
-            while node.left_child is not tree.nil:
-                stack.append(node.left_child)
-                node = node.left_child
-        if stack:
-            candidate = stack.pop()
-        else:
+    """
+    Finds the first node of a subtree, in key order, whose payload the qualifier accepts
+    :param tree: tree containing the subtree
+    :param node: root of the subtree
+    :param qualifier: accepts payloads
+    :param filter_vector: subtrees whose filter vectors do not include it are skipped, the qualifier decides on
+        every node that is reached
+    :return: the matching node, None when there is none
+    """
+    tree_nil = tree.nil
+    filter_vector = filter_vector or 0
+    stack = []
+    current = node
+    while True:
+        while current is not tree_nil and filter_vector & current.subtree_filter_vector == filter_vector:
+            stack.append(current)
+            current = current.left_child
+        if not stack:
             return None
-
-    return candidate
+        current = stack.pop()
+        if qualifier(current.payload):
+            return current
+        current = current.right_child
 
 
 def consolidate_nodes(pre_node: FilterableIntervalTreeNode,
@@ -529,7 +1161,7 @@ def consolidate_nodes(pre_node: FilterableIntervalTreeNode,
         -> FilterableIntervalTreeNode:
 
     new_interval = Interval(pre_node.key.begin, post_node.key.end)
-    new_node = FilterableIntervalTreeNode(new_interval, pre_node.payload, pre_node.filter_vector)
+    new_node = tree.create_node(new_interval, pre_node.payload, pre_node.filter_vector)
 
     if pre_node.tree is tree:
         delete_node(tree, pre_node)
@@ -537,5 +1169,778 @@ def consolidate_nodes(pre_node: FilterableIntervalTreeNode,
     if post_node.tree is tree:
         delete_node(tree, post_node)
 
-    add_node(tree, new_node)
+    insert_node(tree, new_node)
     return new_node
+
+
+# share of the tree a range operation has to touch before the tree is rebuilt rather than modified node by node
+RANGE_REBUILD_FRACTION = 0.2
+
+
+def _inorder_nodes(tree: FilterableIntervalTree) -> Generator[FilterableIntervalTreeNode, None, None]:
+    tree_nil = tree.nil
+    stack = []
+    current = tree.root
+    while stack or current is not tree_nil:
+        while current is not tree_nil:
+            stack.append(current)
+            current = current.left_child
+        current = stack.pop()
+        yield current
+        current = current.right_child
+
+
+def _range_hits(tree: FilterableIntervalTree, interval: Interval, filter_vector: int,
+                qualifier: Callable[[Any], bool]) -> List[FilterableIntervalTreeNode]:
+    query_node = generate_query_node(interval.begin, interval.end, filter_vector=filter_vector or 0)
+    hits = query_tree(tree, query_node, must_contain=False)
+    if qualifier is not None:
+        return [_ for _ in hits if qualifier(_.payload)]
+    return list(hits)
+
+
+def _apply_range_changes(tree: FilterableIntervalTree,
+                         trimmed: List[tuple],
+                         removed: List[FilterableIntervalTreeNode],
+                         added: List[FilterableIntervalTreeNode],
+                         touched: int):
+    """
+    Applies the structural changes of a range operation, rebuilding the tree when they touch a large share of it
+    :param tree: tree to change
+    :param trimmed: (node, key) pairs, each key keeps the begin of its node and so the node's position
+    :param removed: nodes to take out of the tree
+    :param added: nodes to put into the tree
+    :param touched: number of nodes the operation matched
+    """
+    for node, key in trimmed:
+        node.key = key
+
+    if touched and touched >= RANGE_REBUILD_FRACTION * len(tree):
+        removed = set(removed)
+        survivors = (_ for _ in _inorder_nodes(tree) if _ not in removed)
+        added = sorted(added, key=lambda node: node.key.begin)
+        load_sorted_nodes(tree, list(heapq.merge(survivors, added, key=lambda node: node.key.begin)))
+        return
+
+    # the walks share their upper paths, each one stops where an earlier one already brought the aggregates up to date
+    for node, _ in trimmed:
+        update_statistics_in_chain(tree, node)
+    for node in removed:
+        delete_node(tree, node)
+    for node in added:
+        insert_node(tree, node)
+
+
+def delete_range(tree: FilterableIntervalTree,
+                 interval: Interval,
+                 filter_vector: int=None,
+                 qualifier: Callable[[Any], bool]=None) -> List[FilterableIntervalTreeNode]:
+    """
+    Removes everything inside a window.  Nodes overlapping an edge of the window are trimmed to the parts outside of
+    it, a node that starts before the window keeps its place in the tree and only has its end moved.  When the
+    matching nodes make up RANGE_REBUILD_FRACTION of the tree or more, the tree is rebuilt instead.
+    :param tree: tree to remove from
+    :param interval: the window to clear
+    :param filter_vector: when provided only nodes whose filter vector includes it are affected
+    :param qualifier: when provided only nodes whose payload it accepts are affected
+    :return: the nodes that are no longer in the tree
+    """
+    if interval.end <= interval.begin:
+        return []
+
+    hits = _range_hits(tree, interval, filter_vector, qualifier)
+    trimmed = []
+    removed = []
+    added = []
+    for node in hits:
+        key = node.key
+        if key.end > interval.end:
+            right_key = Interval(interval.end, key.end)
+            added.append(tree.create_node(right_key, copy.copy(node.payload), node.filter_vector))
+        if key.begin < interval.begin:
+            trimmed.append((node, Interval(key.begin, interval.begin)))
+        else:
+            removed.append(node)
+
+    _apply_range_changes(tree, trimmed, removed, added, len(hits))
+    return removed
+
+
+def _closed_range_nodes(tree: FilterableIntervalTree, interval: Interval, filter_vector: int=0) \
+        -> Generator[FilterableIntervalTreeNode, None, None]:
+    """
+    nodes that overlap the interval or touch one of its edges, and whose filter vectors include filter_vector
+    """
+    tree_nil = tree.nil
+    begin = interval.begin
+    end = interval.end
+    stack = [tree.root] if tree.root is not tree_nil else []
+    while stack:
+        node = stack.pop()
+        key = node.key
+        if key.begin <= end and key.end >= begin and filter_vector & node.filter_vector == filter_vector:
+            yield node
+        right_child = node.right_child
+        if key.begin <= end and right_child is not tree_nil and right_child.subtree_maximum >= begin and \
+                filter_vector & right_child.subtree_filter_vector == filter_vector:
+            stack.append(right_child)
+        left_child = node.left_child
+        if left_child is not tree_nil and left_child.subtree_maximum >= begin and \
+                filter_vector & left_child.subtree_filter_vector == filter_vector:
+            stack.append(left_child)
+
+
+def adjust_range(tree: FilterableIntervalTree,
+                 interval: Interval,
+                 adjustments: dict,
+                 filter_vector_generator: Callable[[dict], int]=None,
+                 qualifier: Callable[[Any], bool]=None) -> List[FilterableIntervalTreeNode]:
+    """
+    adjust_payload for every node overlapping a window.  Each node is split at the edges of the window and the part
+    inside it gets the adjusted payload, then fragments that touch and have equal payloads, including the nodes just
+    outside the window, are merged.  The changes are applied together, as in delete_range.
+    :param tree: tree to adjust
+    :param interval: the window in which to make the adjustments
+    :param adjustments: the changes to make to the payloads (only works for dictionaries)
+    :param filter_vector_generator: a function that returns a filter vector for each payload, the tree's filter
+        configuration by default
+    :param qualifier: when provided only nodes whose payload it accepts are adjusted
+    :return: the nodes holding adjusted payloads, ordered by begin
+    """
+    if interval.end <= interval.begin:
+        return []
+    if filter_vector_generator is None:
+        filter_vector_generator = tree.filter_config.vector_for_payload
+
+    window_begin = interval.begin
+    window_end = interval.end
+    tree_nodes = set()
+    changed = set()
+    adjusted = set()
+    pieces = []
+    hit_count = 0
+
+    for node in _closed_range_nodes(tree, interval):
+        key = node.key
+        tree_nodes.add(node)
+        pieces.append(node)
+        if not interval_overlaps(key, interval) or (qualifier is not None and not qualifier(node.payload)):
+            continue
+        hit_count += 1
+        new_payload = adjusted_payload(node.payload, adjustments)
+        if new_payload == node.payload:
+            continue
+
+        middle_key = Interval(max(key.begin, window_begin), min(key.end, window_end))
+        if key.end > window_end:
+            right_key = Interval(window_end, key.end)
+            pieces.append(tree.create_node(right_key, copy.copy(node.payload), node.filter_vector))
+
+        if key.begin < window_begin:
+            node.key = Interval(key.begin, window_begin)
+            middle = tree.create_node(middle_key, new_payload, filter_vector_generator(new_payload))
+            pieces.append(middle)
+        else:
+            # the begin stays where it is, so the node can take the adjusted payload in place
+            node.key = middle_key
+            node.payload = new_payload
+            node.filter_vector = filter_vector_generator(new_payload)
+            middle = node
+        changed.add(node)
+        adjusted.add(middle)
+
+    # every piece that ends where another begins is seen first, and absorbs the later one when their payloads match
+    pieces.sort(key=lambda piece: (piece.key.begin, piece.key.end))
+    by_end = {}
+    discarded = set()
+    for piece in pieces:
+        key = piece.key
+        touching = by_end.get(key.begin, [])
+        earlier = next((_ for _ in touching if _.payload == piece.payload), None)
+        if earlier is None:
+            by_end.setdefault(key.end, []).append(piece)
+            continue
+        touching.remove(earlier)
+        earlier.key = Interval(earlier.key.begin, key.end)
+        by_end.setdefault(key.end, []).append(earlier)
+        discarded.add(piece)
+        if earlier in tree_nodes:
+            changed.add(earlier)
+        if piece in adjusted:
+            adjusted.add(earlier)
+
+    trimmed = [(_, _.key) for _ in changed if _ not in discarded]
+    removed = [_ for _ in discarded if _ in tree_nodes]
+    added = [_ for _ in pieces if _ not in tree_nodes and _ not in discarded]
+    _apply_range_changes(tree, trimmed, removed, added, hit_count)
+    return [_ for _ in pieces if _ in adjusted and _ not in discarded]
+
+
+def add_node_coalescing(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode) -> FilterableIntervalTreeNode:
+    """
+    Adds a node, merging it with every node that has an equal payload and touches or overlaps it.  When one of those
+    nodes begins at or before the new one, it is extended in place, otherwise the new node is inserted covering all
+    of them.
+    :param tree: tree to add to
+    :param node: node to add
+    :return: the node holding the merged interval
+    """
+    conform_filter_vector(tree, node)
+    key = node.key
+    payload = node.payload
+    matches = [_ for _ in _closed_range_nodes(tree, key, node.filter_vector) if _.payload == payload]
+    if not matches:
+        return insert_node(tree, node)
+
+    end = max(key.end, max(_.key.end for _ in matches))
+    keeper = min(matches, key=lambda _: _.key.begin)
+    if keeper.key.begin <= key.begin:
+        matches.remove(keeper)
+        keeper.key = Interval(keeper.key.begin, end)
+        update_statistics_in_chain(tree, keeper)
+    else:
+        keeper = node
+        node.key = Interval(key.begin, end)
+
+    for match in matches:
+        delete_node(tree, match)
+    if keeper is node:
+        insert_node(tree, node)
+    return keeper
+
+
+def compact(tree: FilterableIntervalTree) -> int:
+    """
+    Merges every run of equal-payload nodes that touch or overlap, with one pass over the tree in key order, and
+    rebuilds the tree when anything was merged
+    :param tree: tree to compact
+    :return: the number of nodes merged away
+    """
+    # the open run for each payload, bucketed by filter vector since payloads need not be hashable
+    open_runs = {}
+    survivors = []
+    merged = 0
+    for node in _inorder_nodes(tree):
+        key = node.key
+        bucket = open_runs.setdefault(node.filter_vector, [])
+        run_index = next((i for i, _ in enumerate(bucket) if _.payload == node.payload), None)
+        if run_index is None:
+            bucket.append(node)
+            survivors.append(node)
+            continue
+        run = bucket[run_index]
+        if run.key.end < key.begin:
+            # nothing later begins before this node, so the earlier run is closed for good
+            bucket[run_index] = node
+            survivors.append(node)
+            continue
+        if key.end > run.key.end:
+            run.key = Interval(run.key.begin, key.end)
+        merged += 1
+
+    if merged:
+        load_sorted_nodes(tree, survivors)
+    return merged
+
+
+def rank(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode) -> int:
+    """
+    The position of a node in key order
+    :param tree: tree containing the node
+    :param node: node to find the position of
+    :return: the number of nodes before it
+    """
+    tree_nil = tree.nil
+    result = node.left_child.subtree_size
+    parent = node.parent
+    while parent is not tree_nil:
+        if node is parent.right_child:
+            result += parent.left_child.subtree_size + 1
+        node = parent
+        parent = node.parent
+    return result
+
+
+def select(tree: FilterableIntervalTree, index: int) -> FilterableIntervalTreeNode:
+    """
+    The node at a position in key order
+    :param tree: tree to search
+    :param index: position of the node, negative positions count back from the end
+    :return: the node
+    """
+    size = tree.root.subtree_size
+    if index < 0:
+        index += size
+    if not 0 <= index < size:
+        raise IndexError('index out of range')
+
+    node = tree.root
+    while True:
+        left_size = node.left_child.subtree_size
+        if index < left_size:
+            node = node.left_child
+        elif index == left_size:
+            return node
+        else:
+            index -= left_size + 1
+            node = node.right_child
+
+
+def bisect_begin(tree: FilterableIntervalTree, begin) -> int:
+    """
+    The number of nodes that begin before a value, which is the position of the first node beginning at or after it
+    """
+    tree_nil = tree.nil
+    result = 0
+    node = tree.root
+    while node is not tree_nil:
+        if node.key.begin < begin:
+            result += node.left_child.subtree_size + 1
+            node = node.right_child
+        else:
+            node = node.left_child
+    return result
+
+
+def _next_node(tree: FilterableIntervalTree, node: FilterableIntervalTreeNode) -> FilterableIntervalTreeNode:
+    tree_nil = tree.nil
+    if node.right_child is not tree_nil:
+        node = node.right_child
+        while node.left_child is not tree_nil:
+            node = node.left_child
+        return node
+    parent = node.parent
+    while parent is not tree_nil and node is parent.right_child:
+        node = parent
+        parent = node.parent
+    return parent
+
+
+def query_begin_range(tree: FilterableIntervalTree, begin, end, offset: int=0, limit: int=None) \
+        -> Generator[FilterableIntervalTreeNode, None, None]:
+    """
+    Pages through the nodes beginning in [begin, end) in key order.  The first node of the page is found with
+    select, so a deep page costs O(log n) to reach rather than O(offset).
+    :param tree: tree to search
+    :param begin: smallest begin to include
+    :param end: begin at which to stop
+    :param offset: number of matching nodes to skip
+    :param limit: largest number of nodes to yield, all of them when not provided
+    :return: a generator of nodes
+    """
+    first = bisect_begin(tree, begin) + offset
+    stop = bisect_begin(tree, end)
+    if limit is not None:
+        stop = min(stop, first + limit)
+    if first >= stop:
+        return
+
+    tree_nil = tree.nil
+    node = select(tree, first)
+    for _ in range(stop - first):
+        yield node
+        node = _next_node(tree, node)
+        if node is tree_nil:
+            return
+
+
+def nearest(tree: FilterableIntervalTree,
+            point,
+            direction: str='before',
+            filter_vector: int=None,
+            qualifier: Callable[[Any], bool]=None,
+            k: int=1) -> List[FilterableIntervalTreeNode]:
+    """
+    Finds the matching nodes that begin closest to a point on one side of it.  The node beginning last at or before
+    a point is the one in effect there when the intervals are back to back, such as the last known state of a
+    device.  The boundary node is found by descending the tree, then the bloom-guided neighbor searches step away
+    from it.
+    :param tree: tree to search
+    :param point: the point to search around
+    :param direction: 'before' for nodes beginning at or before the point, 'after' for those beginning at or after it
+    :param filter_vector: subtrees and nodes whose filter vectors do not include it are skipped
+    :param qualifier: when provided only nodes whose payload it accepts are returned
+    :param k: largest number of nodes to return
+    :return: up to k nodes, nearest first
+    """
+    if direction not in ('before', 'after'):
+        raise ValueError("direction must be 'before' or 'after'")
+    before = direction == 'before'
+    filter_vector = filter_vector or 0
+    if qualifier is None:
+        qualifier = lambda x: True
+
+    tree_nil = tree.nil
+    boundary = None
+    node = tree.root
+    while node is not tree_nil:
+        begin = node.key.begin
+        if before and begin <= point:
+            boundary = node
+            node = node.right_child
+        elif not before and begin >= point:
+            boundary = node
+            node = node.left_child
+        else:
+            node = node.left_child if before else node.right_child
+
+    results = []
+    if boundary is None or k <= 0:
+        return results
+    if filter_vector & boundary.filter_vector == filter_vector and qualifier(boundary.payload):
+        results.append(boundary)
+    node = boundary
+    step = get_predecessor_for_node if before else get_successor_for_node
+    while len(results) < k:
+        node = step(tree, node, qualifier, filter_vector)
+        if node is None:
+            break
+        # the neighbor searches only prune subtrees by the vector, each node they return is checked here
+        if filter_vector & node.filter_vector == filter_vector:
+            results.append(node)
+    return results
+
+
+class _JoinStream:
+    """
+    The nodes of a tree in key order whose filter vectors include a filter vector, for the joins and the coverage
+    operations.  The floors
+    only ever rise, and once they do, nodes ending before end_floor or beginning before begin_floor are skipped along
+    with every subtree made up of them.
+    """
+    __slots__ = ('tree_nil', 'filter_vector', 'stack', 'head', 'end_floor', 'begin_floor', 'inclusive_floor')
+
+    def __init__(self, tree: FilterableIntervalTree, filter_vector: int, inclusive_floor: bool):
+        """
+        :param inclusive_floor: also skip nodes ending exactly at end_floor
+        """
+        self.tree_nil = tree.nil
+        self.filter_vector = filter_vector
+        self.stack = []
+        self.head = None
+        self.end_floor = -math.inf
+        self.begin_floor = -math.inf
+        self.inclusive_floor = inclusive_floor
+        self._descend(tree.root)
+
+    def _above_end_floor(self, end) -> bool:
+        return end > self.end_floor if self.inclusive_floor else end >= self.end_floor
+
+    def _descend(self, node: FilterableIntervalTreeNode):
+        tree_nil = self.tree_nil
+        filter_vector = self.filter_vector
+        while node is not tree_nil and filter_vector & node.subtree_filter_vector == filter_vector and \
+                self._above_end_floor(node.subtree_maximum):
+            if node.key.begin < self.begin_floor:
+                # the node and everything to its left begin too early
+                node = node.right_child
+            else:
+                self.stack.append(node)
+                node = node.left_child
+
+    def _passes_floors(self, node: FilterableIntervalTreeNode) -> bool:
+        return node.key.begin >= self.begin_floor and self._above_end_floor(node.key.end)
+
+    def peek(self) -> FilterableIntervalTreeNode:
+        """
+        :return: the next node, without consuming it, or None when there are no more
+        """
+        if self.head is not None and not self._passes_floors(self.head):
+            # the floors rose after the head was found
+            self.head = None
+        filter_vector = self.filter_vector
+        stack = self.stack
+        while self.head is None and stack:
+            node = stack.pop()
+            self._descend(node.right_child)
+            if self._passes_floors(node) and filter_vector & node.filter_vector == filter_vector:
+                self.head = node
+        return self.head
+
+    def pop(self) -> FilterableIntervalTreeNode:
+        node = self.peek()
+        self.head = None
+        return node
+
+
+def join_overlapping(tree_a: FilterableIntervalTree,
+                     tree_b: FilterableIntervalTree,
+                     must_contain=False,
+                     filter_vector: int=None) \
+        -> Generator[Tuple[FilterableIntervalTreeNode, FilterableIntervalTreeNode], None, None]:
+    """
+    Finds the pairs of nodes from two trees whose intervals overlap, the same pairs as running query_tree on tree_b
+    for every node of tree_a, in one sweep over both trees in key order.  Nodes that are still open are kept in an
+    active list for each tree.  While one tree has no open nodes, the other skips every subtree that ends before the
+    next node of the first one begins.
+    :param tree_a: first tree
+    :param tree_b: second tree
+    :param must_contain: when true the node from tree_b has to contain the node from tree_a
+    :param filter_vector: when provided only nodes whose filter vectors include it are joined, in both trees
+    :return: a generator of (node_a, node_b) pairs
+    """
+    filter_vector = filter_vector or 0
+    # a node ending where another begins neither overlaps it nor contains anything beginning later
+    stream_a = _JoinStream(tree_a, filter_vector, True)
+    stream_b = _JoinStream(tree_b, filter_vector, not must_contain)
+    active_a = []
+    active_b = []
+
+    while True:
+        if must_contain:
+            node_a = stream_a.peek()
+            if node_a is None:
+                return
+            stream_b.end_floor = node_a.key.begin
+            node_b = stream_b.peek()
+            # a node of tree_a is contained by nodes that begin at or before it, ties go to tree_b first
+            if node_b is not None and node_b.key.begin <= node_a.key.begin:
+                active_b.append(stream_b.pop())
+                continue
+            if not active_b:
+                if node_b is None:
+                    return
+                stream_a.begin_floor = node_b.key.begin
+                continue
+
+            node_a = stream_a.pop()
+            begin = node_a.key.begin
+            active_b = [_ for _ in active_b if _.key.end >= begin]
+            for node_b in active_b:
+                if interval_contains(node_b.key, node_a.key):
+                    yield node_a, node_b
+            continue
+
+        node_a = stream_a.peek()
+        node_b = stream_b.peek()
+        if not active_b:
+            if node_b is None:
+                return
+            stream_a.end_floor = node_b.key.begin
+            node_a = stream_a.peek()
+        if not active_a:
+            if node_a is None:
+                return
+            stream_b.end_floor = node_a.key.begin
+            node_b = stream_b.peek()
+        if node_a is None and node_b is None:
+            return
+
+        if node_b is None or (node_a is not None and node_a.key.begin <= node_b.key.begin):
+            node_a = stream_a.pop()
+            begin = node_a.key.begin
+            active_b = [_ for _ in active_b if _.key.end > begin]
+            for node_b in active_b:
+                if interval_overlaps(node_a.key, node_b.key):
+                    yield node_a, node_b
+            active_a.append(node_a)
+        else:
+            node_b = stream_b.pop()
+            begin = node_b.key.begin
+            active_a = [_ for _ in active_a if _.key.end > begin]
+            for node_a in active_a:
+                if interval_overlaps(node_a.key, node_b.key):
+                    yield node_a, node_b
+            active_b.append(node_b)
+
+
+def coverage_runs(tree: FilterableIntervalTree, filter_vector: int=None) -> Generator[Interval, None, None]:
+    """
+    The parts of the line covered by the nodes of a tree, as disjoint runs in order.  Runs that touch are merged, and
+    subtrees ending inside the current run are skipped without being visited.
+    :param tree: tree to read
+    :param filter_vector: when provided only nodes whose filter vectors include it count
+    :return: a generator of intervals
+    """
+    stream = _JoinStream(tree, filter_vector or 0, True)
+    run_begin = run_end = None
+    node = stream.pop()
+    while node is not None:
+        key = node.key
+        # empty intervals cover nothing
+        if key.begin < key.end:
+            if run_end is not None and key.begin <= run_end:
+                run_end = max(run_end, key.end)
+            else:
+                if run_end is not None:
+                    yield Interval(run_begin, run_end)
+                run_begin, run_end = key.begin, key.end
+            stream.end_floor = run_end
+        node = stream.pop()
+    if run_end is not None:
+        yield Interval(run_begin, run_end)
+
+
+def coverage_union(tree_a: FilterableIntervalTree, tree_b: FilterableIntervalTree, filter_vector_a: int=None,
+                   filter_vector_b: int=None) -> Generator[Interval, None, None]:
+    """
+    The parts of the line covered by either tree, as disjoint runs in order
+    :param tree_a: first tree
+    :param tree_b: second tree
+    :param filter_vector_a: when provided only nodes of tree_a whose filter vectors include it count
+    :param filter_vector_b: when provided only nodes of tree_b whose filter vectors include it count
+    :return: a generator of intervals
+    """
+    runs = heapq.merge(coverage_runs(tree_a, filter_vector_a), coverage_runs(tree_b, filter_vector_b),
+                       key=lambda run: run.begin)
+    run_begin = run_end = None
+    for run in runs:
+        if run_end is not None and run.begin <= run_end:
+            run_end = max(run_end, run.end)
+            continue
+        if run_end is not None:
+            yield Interval(run_begin, run_end)
+        run_begin, run_end = run.begin, run.end
+    if run_end is not None:
+        yield Interval(run_begin, run_end)
+
+
+def coverage_intersection(tree_a: FilterableIntervalTree, tree_b: FilterableIntervalTree, filter_vector_a: int=None,
+                          filter_vector_b: int=None) -> Generator[Interval, None, None]:
+    """
+    The parts of the line covered by both trees, as disjoint runs in order
+    :param tree_a: first tree
+    :param tree_b: second tree
+    :param filter_vector_a: when provided only nodes of tree_a whose filter vectors include it count
+    :param filter_vector_b: when provided only nodes of tree_b whose filter vectors include it count
+    :return: a generator of intervals
+    """
+    runs_a = coverage_runs(tree_a, filter_vector_a)
+    runs_b = coverage_runs(tree_b, filter_vector_b)
+    run_a = next(runs_a, None)
+    run_b = next(runs_b, None)
+    while run_a is not None and run_b is not None:
+        begin = max(run_a.begin, run_b.begin)
+        end = min(run_a.end, run_b.end)
+        if begin < end:
+            yield Interval(begin, end)
+        if run_a.end <= run_b.end:
+            run_a = next(runs_a, None)
+        else:
+            run_b = next(runs_b, None)
+
+
+def coverage_difference(tree_a: FilterableIntervalTree, tree_b: FilterableIntervalTree, filter_vector_a: int=None,
+                        filter_vector_b: int=None) -> Generator[Interval, None, None]:
+    """
+    The parts of the line covered by tree_a but not by tree_b, as disjoint runs in order
+    :param tree_a: tree covering the line
+    :param tree_b: tree whose coverage is taken away
+    :param filter_vector_a: when provided only nodes of tree_a whose filter vectors include it count
+    :param filter_vector_b: when provided only nodes of tree_b whose filter vectors include it count
+    :return: a generator of intervals
+    """
+    runs_b = coverage_runs(tree_b, filter_vector_b)
+    run_b = next(runs_b, None)
+    for run_a in coverage_runs(tree_a, filter_vector_a):
+        begin, end = run_a.begin, run_a.end
+        while run_b is not None and run_b.end <= begin:
+            run_b = next(runs_b, None)
+        while run_b is not None and run_b.begin < end:
+            if run_b.begin > begin:
+                yield Interval(begin, run_b.begin)
+            if run_b.end >= end:
+                # run_b may cover the next run of tree_a as well
+                begin = end
+                break
+            begin = run_b.end
+            run_b = next(runs_b, None)
+        if begin < end:
+            yield Interval(begin, end)
+
+
+def tree_from_runs(runs: Iterable[Interval], payload=None, filter_config: FilterConfig=None) \
+        -> FilterableIntervalTree:
+    """
+    Bulk builds a tree from the output of the coverage operations
+    :param runs: intervals ordered by begin
+    :param payload: payload given to every node
+    :param filter_config: the filter configuration of the new tree
+    :return: a new tree with one node per run
+    """
+    filter_config = filter_config or DEFAULT_FILTER_CONFIG
+    vector = filter_config.vector_for_payload(payload)
+    nodes = [FilterableIntervalTreeNode(run, payload, vector) for run in runs]
+    return FilterableIntervalTree.from_sorted(nodes, filter_config)
+
+
+def find_gaps(tree: FilterableIntervalTree,
+              length=0,
+              window: Interval=None,
+              filter_vector: int=None) -> Generator[Interval, None, None]:
+    """
+    Finds the free stretches between the nodes of a tree, in order.  A gap runs from the furthest end reached by the
+    nodes before it to the begin of the next node, an empty interval still ends the gap before it.
+
+    Subtrees lying inside the stretch covered so far are skipped.  In a tree built with track_gaps, and without a
+    filter vector, so are subtrees whose subtree_largest_gap shows they hold no gap long enough.  On intervals that
+    rarely overlap, each gap is then reached in about O(log n).  The bound counts the distance between neighbours in
+    key order, though, so where long intervals cover shorter ones the neighbours' gaps are not free and the bound
+    prunes little.  Without the aggregates, or with a filter vector, the search visits every node not lying under a
+    covered subtree, which can come close to a full scan.
+    :param tree: tree to search
+    :param length: shortest gap to report
+    :param window: reports the uncovered parts of this interval, including those before the first node and after the
+        last one, rather than only the gaps between nodes
+    :param filter_vector: when provided only nodes whose filter vectors include it are taken as covering
+    :return: a generator of gaps
+    """
+    tree_nil = tree.nil
+    filtered = bool(filter_vector)
+    tracked = tree.track_gaps
+    bounded = tracked and not filtered
+    # the furthest end so far, None until the first node when there is no window
+    covered = None if window is None else window.begin
+    window_end = math.inf if window is None else window.end
+
+    # entries are (node, whole subtree) pairs, taken from the stack in key order
+    stack = [(tree.root, True)]
+    while stack:
+        node, subtree = stack.pop()
+        if subtree:
+            if node is tree_nil:
+                continue
+            if filtered and filter_vector & node.subtree_filter_vector != filter_vector:
+                continue
+            if covered is not None and node.subtree_maximum <= covered:
+                continue
+            if tracked and node.subtree_minimum >= window_end:
+                break
+            if bounded:
+                bound = node.subtree_largest_gap
+                if covered is not None and node.subtree_minimum - covered > bound:
+                    bound = node.subtree_minimum - covered
+                if bound < length or bound <= 0:
+                    covered = node.subtree_maximum if covered is None else max(covered, node.subtree_maximum)
+                    continue
+            stack.append((node.right_child, True))
+            stack.append((node, False))
+            stack.append((node.left_child, True))
+            continue
+
+        if filtered and filter_vector & node.filter_vector != filter_vector:
+            continue
+        key = node.key
+        if key.begin >= window_end:
+            break
+        if covered is None:
+            covered = key.end
+            continue
+        if key.begin > covered and key.begin - covered >= length:
+            yield Interval(covered, key.begin)
+        if key.end > covered:
+            covered = key.end
+
+    if window is not None and window_end > covered and window_end - covered >= length:
+        yield Interval(covered, window_end)
+
+
+def first_gap(tree: FilterableIntervalTree,
+              length=0,
+              window: Interval=None,
+              filter_vector: int=None) -> Interval:
+    """
+    The first gap find_gaps reports
+    :return: the gap, or None when there is none
+    """
+    return next(find_gaps(tree, length, window, filter_vector), None)
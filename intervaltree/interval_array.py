@@ -0,0 +1,165 @@
+from intervaltree.interval import Interval
+from .i_tree_funcs import FilterableIntervalTreeNode
+from .filter_config import FilterConfig, DEFAULT_FILTER_CONFIG
+from typing import Iterable, List, Sequence, Union
+import numpy as np
+
+
+class IntervalArray:
+    """
+    A column of intervals held as two NumPy arrays.  The operations match their Interval counterparts row for row,
+    against either a single Interval or another IntervalArray of the same length.
+    """
+    __slots__ = ('begins', 'ends')
+
+    def __init__(self, begins: Sequence, ends: Sequence):
+        begins = np.asarray(begins)
+        ends = np.asarray(ends)
+        if begins.ndim != 1 or begins.shape != ends.shape:
+            raise ValueError('begins and ends must be one dimensional and of the same length')
+        self.begins = begins
+        self.ends = ends
+
+    @classmethod
+    def from_intervals(cls, intervals: Iterable[Interval], dtype=None) -> 'IntervalArray':
+        intervals = list(intervals)
+        begins = np.array([_.begin for _ in intervals], dtype=dtype)
+        ends = np.array([_.end for _ in intervals], dtype=dtype)
+        return cls(begins, ends)
+
+    def to_intervals(self) -> List[Interval]:
+        return [Interval(begin, end) for begin, end in zip(self.begins.tolist(), self.ends.tolist())]
+
+    def __len__(self):
+        return len(self.begins)
+
+    def __iter__(self):
+        return iter(self.to_intervals())
+
+    def __getitem__(self, item) -> Union[Interval, 'IntervalArray']:
+        if isinstance(item, (int, np.integer)):
+            return Interval(self.begins[item].item(), self.ends[item].item())
+        return IntervalArray(self.begins[item], self.ends[item])
+
+    def __repr__(self):
+        return 'IntervalArray(%s)' % ', '.join('[%r, %r)' % _ for _ in zip(self.begins.tolist(), self.ends.tolist()))
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.ends - self.begins
+
+    @staticmethod
+    def _columns(other):
+        if isinstance(other, IntervalArray):
+            return other.begins, other.ends
+        return other[0], other[1]
+
+    def overlaps(self, other) -> np.ndarray:
+        """
+        interval_overlaps for every row
+        :param other: an Interval, or an IntervalArray of the same length
+        :return: a boolean array
+        """
+        other_begins, other_ends = self._columns(other)
+        self_first = self.begins <= other_begins
+        first_begins = np.where(self_first, self.begins, other_begins)
+        first_ends = np.where(self_first, self.ends, other_ends)
+        second_begins = np.where(self_first, other_begins, self.begins)
+        second_ends = np.where(self_first, other_ends, self.ends)
+        return (second_ends > first_begins) & (second_begins < first_ends)
+
+    def contains(self, other) -> np.ndarray:
+        """
+        interval_contains for every row, true where the row contains other
+        :param other: an Interval, or an IntervalArray of the same length
+        :return: a boolean array
+        """
+        other_begins, other_ends = self._columns(other)
+        return (self.begins <= other_begins) & (self.ends >= other_ends)
+
+    def touches(self, other) -> np.ndarray:
+        """
+        Interval.touches for every row
+        :param other: an Interval, or an IntervalArray of the same length
+        :return: a boolean array
+        """
+        other_begins, other_ends = self._columns(other)
+        return (self.begins == other_ends) | (self.ends == other_begins)
+
+    def remove(self, other, return_index: bool=False):
+        """
+        Interval.remove for every row
+        :param other: an Interval, or an IntervalArray of the same length
+        :param return_index: also return the row each fragment came from
+        :return: the fragments, in row order, and the rows they came from when return_index is true
+        """
+        other_begins, other_ends = self._columns(other)
+        begins = self.begins
+        ends = self.ends
+        overlapping = self.overlaps(other)
+        contained = (other_begins <= begins) & (other_ends >= ends)
+
+        # get_overlap: other when self contains it, otherwise the part of self on other's side
+        other_inside = (begins <= other_begins) & (ends >= other_ends)
+        overlap_begins = np.where(other_inside | (other_begins > begins), other_begins, begins)
+        overlap_ends = np.where(other_inside | (other_begins <= begins), other_ends, ends)
+
+        split = overlapping & ~contained
+        kept = ~overlapping & ~contained
+        # a row keeps up to two fragments, before and after the overlap, an untouched row keeps itself in the first
+        fragment_begins = np.stack([begins, overlap_ends], 1)
+        fragment_ends = np.stack([np.where(split, overlap_begins, ends), ends], 1)
+        present = np.stack([
+            kept | (split & (overlap_begins != begins)),
+            split & (ends != overlap_ends)
+        ], 1)
+
+        result = IntervalArray(fragment_begins[present], fragment_ends[present])
+        if return_index:
+            rows = np.broadcast_to(np.arange(len(begins))[:, None], present.shape)
+            return result, rows[present]
+        return result
+
+    def argsort(self) -> np.ndarray:
+        """
+        the order Interval.__lt__ sorts rows in, by begin alone and stable for equal begins
+        """
+        return np.argsort(self.begins, kind='mergesort')
+
+    def sorted(self) -> 'IntervalArray':
+        return self[self.argsort()]
+
+    def merge(self, touching: bool=True) -> 'IntervalArray':
+        """
+        The union of the rows as disjoint runs ordered by begin
+        :param touching: also merge rows where one ends exactly where the next begins
+        :return: the runs
+        """
+        if not len(self):
+            return IntervalArray(self.begins[:0], self.ends[:0])
+        ordered = self.sorted()
+        begins = ordered.begins
+        run_ends = np.maximum.accumulate(ordered.ends)
+        if touching:
+            starts_run = begins[1:] > run_ends[:-1]
+        else:
+            starts_run = begins[1:] >= run_ends[:-1]
+        starts = np.concatenate([[0], np.flatnonzero(starts_run) + 1])
+        return IntervalArray(begins[starts], np.maximum.reduceat(ordered.ends, starts))
+
+    def to_nodes(self, payloads: Sequence, filter_config: FilterConfig=None) -> List[FilterableIntervalTreeNode]:
+        """
+        Builds tree nodes ordered by begin, ready for FilterableIntervalTree.from_sorted
+        :param payloads: one payload per row
+        :param filter_config: the filter configuration of the tree the nodes are for
+        :return: the nodes
+        """
+        if len(payloads) != len(self):
+            raise ValueError('one payload is needed per interval')
+        filter_config = filter_config or DEFAULT_FILTER_CONFIG
+        order = self.argsort().tolist()
+        payloads = [payloads[_] for _ in order]
+        vectors = filter_config.vectors_for_payloads(payloads)
+        keys = self[order].to_intervals()
+        return [FilterableIntervalTreeNode(key, payload, vector)
+                for key, payload, vector in zip(keys, payloads, vectors)]
@@ -0,0 +1,87 @@
+import threading
+
+
+class QueryStats:
+    """
+    Counters describing a single query_tree traversal.  Only query_tree is instrumented: query_tree_ordered,
+    count_query, nearest, join_overlapping and the coverage and gap searches take no stats and are not counted.
+    """
+
+    def __init__(self):
+        self.nodes_visited = 0
+        self.pruned_by_maximum = 0
+        self.pruned_by_begin = 0
+        self.pruned_by_filter = 0
+        self.rejected_by_qualifier = 0
+        self.results = 0
+        self.wall_time = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'nodes_visited': self.nodes_visited,
+            'pruned_by_maximum': self.pruned_by_maximum,
+            'pruned_by_begin': self.pruned_by_begin,
+            'pruned_by_filter': self.pruned_by_filter,
+            'rejected_by_qualifier': self.rejected_by_qualifier,
+            'results': self.results,
+            'wall_time': self.wall_time,
+        }
+
+    def explain(self) -> str:
+        """
+        describes where the traversal spent its effort
+        :return: a multi-line summary
+        """
+        lines = [
+            'visited %d nodes for %d results in %.6fs' % (self.nodes_visited, self.results, self.wall_time),
+            'subtrees pruned by subtree_maximum: %d' % self.pruned_by_maximum,
+            'subtrees pruned by begin order: %d' % self.pruned_by_begin,
+            'subtrees pruned by subtree_filter_vector: %d' % self.pruned_by_filter,
+            'nodes rejected by qualifies after passing the filter vector: %d' % self.rejected_by_qualifier,
+        ]
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return 'QueryStats(%s)' % ', '.join('%s=%r' % _ for _ in self.as_dict().items())
+
+
+class QueryStatsAggregator:
+    """
+    Process-wide totals of instrumented queries.  While enabled, every query_tree call is instrumented even when no
+    QueryStats is passed in.  Other searches are not included, see QueryStats.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._totals = QueryStats()
+        self._queries = 0
+
+    def record(self, stats: QueryStats):
+        with self._lock:
+            totals = self._totals
+            totals.nodes_visited += stats.nodes_visited
+            totals.pruned_by_maximum += stats.pruned_by_maximum
+            totals.pruned_by_begin += stats.pruned_by_begin
+            totals.pruned_by_filter += stats.pruned_by_filter
+            totals.rejected_by_qualifier += stats.rejected_by_qualifier
+            totals.results += stats.results
+            totals.wall_time += stats.wall_time
+            self._queries += 1
+
+    def snapshot(self) -> dict:
+        """
+        :return: the totals so far, along with the number of queries recorded
+        """
+        with self._lock:
+            result = self._totals.as_dict()
+            result['queries'] = self._queries
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._totals = QueryStats()
+            self._queries = 0
+
+
+query_stats_aggregator = QueryStatsAggregator()
@@ -98,7 +98,7 @@ def rb_delete_fixup(tree: RBTree, node: RBTreeNode,
                     w.red = True
                     right_rotate_func(tree, w)
                     w = x.parent.right_child
-                w.color = x.parent.color
+                w.black = x.parent.black
                 x.parent.black = True
                 w.right_child.black = True
                 left_rotate_func(tree, x.parent)
@@ -120,7 +120,7 @@ def rb_delete_fixup(tree: RBTree, node: RBTreeNode,
                     w.red = True
                     left_rotate_func(tree, w)
                     w = x.parent.left_child
-                w.color = x.parent.color
+                w.black = x.parent.black
                 x.parent.black = True
                 w.left_child.black = True
                 right_rotate_func(tree, x.parent)
@@ -157,7 +157,7 @@ def tree_minimum(tree: RBTree, node: RBTreeNode) -> RBTreeNode:
 def delete_node(tree: RBTree, node: RBTreeNode, transplant_func=transplant, fixup_func=rb_delete_fixup):
     z = node
     y = z
-    y_original_color = y.color
+    y_original_black = y.black
 
     if z.left_child is tree.nil:
         x = z.right_child
@@ -167,7 +167,7 @@ def delete_node(tree: RBTree, node: RBTreeNode, transplant_func=transplant, fixu
         transplant(tree, z, z.left_child)
     else:
         y = tree_successor(tree, z)
-        y_original_color = y.color
+        y_original_black = y.black
         x = y.right_child
         if y.parent is z:
             x.parent = y
@@ -178,8 +178,8 @@ def delete_node(tree: RBTree, node: RBTreeNode, transplant_func=transplant, fixu
         transplant(tree, z, y)
         y.left_child = z.left_child
         y.left_child.parent = y
-        y.color = z.color
-    if y_original_color is "black":
+        y.black = z.black
+    if y_original_black:
         fixup_func(tree, x)
     tree.nil.parent = None
 
@@ -2,6 +2,7 @@ from intervaltree.bs_tree_node import *
 
 
 class RBTreeNode(BSTreeNode):
+    __slots__ = ('black',)
 
     def __init__(self, key=None,
                  parent=None,
@@ -17,7 +18,7 @@ class RBTreeNode(BSTreeNode):
 
     @color.setter
     def color(self, value:str):
-        self.black = value is "black"
+        self.black = value == "black"
 
     @property
     def is_root(self):
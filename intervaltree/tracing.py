@@ -0,0 +1,688 @@
+"""
+Capture and replay of workloads run against i_tree_funcs.
+
+TraceRecorder replaces the public operations of the i_tree_funcs module, add_node, insert_node, add_node_coalescing,
+delete_node, query_tree, adjust_payload, delete_range, adjust_range and compact, with wrappers that write every call
+to a compact binary trace.  Only code that looks the functions up on the module while the recorder runs is traced,
+names imported from it beforehand still refer to the originals.  Each call is recorded once, as made: calls
+i_tree_funcs makes to those functions itself, such as the query_tree of exists_query or the compact of from_sorted,
+and any call made while a recorded one runs on the same thread, go straight to the original.  Functions that are not
+recorded, load_sorted_nodes or consolidate_nodes for example, leave a replayed tree behind the recorded one when
+they change it.
+
+A trace is a header followed by records.  Each record starts with an operation code, the id of the tree it applies
+to and the seconds since recording started.  The first record for a tree holds its filter configuration and its
+contents at that point, so the replay starts from the same state.  Interval bounds are written as int64 or float64
+with a tag for each, so integers come back as integers and exactly, and bounds of any other type, or integers
+outside the int64 range, raise ValueError.  Payloads are written once each as JSON and then referred to by id, and
+with hash_payloads set every key and value is replaced by a stable hash first.  The JSON tags dicts and tuples, so
+that payloads made of None, bool, int, float, str, list, tuple and dict come back equal and of the same types, dict
+keys included.  Payloads holding any other type raise ValueError when they are recorded.  Nodes are identified by
+their interval and payload, so a trace can be replayed on engines that address nodes differently.  A qualifier given
+to delete_range or adjust_range cannot be written, so the recorder calls it on the payloads of the nodes the
+operation matches and writes the payloads it accepted instead.  A filter_vector_generator is not written either, the
+replay derives vectors from the configuration of the tree.
+
+TraceReplayer runs a trace through an adapter for a tree engine and reports latency percentiles per operation.
+"""
+import json
+import math
+import numbers
+import struct
+import sys
+import threading
+from collections import namedtuple
+from time import perf_counter
+from typing import Any, BinaryIO, Dict, Generator, List, Optional
+import mmh3
+from intervaltree import i_tree_funcs
+from intervaltree import array_i_tree
+from .filter_config import FilterConfig, FieldMatch, DEFAULT_FILTER_CONFIG
+from .interval import Interval, interval_overlaps
+
+MAGIC = b'FITR'
+VERSION = 2
+
+OP_PAYLOAD = 1
+OP_TREE = 2
+OP_ADD = 3
+OP_DELETE = 4
+OP_QUERY = 5
+OP_ADJUST = 6
+OP_INSERT = 7
+OP_ADD_COALESCING = 8
+OP_DELETE_RANGE = 9
+OP_ADJUST_RANGE = 10
+OP_COMPACT = 11
+
+OPERATION_NAMES = {
+    OP_TREE: 'tree',
+    OP_ADD: 'add_node',
+    OP_DELETE: 'delete_node',
+    OP_QUERY: 'query_tree',
+    OP_ADJUST: 'adjust_payload',
+    OP_INSERT: 'insert_node',
+    OP_ADD_COALESCING: 'add_node_coalescing',
+    OP_DELETE_RANGE: 'delete_range',
+    OP_ADJUST_RANGE: 'adjust_range',
+    OP_COMPACT: 'compact',
+}
+
+QUERY_MUST_CONTAIN = 1
+QUERY_PARTIAL = 2
+TREE_COALESCE = 1
+TREE_FIELD_LEVEL = 2
+TREE_TRACK_GAPS = 4
+RANGE_QUALIFIED = 1
+BOUND_INT = 0
+BOUND_FLOAT = 1
+
+_HEADER = struct.Struct('<4sH')
+# operation, tree id, seconds since recording started
+_RECORD = struct.Struct('<BId')
+# payload id, length of its JSON
+_PAYLOAD = struct.Struct('<II')
+# filter width, hash count, flags, node count
+_TREE = struct.Struct('<IHBI')
+# the tags of begin and end, then begin and end as int64 or float64 following their tags
+_INTERVAL = struct.Struct('<BB8s8s')
+_INT64 = struct.Struct('<q')
+_FLOAT64 = struct.Struct('<d')
+# after the interval: payload id
+_NODE = struct.Struct('<I')
+# after the interval: payload id, flags, length of the filter vector in bytes
+_QUERY = struct.Struct('<IBH')
+# after the node interval: node payload id, then after the adjustment interval: adjustments id
+_ADJUST = struct.Struct('<I')
+# after the interval of a range operation: flags, length of the filter vector in bytes, count of accepted payloads,
+# then the filter vector and the ids of the payloads the qualifier accepted
+_RANGE = struct.Struct('<BHI')
+_PAYLOAD_ID = struct.Struct('<I')
+
+# the adapter method that replays each operation
+ADAPTER_METHODS = {
+    'add_node': 'add',
+    'insert_node': 'insert',
+    'add_node_coalescing': 'add_coalescing',
+    'delete_node': 'delete',
+    'query_tree': 'query',
+    'adjust_payload': 'adjust',
+    'delete_range': 'delete_range',
+    'adjust_range': 'adjust_range',
+    'compact': 'compact',
+}
+
+_LIBRARY_GLOBALS = vars(i_tree_funcs)
+
+TraceRecord = namedtuple('TraceRecord', ['operation', 'tree_id', 'time', 'arguments'])
+
+
+def encode_payload(payload):
+    """
+    A payload as JSON data that keeps its types: dicts become {"d": [[key, value], ...]} and tuples {"t": [...]},
+    so that a JSON object is always one of those tags
+    :param payload: payload made of None, bool, int, float, str, list, tuple and dict
+    :return: the JSON data, raising ValueError for any other type
+    """
+    payload_type = type(payload)
+    if payload is None or payload_type in (bool, int, float, str):
+        return payload
+    if payload_type is list:
+        return [encode_payload(_) for _ in payload]
+    if payload_type is tuple:
+        return {'t': [encode_payload(_) for _ in payload]}
+    if payload_type is dict:
+        return {'d': [[encode_payload(key), encode_payload(value)] for key, value in payload.items()]}
+    raise ValueError('payloads holding %s cannot be traced' % payload_type.__name__)
+
+
+def decode_payload(data):
+    """
+    the payload encode_payload turned into data
+    """
+    if type(data) is list:
+        return [decode_payload(_) for _ in data]
+    if type(data) is dict:
+        if 't' in data:
+            return tuple(decode_payload(_) for _ in data['t'])
+        return {decode_payload(key): decode_payload(value) for key, value in data['d']}
+    return data
+
+
+def _pack_bound(value) -> tuple:
+    if isinstance(value, numbers.Integral):
+        value = int(value)
+        if not -2 ** 63 <= value < 2 ** 63:
+            raise ValueError('interval bound %d is outside the int64 range a trace can hold' % value)
+        return BOUND_INT, _INT64.pack(value)
+    if isinstance(value, float):
+        return BOUND_FLOAT, _FLOAT64.pack(value)
+    raise ValueError('interval bounds of type %s cannot be traced' % type(value).__name__)
+
+
+def pack_interval(interval: Interval) -> bytes:
+    """
+    the bounds of an interval with their type tags, raising ValueError for bounds that are neither int64 nor float
+    """
+    begin_tag, begin = _pack_bound(interval.begin)
+    end_tag, end = _pack_bound(interval.end)
+    return _INTERVAL.pack(begin_tag, end_tag, begin, end)
+
+
+def _unpack_bound(tag: int, data: bytes):
+    if tag == BOUND_INT:
+        return _INT64.unpack(data)[0]
+    if tag == BOUND_FLOAT:
+        return _FLOAT64.unpack(data)[0]
+    raise ValueError('unknown bound type %d' % tag)
+
+
+def unpack_interval(data: bytes) -> Interval:
+    begin_tag, end_tag, begin, end = _INTERVAL.unpack(data)
+    return Interval(_unpack_bound(begin_tag, begin), _unpack_bound(end_tag, end))
+
+
+def stable_hash(value) -> str:
+    """
+    a hash of repr(value) that is the same in every process, unlike hash()
+    """
+    return mmh3.hash_bytes(repr(value))[:8].hex()
+
+
+def anonymize(payload):
+    """
+    Replaces the keys and values of a dict payload with their stable hashes, and any other payload with its own.  Dict
+    payloads stay dicts, so adjust_payload still applies to them on replay.
+    """
+    if payload is None:
+        return None
+    if isinstance(payload, dict):
+        return {stable_hash(key): stable_hash(value) for key, value in payload.items()}
+    return stable_hash(payload)
+
+
+class TraceRecorder:
+    """
+    Records the calls made through i_tree_funcs while started, to a binary stream
+    """
+
+    def __init__(self, stream: BinaryIO, hash_payloads: bool=False):
+        """
+        :param stream: binary stream to write the trace to
+        :param hash_payloads: replaces every payload key and value with a stable hash before writing it
+        """
+        self.stream = stream
+        self.hash_payloads = hash_payloads
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals = {}
+        self._payload_ids = {}
+        self._trees = {}
+        self._tree_count = 0
+        self._started = None
+        stream.write(_HEADER.pack(MAGIC, VERSION))
+
+    def __enter__(self) -> 'TraceRecorder':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._originals:
+            raise RuntimeError('the recorder is already started')
+        self._started = perf_counter()
+        for name, wrapper in [
+            ('add_node', self._add_node),
+            ('insert_node', self._insert_node),
+            ('add_node_coalescing', self._add_node_coalescing),
+            ('delete_node', self._delete_node),
+            ('query_tree', self._query_tree),
+            ('adjust_payload', self._adjust_payload),
+            ('delete_range', self._delete_range),
+            ('adjust_range', self._adjust_range),
+            ('compact', self._compact),
+        ]:
+            self._originals[name] = getattr(i_tree_funcs, name)
+            setattr(i_tree_funcs, name, wrapper)
+
+    def stop(self):
+        for name, original in self._originals.items():
+            setattr(i_tree_funcs, name, original)
+        self._originals = {}
+        # the trees were only held to keep their ids from being reused
+        self._trees = {}
+        self.stream.flush()
+
+    def _call(self, name: str, write, *args):
+        """
+        Runs the original function, recording the call when it is made at the top level: neither by i_tree_funcs
+        itself nor while another wrapped call runs on this thread
+        """
+        original = self._originals[name]
+        local = self._local
+        depth = getattr(local, 'depth', 0)
+        local.depth = depth + 1
+        try:
+            # the frames below are this method and the wrapper, then the caller
+            if not depth and sys._getframe(2).f_globals is not _LIBRARY_GLOBALS:
+                with self._lock:
+                    write()
+            return original(*args)
+        finally:
+            local.depth = depth
+
+    def _add_node(self, tree, node):
+        def write():
+            tree_id = self._tree_id(tree)
+            self._write_record(OP_ADD, tree_id, self._node(node))
+        return self._call('add_node', write, tree, node)
+
+    def _insert_node(self, tree, node):
+        def write():
+            tree_id = self._tree_id(tree)
+            self._write_record(OP_INSERT, tree_id, self._node(node))
+        return self._call('insert_node', write, tree, node)
+
+    def _add_node_coalescing(self, tree, node):
+        def write():
+            tree_id = self._tree_id(tree)
+            self._write_record(OP_ADD_COALESCING, tree_id, self._node(node))
+        return self._call('add_node_coalescing', write, tree, node)
+
+    def _delete_node(self, tree, node):
+        def write():
+            tree_id = self._tree_id(tree)
+            self._write_record(OP_DELETE, tree_id, self._node(node))
+        return self._call('delete_node', write, tree, node)
+
+    def _query_tree(self, tree, query_node, must_contain=True, stats=None):
+        def write():
+            tree_id = self._tree_id(tree)
+            payload = query_node.payload
+            flags = QUERY_MUST_CONTAIN if must_contain else 0
+            if isinstance(payload, FieldMatch):
+                flags |= QUERY_PARTIAL
+                payload = payload.fields
+            payload_id = self._payload_id(payload)
+            # without a payload the filter vector is all the query has to filter on
+            vector = _vector_bytes(query_node.filter_vector) if payload is None else b''
+            self._write_record(OP_QUERY, tree_id,
+                               pack_interval(query_node.key) + _QUERY.pack(payload_id, flags, len(vector)) + vector)
+        return self._call('query_tree', write, tree, query_node, must_contain, stats)
+
+    def _adjust_payload(self, tree, a_node, adjustment_interval, adjustments, filter_vector_generator=None):
+        def write():
+            tree_id = self._tree_id(tree)
+            self._write_record(OP_ADJUST, tree_id,
+                               self._node(a_node) + pack_interval(adjustment_interval) +
+                               _ADJUST.pack(self._payload_id(adjustments)))
+        return self._call('adjust_payload', write, tree, a_node, adjustment_interval, adjustments,
+                          filter_vector_generator)
+
+    def _delete_range(self, tree, interval, filter_vector=None, qualifier=None):
+        def write():
+            tree_id = self._tree_id(tree)
+            accepted = None
+            if qualifier is not None and interval.end > interval.begin:
+                accepted = [_.payload for _ in i_tree_funcs._range_hits(tree, interval, filter_vector, qualifier)]
+            self._write_record(OP_DELETE_RANGE, tree_id,
+                               pack_interval(interval) + self._range(filter_vector, qualifier, accepted))
+        return self._call('delete_range', write, tree, interval, filter_vector, qualifier)
+
+    def _adjust_range(self, tree, interval, adjustments, filter_vector_generator=None, qualifier=None):
+        def write():
+            tree_id = self._tree_id(tree)
+            accepted = None
+            if qualifier is not None:
+                accepted = [_.payload for _ in i_tree_funcs._closed_range_nodes(tree, interval)
+                            if interval_overlaps(_.key, interval) and qualifier(_.payload)]
+            self._write_record(OP_ADJUST_RANGE, tree_id,
+                               pack_interval(interval) + _ADJUST.pack(self._payload_id(adjustments)) +
+                               self._range(None, qualifier, accepted))
+        return self._call('adjust_range', write, tree, interval, adjustments, filter_vector_generator, qualifier)
+
+    def _compact(self, tree):
+        def write():
+            self._write_record(OP_COMPACT, self._tree_id(tree), b'')
+        return self._call('compact', write, tree)
+
+    def _write_record(self, operation: int, tree_id: int, body: bytes):
+        self.stream.write(_RECORD.pack(operation, tree_id, perf_counter() - self._started) + body)
+
+    def _payload_id(self, payload) -> int:
+        if payload is None:
+            return 0
+        if self.hash_payloads:
+            payload = anonymize(payload)
+        text = json.dumps(encode_payload(payload))
+        payload_id = self._payload_ids.get(text)
+        if payload_id is None:
+            payload_id = self._payload_ids[text] = len(self._payload_ids) + 1
+            data = text.encode('utf-8')
+            self._write_record(OP_PAYLOAD, 0, _PAYLOAD.pack(payload_id, len(data)) + data)
+        return payload_id
+
+    def _node(self, node) -> bytes:
+        return pack_interval(node.key) + _NODE.pack(self._payload_id(node.payload))
+
+    def _range(self, filter_vector, qualifier, accepted) -> bytes:
+        """
+        the selection of a range operation: its filter vector and, in place of the qualifier, which payloads of the
+        nodes it would match the qualifier accepted
+        """
+        vector = _vector_bytes(filter_vector)
+        payload_ids = sorted({self._payload_id(_) for _ in accepted or []})
+        return _RANGE.pack(RANGE_QUALIFIED if qualifier is not None else 0, len(vector), len(payload_ids)) + vector + \
+            b''.join(_PAYLOAD_ID.pack(_) for _ in payload_ids)
+
+    def _tree_id(self, tree) -> int:
+        """
+        the id of a tree, writing its configuration and contents the first time it is seen
+        """
+        entry = self._trees.get(id(tree))
+        if entry is not None:
+            return entry[1]
+        config = tree.filter_config
+        flags = (TREE_COALESCE if tree.coalesce else 0) | (TREE_FIELD_LEVEL if config.field_level else 0) | \
+            (TREE_TRACK_GAPS if tree.track_gaps else 0)
+        # packed before the tree gets its id, a node that cannot be traced leaves the tree unseen
+        nodes = [self._node(_) for _ in i_tree_funcs._inorder_nodes(tree)] if tree.root is not tree.nil else []
+        self._tree_count += 1
+        tree_id = self._tree_count
+        self._trees[id(tree)] = (tree, tree_id)
+        self._write_record(OP_TREE, tree_id, _TREE.pack(config.width, config.hash_count, flags, len(nodes)) +
+                           b''.join(nodes))
+        return tree_id
+
+
+def _vector_bytes(filter_vector: Optional[int]) -> bytes:
+    if not filter_vector:
+        return b''
+    return filter_vector.to_bytes((filter_vector.bit_length() + 7) // 8, 'little')
+
+
+def read_trace(stream: BinaryIO) -> Generator[TraceRecord, None, None]:
+    """
+    Reads the operations of a trace.  Payload definitions are resolved rather than returned.
+    :param stream: binary stream holding the trace
+    :return: a generator of records, whose arguments are
+        tree: (config, [(interval, payload), ...]) where config holds width, hash_count, coalesce, field_level
+            and track_gaps
+        add_node, insert_node, add_node_coalescing, delete_node: (interval, payload)
+        query_tree: (interval, payload, filter_vector, must_contain, partial)
+        adjust_payload: (interval, payload, adjustment_interval, adjustments)
+        delete_range: (interval, filter_vector, accepted)
+        adjust_range: (interval, adjustments, accepted)
+        compact: ()
+        where accepted is None for a range operation without a qualifier, and otherwise the list of payloads the
+        qualifier accepted
+    """
+    magic, version = _HEADER.unpack(stream.read(_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('not a trace')
+    if version != VERSION:
+        raise ValueError('unsupported trace version %d' % version)
+
+    payloads = {0: None}
+
+    def read(layout: struct.Struct) -> tuple:
+        return layout.unpack(stream.read(layout.size))
+
+    def read_interval() -> Interval:
+        return unpack_interval(stream.read(_INTERVAL.size))
+
+    def node_arguments() -> tuple:
+        key = read_interval()
+        payload_id, = read(_NODE)
+        return key, payloads[payload_id]
+
+    def range_arguments() -> tuple:
+        flags, vector_length, accepted_count = read(_RANGE)
+        vector = int.from_bytes(stream.read(vector_length), 'little')
+        accepted = [payloads[read(_PAYLOAD_ID)[0]] for _ in range(accepted_count)]
+        return vector, accepted if flags & RANGE_QUALIFIED else None
+
+    while True:
+        header = stream.read(_RECORD.size)
+        if not header:
+            return
+        if len(header) < _RECORD.size:
+            raise ValueError('truncated trace')
+        operation, tree_id, time = _RECORD.unpack(header)
+
+        if operation == OP_PAYLOAD:
+            payload_id, length = read(_PAYLOAD)
+            payloads[payload_id] = decode_payload(json.loads(stream.read(length).decode('utf-8')))
+            continue
+        if operation == OP_TREE:
+            width, hash_count, flags, count = read(_TREE)
+            config = {
+                'width': width,
+                'hash_count': hash_count,
+                'coalesce': bool(flags & TREE_COALESCE),
+                'field_level': bool(flags & TREE_FIELD_LEVEL),
+                'track_gaps': bool(flags & TREE_TRACK_GAPS),
+            }
+            arguments = (config, [node_arguments() for _ in range(count)])
+        elif operation in (OP_ADD, OP_INSERT, OP_ADD_COALESCING, OP_DELETE):
+            arguments = node_arguments()
+        elif operation == OP_QUERY:
+            key = read_interval()
+            payload_id, flags, vector_length = read(_QUERY)
+            vector = int.from_bytes(stream.read(vector_length), 'little')
+            arguments = (key, payloads[payload_id], vector, bool(flags & QUERY_MUST_CONTAIN),
+                         bool(flags & QUERY_PARTIAL))
+        elif operation == OP_ADJUST:
+            key, payload = node_arguments()
+            adjustment_interval = read_interval()
+            adjustments_id, = read(_ADJUST)
+            arguments = (key, payload, adjustment_interval, payloads[adjustments_id])
+        elif operation == OP_DELETE_RANGE:
+            key = read_interval()
+            arguments = (key,) + range_arguments()
+        elif operation == OP_ADJUST_RANGE:
+            key = read_interval()
+            adjustments_id, = read(_ADJUST)
+            arguments = (key, payloads[adjustments_id], range_arguments()[1])
+        elif operation == OP_COMPACT:
+            arguments = ()
+        else:
+            raise ValueError('unknown operation %d' % operation)
+        yield TraceRecord(OPERATION_NAMES[operation], tree_id, time, arguments)
+
+
+def _qualifier(accepted: Optional[list]):
+    """
+    a qualifier accepting the payloads a recorded qualifier accepted, or None when the operation had none
+    """
+    if accepted is None:
+        return None
+    return lambda payload: payload in accepted
+
+
+class ObjectTreeAdapter:
+    """
+    Replays traces on FilterableIntervalTree through i_tree_funcs
+    """
+    name = 'object'
+
+    def build(self, config: dict, entries: List[tuple]) -> i_tree_funcs.FilterableIntervalTree:
+        filter_config = FilterConfig(config['width'], config['hash_count'], field_level=config['field_level'])
+        node_class = i_tree_funcs.GapTrackingIntervalTreeNode if config['track_gaps'] else \
+            i_tree_funcs.FilterableIntervalTreeNode
+        nodes = [node_class(key, payload, filter_config=filter_config) for key, payload in entries]
+        return i_tree_funcs.FilterableIntervalTree.from_sorted(nodes, filter_config, config['coalesce'],
+                                                              config['track_gaps'])
+
+    def find(self, tree, key: Interval, payload) -> Optional[i_tree_funcs.FilterableIntervalTreeNode]:
+        query_node = i_tree_funcs.generate_query_node(key.begin, key.end, payload, filter_config=tree.filter_config)
+        for node in i_tree_funcs.query_tree(tree, query_node, True):
+            if node.key == key and node.payload == payload:
+                return node
+        return None
+
+    def add(self, tree, key: Interval, payload):
+        i_tree_funcs.add_node(tree, tree.create_node(key, payload))
+
+    def insert(self, tree, key: Interval, payload):
+        i_tree_funcs.insert_node(tree, tree.create_node(key, payload))
+
+    def add_coalescing(self, tree, key: Interval, payload):
+        i_tree_funcs.add_node_coalescing(tree, tree.create_node(key, payload))
+
+    def delete(self, tree, node):
+        i_tree_funcs.delete_node(tree, node)
+
+    def query(self, tree, key: Interval, payload, filter_vector: int, must_contain: bool, partial: bool) -> int:
+        query_node = i_tree_funcs.generate_query_node(key.begin, key.end, payload, None if payload else filter_vector,
+                                                      tree.filter_config, partial)
+        count = 0
+        for _ in i_tree_funcs.query_tree(tree, query_node, must_contain):
+            count += 1
+        return count
+
+    def adjust(self, tree, node, adjustment_interval: Interval, adjustments: dict):
+        i_tree_funcs.adjust_payload(tree, node, adjustment_interval, adjustments)
+
+    def delete_range(self, tree, interval: Interval, filter_vector: int, accepted: Optional[list]):
+        i_tree_funcs.delete_range(tree, interval, filter_vector or None, _qualifier(accepted))
+
+    def adjust_range(self, tree, interval: Interval, adjustments: dict, accepted: Optional[list]):
+        i_tree_funcs.adjust_range(tree, interval, adjustments, None, _qualifier(accepted))
+
+    def compact(self, tree):
+        i_tree_funcs.compact(tree)
+
+    def contents(self, tree) -> List[tuple]:
+        return [(_.key, _.payload) for _ in i_tree_funcs._inorder_nodes(tree)]
+
+
+class ArrayTreeAdapter:
+    """
+    Replays traces on ArrayFilterableIntervalTree.  The array engine has integer bounds and 64 bit filter vectors
+    built with the default configuration, so traces of other configurations are replayed with it regardless.  It
+    neither coalesces nor has range operations, so add_node_coalescing, delete_range, adjust_range and compact
+    records are counted as unsupported and skipped, and trees that coalesce are replayed without it.
+    """
+    name = 'array'
+
+    @staticmethod
+    def _vector(payload) -> int:
+        return DEFAULT_FILTER_CONFIG.vector_for_string(str(payload))
+
+    def build(self, config: dict, entries: List[tuple]) -> array_i_tree.ArrayFilterableIntervalTree:
+        tree = array_i_tree.ArrayFilterableIntervalTree(2 * len(entries) + 2)
+        for key, payload in entries:
+            array_i_tree.add_node(tree, key, payload, self._vector(payload))
+        return tree
+
+    def find(self, tree, key: Interval, payload) -> Optional[int]:
+        query_node = i_tree_funcs.generate_query_node(key.begin, key.end, payload, self._vector(payload))
+        for index in array_i_tree.query_tree(tree, query_node, True):
+            if tree.key(index) == key and tree.payload(index) == payload:
+                return index
+        return None
+
+    def add(self, tree, key: Interval, payload):
+        array_i_tree.add_node(tree, key, payload, self._vector(payload))
+
+    insert = add
+
+    def delete(self, tree, index: int):
+        array_i_tree.delete_node(tree, index)
+
+    def query(self, tree, key: Interval, payload, filter_vector: int, must_contain: bool, partial: bool) -> int:
+        vector = self._vector(payload) if payload is not None else filter_vector & 0xffffffffffffffff
+        query_node = i_tree_funcs.generate_query_node(key.begin, key.end, payload, vector)
+        count = 0
+        for _ in array_i_tree.query_tree(tree, query_node, must_contain):
+            count += 1
+        return count
+
+    def adjust(self, tree, index: int, adjustment_interval: Interval, adjustments: dict):
+        array_i_tree.adjust_payload(tree, index, adjustment_interval, adjustments, self._vector)
+
+    def contents(self, tree) -> List[tuple]:
+        return [(tree.key(_), tree.payload(_)) for _ in array_i_tree.inorder_walk(tree)]
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """
+    nearest rank percentile of values that are already sorted
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+class TraceReplayer:
+    """
+    Runs the operations of traces against one tree engine, timing each of them.  Nodes named by delete_node and
+    adjust_payload records are looked up before the timer starts, and records whose node cannot be found are counted
+    as unresolved and skipped.  Records of operations the adapter has no method for are counted as unsupported and
+    skipped.
+    """
+
+    def __init__(self, adapter=None):
+        """
+        :param adapter: engine to replay on, an ObjectTreeAdapter when not provided
+        """
+        self.adapter = adapter or ObjectTreeAdapter()
+        self.trees = {}
+        self.latencies = {}
+        self.unresolved = {}
+        self.unsupported = {}
+
+    def replay(self, stream: BinaryIO) -> Dict[str, Dict[str, Any]]:
+        """
+        :param stream: binary stream holding the trace
+        :return: the report
+        """
+        adapter = self.adapter
+        trees = self.trees
+        for record in read_trace(stream):
+            arguments = record.arguments
+            if record.operation == 'tree':
+                trees[record.tree_id] = adapter.build(*arguments)
+                continue
+            tree = trees[record.tree_id]
+
+            method = getattr(adapter, ADAPTER_METHODS[record.operation], None)
+            if method is None:
+                self.unsupported[record.operation] = self.unsupported.get(record.operation, 0) + 1
+                continue
+            if record.operation in ('delete_node', 'adjust_payload'):
+                node = adapter.find(tree, arguments[0], arguments[1])
+                if node is None:
+                    self.unresolved[record.operation] = self.unresolved.get(record.operation, 0) + 1
+                    continue
+                started = perf_counter()
+                method(tree, node, *arguments[2:])
+            else:
+                started = perf_counter()
+                method(tree, *arguments)
+            self.latencies.setdefault(record.operation, []).append(perf_counter() - started)
+        return self.report()
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: for each operation replayed, the count, the unresolved and unsupported counts and the mean, p50, p90,
+            p99 and maximum latencies in microseconds
+        """
+        result = {}
+        for operation in sorted(set(self.latencies) | set(self.unresolved) | set(self.unsupported)):
+            ordered = sorted(self.latencies.get(operation, []))
+            result[operation] = {
+                'count': len(ordered),
+                'unresolved': self.unresolved.get(operation, 0),
+                'unsupported': self.unsupported.get(operation, 0),
+                'mean_us': 1e6 * sum(ordered) / len(ordered) if ordered else 0.0,
+                'p50_us': 1e6 * percentile(ordered, 0.5),
+                'p90_us': 1e6 * percentile(ordered, 0.9),
+                'p99_us': 1e6 * percentile(ordered, 0.99),
+                'max_us': 1e6 * ordered[-1] if ordered else 0.0,
+            }
+        return result
@@ -46,7 +46,7 @@ setup(
 
     # You can just specify the packages manually here if your project is
     # simple. Or you can use find_packages().
-    packages=find_packages(exclude=['test']),
+    packages=find_packages(exclude=['test', 'benchmarks']),
     install_requires=requirements,
     extras_require={
         'test': ['coverage'],
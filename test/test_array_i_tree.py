@@ -0,0 +1,159 @@
+from intervaltree.array_i_tree import *
+from intervaltree.i_tree_funcs import generate_query_node, FilterableIntervalTreeNode
+from .test_easy_hashes import id_generator
+import random
+
+
+def assert_valid_array_tree(tree: ArrayFilterableIntervalTree):
+    assert tree.blacks[NIL]
+    assert tree.blacks[tree.root]
+    assert tree.subtree_maximums[NIL] == np.iinfo(np.int64).min
+    assert tree.subtree_filter_vectors[NIL] == 0
+
+    def check(index):
+        if index == NIL:
+            return 0
+        left = tree.left_children[index]
+        right = tree.right_children[index]
+        if left != NIL:
+            assert tree.parents[left] == index
+            assert tree.begins[left] <= tree.begins[index]
+        if right != NIL:
+            assert tree.parents[right] == index
+            assert tree.begins[right] >= tree.begins[index]
+        if not tree.blacks[index]:
+            assert tree.blacks[left] and tree.blacks[right]
+        left_height = check(left)
+        right_height = check(right)
+        assert left_height == right_height
+        assert tree.subtree_maximums[index] == \
+            max(tree.ends[index], tree.subtree_maximums[left], tree.subtree_maximums[right])
+        assert tree.subtree_filter_vectors[index] == \
+            tree.filter_vectors[index] | tree.subtree_filter_vectors[left] | tree.subtree_filter_vectors[right]
+        return left_height + (1 if tree.blacks[index] else 0)
+
+    check(tree.root)
+    assert len(list(tree.inorder_walk())) == len(tree)
+
+
+def build_random_intervals(count):
+    data = map(lambda _: (random.randint(0, 1000), random.randint(0, 30)), range(0, count))
+    return [(Interval(v[0], v[0] + v[1]), id_generator(15)) for v in data]
+
+
+def test_insertion_and_removal_integrity():
+    random.seed('test')
+    tree = ArrayFilterableIntervalTree()
+    indexes = [add_node(tree, interval, payload) for interval, payload in build_random_intervals(300)]
+    assert_valid_array_tree(tree)
+
+    begins = [tree.begins[_] for _ in tree.inorder_walk()]
+    assert begins == sorted(begins)
+
+    random.shuffle(indexes)
+    for index in indexes[:200]:
+        delete_node(tree, index)
+        assert_valid_array_tree(tree)
+
+    for interval, payload in build_random_intervals(100):
+        add_node(tree, interval, payload)
+    assert_valid_array_tree(tree)
+    assert len(tree) == 200
+
+
+def test_query_matches_object_tree():
+    from intervaltree import i_tree_funcs
+    random.seed('test')
+    data = build_random_intervals(1000)
+    array_tree = ArrayFilterableIntervalTree()
+    object_tree = i_tree_funcs.FilterableIntervalTree()
+    for interval, payload in data:
+        add_node(array_tree, interval, payload)
+        i_tree_funcs.add_node(object_tree, FilterableIntervalTreeNode(interval, payload))
+
+    for interval, payload in random.sample(data, 50):
+        for must_contain in [True, False]:
+            query = generate_query_node(interval.begin, interval.end, payload)
+            expected = sorted(
+                (_.key, _.payload) for _ in i_tree_funcs.query_tree(object_tree, query, must_contain))
+            actual = sorted(
+                (array_tree.key(_), array_tree.payload(_)) for _ in query_tree(array_tree, query, must_contain))
+            assert expected == actual
+            if must_contain:
+                assert (interval, payload) in actual
+
+        query = generate_query_node(interval.begin, interval.end, filter_vector=0)
+        expected = sorted(_.key for _ in i_tree_funcs.query_tree(object_tree, query, False))
+        actual = sorted(array_tree.key(_) for _ in query_tree(array_tree, query, False))
+        assert expected == actual
+
+
+def test_adjust_payload():
+    tree = ArrayFilterableIntervalTree()
+    payload_a = {'name': 'chris'}
+    index = add_node(tree, Interval(50, 100), payload_a)
+    adjusted = adjust_payload(tree, index, Interval(60, 70), {'state': 'b'})
+
+    expectations = [
+        (Interval(50, 60), payload_a),
+        (Interval(60, 70), {'state': 'b', 'name': 'chris'}),
+        (Interval(70, 100), payload_a)
+    ]
+    actual = [(tree.key(_), tree.payload(_)) for _ in tree.inorder_walk()]
+    assert expectations == actual
+    assert tree.key(adjusted) == Interval(60, 70)
+
+    adjust_payload(tree, adjusted, Interval(60, 70), {'state': None})
+    actual = [(tree.key(_), tree.payload(_)) for _ in tree.inorder_walk()]
+    assert [_[0] for _ in actual] == [Interval(50, 60), Interval(60, 70), Interval(70, 100)]
+
+    index = [_ for _ in tree.inorder_walk()][1]
+    tree.payloads[index] = {'name': 'chris'}
+    adjust_payload(tree, index, Interval(65, 70), {'name': 'manu'})
+    actual = [(tree.key(_), tree.payload(_)) for _ in tree.inorder_walk()]
+    assert actual == [
+        (Interval(50, 65), payload_a),
+        (Interval(65, 70), {'name': 'manu'}),
+        (Interval(70, 100), payload_a)
+    ]
+    assert_valid_array_tree(tree)
+
+
+def test_adjusted_payload_is_found_by_queries():
+    tree = ArrayFilterableIntervalTree()
+    index = add_node(tree, Interval(5000, 5100), {'name': 'chris'})
+    adjusted = adjust_payload(tree, index, Interval(5020, 5030), {'state': 'b'})
+    assert tree.filter_vectors[adjusted] == tree.filter_config.vector_for_payload({'name': 'chris', 'state': 'b'})
+
+    query = generate_query_node(5022, 5028, {'name': 'chris', 'state': 'b'}, filter_config=tree.filter_config)
+    assert [tree.key(_) for _ in query_tree(tree, query)] == [Interval(5020, 5030)]
+    assert_valid_array_tree(tree)
+
+
+def test_memory_per_interval():
+    random.seed('test')
+    tree = ArrayFilterableIntervalTree()
+    for interval, payload in build_random_intervals(4000):
+        add_node(tree, interval, payload)
+
+    bytes_per_slot = tree.nbytes / tree.capacity
+    assert bytes_per_slot < 64
+
+
+def test_unsupported_bounds_and_widths():
+    tree = ArrayFilterableIntervalTree()
+    for interval in [Interval(0.5, 2), Interval(0, float('inf')), Interval(0, 2 ** 63)]:
+        try:
+            add_node(tree, interval, 'a')
+            assert False
+        except ValueError:
+            pass
+    assert len(tree) == 0
+    add_node(tree, Interval(-2 ** 63 + 1, 2 ** 63 - 1), 'a')
+    assert_valid_array_tree(tree)
+
+    try:
+        ArrayFilterableIntervalTree(filter_config=FilterConfig(width=128))
+        assert False
+    except ValueError:
+        pass
@@ -42,3 +42,31 @@ def test_hash_to_64():
             assert_0_to_63(_)
         uniques = set(data)
         assert len(uniques) >= uniques_needed
+
+
+def test_hash_to_width():
+    random.seed('testing')
+    seeds = list(
+        map(lambda _: id_generator(10), range(0, 300))
+    )
+    assert easy_hashes.hash_to_64('test1', 5) == [13, 60, 15, 2, 59]
+    for seed in seeds:
+        for width in [128, 256, 512]:
+            data = easy_hashes.hash_to_width(seed, count=12, width=width)
+            assert len(data) == 12
+            for _ in data:
+                assert 0 <= _ < width
+            assert data[8:] != data[:4]
+
+
+def test_hash_batch_to_width():
+    random.seed('testing')
+    seeds = list(
+        map(lambda _: id_generator(10), range(0, 300))
+    )
+    for width in [64, 128, 512]:
+        for count in [1, 5, 12]:
+            batch = easy_hashes.hash_batch_to_width(seeds, count, width)
+            assert batch.shape == (len(seeds), count)
+            for seed, row in zip(seeds, batch.tolist()):
+                assert row == easy_hashes.hash_to_width(seed, count, width)
@@ -0,0 +1,231 @@
+from intervaltree.i_tree_funcs import *
+from intervaltree.filter_config import FilterConfig, FieldMatch, false_positive_report
+from intervaltree.query_stats import QueryStats
+from .test_filterable_interval_tree import insert_nodes
+from .test_easy_hashes import id_generator
+import random
+
+
+def test_default_config_matches_basic_vectors():
+    config = FilterConfig()
+    for value in ['test1', 'test2', "{'name': 'chris'}"]:
+        assert config.vector_for_string(value) == generate_basic_filter_vector(value)
+        assert FilterableIntervalTreeNode(Interval(0, 1), value).filter_vector == config.vector_for_string(value)
+
+
+def test_invalid_configs():
+    for width, hash_count in [(32, 5), (96, 5), (131072, 5), (64, 0)]:
+        try:
+            FilterConfig(width, hash_count)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_wide_filter_tree():
+    random.seed('test')
+    config = FilterConfig(256, 7)
+    tree = FilterableIntervalTree(config)
+    payloads = [id_generator(10) for _ in range(200)]
+    nodes = []
+    for _ in range(1000):
+        begin = random.randint(0, 1000)
+        node = tree.create_node(Interval(begin, begin + random.randint(1, 30)), random.choice(payloads))
+        assert node.filter_vector < 1 << 256
+        assert bin(node.filter_vector).count('1') <= 7
+        add_node(tree, node)
+        nodes.append(node)
+
+    for node in nodes[:50]:
+        query = generate_query_node(node.key.begin, node.key.end, node.payload, filter_config=config)
+        assert node in list(query_tree(tree, query, True))
+
+    bulk_tree = FilterableIntervalTree.from_iterable(nodes[:100], config)
+    assert bulk_tree.filter_config is config
+
+
+def test_nodes_follow_the_tree_config():
+    random.seed('test')
+    config = FilterConfig(256, 7)
+    tree = FilterableIntervalTree(config)
+    payloads = [id_generator(10) for _ in range(20)]
+    nodes = []
+    for _ in range(200):
+        begin = random.randint(0, 1000)
+        # built without the tree's configuration, the vector is derived again when the node is added
+        node = FilterableIntervalTreeNode(Interval(begin, begin + random.randint(1, 30)), random.choice(payloads))
+        add_node(tree, node)
+        assert node.filter_vector == config.vector_for_payload(node.payload)
+        nodes.append(node)
+
+    for node in nodes[:50]:
+        query = generate_query_node(node.key.begin, node.key.end, node.payload, filter_config=config)
+        assert node in list(query_tree(tree, query, True))
+
+    sorted_nodes = sorted((FilterableIntervalTreeNode(_.key, _.payload) for _ in nodes), key=lambda _: _.key.begin)
+    bulk_tree = FilterableIntervalTree.from_sorted(sorted_nodes, config)
+    assert all(_.filter_vector == config.vector_for_payload(_.payload) for _ in sorted_nodes)
+
+    explicit = FilterableIntervalTreeNode(Interval(0, 1), 'a', 1 << 64)
+    try:
+        add_node(FilterableIntervalTree(), explicit)
+        assert False
+    except ValueError:
+        pass
+    add_node(bulk_tree, explicit)
+    assert explicit.filter_vector == 1 << 64
+
+
+def test_false_positive_report():
+    random.seed('test')
+    payloads = [id_generator(10) for _ in range(500)]
+
+    def build(config):
+        nodes = []
+        for i in range(2000):
+            nodes.append(FilterableIntervalTreeNode(Interval(i, i + 5), random.choice(payloads), filter_config=config))
+        return FilterableIntervalTree.from_sorted(nodes, config)
+
+    narrow = false_positive_report(build(FilterConfig(64, 5)))
+    wide = false_positive_report(build(FilterConfig(512, 5)))
+
+    assert [_['nodes'] for _ in narrow] == [2 ** _ for _ in range(10)] + [2000 - 1023]
+    assert narrow[0]['observed_false_positive_rate'] > 0.9
+    assert wide[0]['observed_false_positive_rate'] < narrow[0]['observed_false_positive_rate']
+    assert wide[-1]['mean_fill'] < narrow[-1]['mean_fill']
+    for entry in narrow + wide:
+        assert 0 <= entry['expected_false_positive_rate'] <= 1
+        assert 0 <= entry['observed_false_positive_rate'] <= 1
+
+    config = FilterConfig(512, 5)
+    assert config.expected_false_positive_rate(10) < config.expected_false_positive_rate(1000)
+
+
+def test_filter_vector_cache():
+    config = FilterConfig(cache_size=3)
+    uncached = FilterConfig(cache_size=0)
+    assert uncached.cache is None
+
+    payloads = ['a', 'b', {'name': 'chris', 'state': 1}, {'state': 1, 'name': 'chris'}, 5, 5.0, True, None]
+    for payload in payloads + payloads:
+        assert config.vector_for_payload(payload) == uncached.vector_for_payload(payload)
+        assert config.vector_for_payload(payload) == generate_basic_filter_vector(str(payload))
+    assert len(config.cache) == 3
+    assert config.cache.hits > 0
+    assert config.cache.misses > 0
+
+    config.cache.clear()
+    config.vector_for_payload('a')
+    config.vector_for_payload('a')
+    assert config.cache.info() == {'hits': 1, 'misses': 1, 'size': 1, 'max_size': 3}
+
+    unhashable = {'names': ['chris', 'manu']}
+    assert config.vector_for_payload(unhashable) == generate_basic_filter_vector(str(unhashable))
+
+    # equal payloads whose str() differs must not share a cache entry
+    config = FilterConfig()
+    for pair in [(0.0, -0.0), ((1,), (True,)), ({'a': 0.0}, {'a': -0.0}), ({1: 'a'}, {True: 'a'}),
+                 ({'a': (1, 2)}, {'a': (True, 2)})]:
+        for payload in pair:
+            assert config.vector_for_payload(payload) == generate_basic_filter_vector(str(payload))
+
+
+def test_filter_vector_cache_eviction_is_lru():
+    config = FilterConfig(cache_size=2)
+    for payload in ['a', 'b']:
+        config.vector_for_payload(payload)
+    config.vector_for_payload('a')
+    config.vector_for_payload('c')
+    config.vector_for_payload('a')
+    assert config.cache.hits == 2
+    config.vector_for_payload('b')
+    assert config.cache.misses == 4
+
+
+def test_custom_canonicalizer():
+    config = FilterConfig(canonicalizer=lambda payload: tuple(sorted(payload.items())))
+    first = config.vector_for_payload({'name': 'chris', 'state': 'a'})
+    second = config.vector_for_payload({'state': 'a', 'name': 'chris'})
+    assert first == second
+    assert config.cache.hits == 1
+
+    config.cache.clear()
+    assert config.vector_for_payload({'state': 'a', 'name': 'chris'}) == first
+
+    tree = FilterableIntervalTree(config)
+    node = tree.create_node(Interval(0, 10), {'name': 'chris', 'state': 'a'})
+    add_node(tree, node)
+    query = generate_query_node(2, 3, {'state': 'a', 'name': 'chris'}, filter_config=config)
+    assert list(query_tree(tree, query)) == [node]
+
+
+def test_batched_vectors_match_scalar_vectors():
+    random.seed('test')
+    payloads = [{'state': random.randint(0, 20)} for _ in range(500)] + ['a', 5, None]
+    for width, hash_count in [(64, 5), (128, 3), (512, 11)]:
+        config = FilterConfig(width, hash_count)
+        expected = [config.vector_for_payload(_) for _ in payloads]
+        assert config.vectors_for_payloads(payloads) == expected
+
+        words = config.vectors_for_strings([str(_) for _ in payloads])
+        assert len(words) == len(payloads)
+
+    config = FilterConfig(canonicalizer=lambda payload: str(payload).upper())
+    assert config.vectors_for_payloads(['a', 'A']) == [config.vector_for_payload('a')] * 2
+    assert config.vectors_for_payloads([]) == []
+
+
+def test_field_level_vectors():
+    config = FilterConfig(256, 3, field_level=True)
+    first = config.vector_for_payload({'name': 'chris', 'state': 'a'})
+    assert first == config.vector_for_payload({'state': 'a', 'name': 'chris'})
+    assert first == config.vector_for_fields({'name': 'chris'}) | config.vector_for_fields({'state': 'a'})
+    assert config.vector_for_payload('a') == config.vector_for_string('a')
+
+    payloads = [{'state': 'a', 'name': 'chris'}, {'state': 'b'}, 'a', {}]
+    assert config.vectors_for_payloads(payloads) == [config.vector_for_payload(_) for _ in payloads]
+
+    try:
+        FieldMatch({'state': 'a'})
+        assert False
+    except ValueError:
+        pass
+
+
+def test_field_level_cache_ignores_the_canonicalizer():
+    # a canonicalizer that gives every payload the same key
+    config = FilterConfig(256, 3, canonicalizer=lambda payload: 0, field_level=True)
+    payloads = [{'name': 'chris'}, {'name': 'manu'}, {1: 'a'}, {True: 'a'}, {'tags': ['a']}, {'name': 'chris'}]
+    for _ in range(2):
+        assert [config.vector_for_payload(_) for _ in payloads] == [config.vector_for_fields(_) for _ in payloads]
+    assert config.cache.hits == len(payloads) + 1
+    assert config.vector_for_payload({'state': 'a', 'name': 'chris'}) == \
+        config.vector_for_payload({'name': 'chris', 'state': 'a'})
+
+
+def test_partial_match_query():
+    random.seed('test')
+    config = FilterConfig(256, 3, field_level=True)
+    tree = FilterableIntervalTree(config)
+    nodes = []
+    for _ in range(1000):
+        begin = random.randint(0, 1000)
+        payload = {'name': 'device-%d' % random.randrange(50), 'state': random.choice('abcd')}
+        nodes.append(tree.create_node(Interval(begin, begin + random.randint(1, 30)), payload))
+    insert_nodes(tree, nodes)
+
+    for _ in range(20):
+        name = 'device-%d' % random.randrange(50)
+        begin = random.randint(0, 1000)
+        query = generate_query_node(begin, begin + 50, {'name': name}, filter_config=config, partial=True)
+        stats = QueryStats()
+        results = list(query_tree(tree, query, must_contain=False, stats=stats))
+        expected = [_ for _ in nodes if _.payload['name'] == name and _.key.overlaps(query.key)]
+        assert sorted(map(id, results)) == sorted(map(id, expected))
+        assert stats.pruned_by_filter > 0
+
+        query = generate_query_node(begin, begin + 50, {'name': name, 'state': 'a'}, filter_config=config,
+                                    partial=True)
+        results = list(query_tree(tree, query, must_contain=False))
+        assert all(_.payload['name'] == name and _.payload['state'] == 'a' for _ in results)
+        assert len(results) == sum(1 for _ in expected if _.payload['state'] == 'a')
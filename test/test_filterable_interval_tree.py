@@ -4,6 +4,7 @@ from .test_rb_tree import assert_black_balanced_trees, assert_relationships, ass
 from intervaltree.print_tree import print_tree_diagram
 from .test_easy_hashes import id_generator
 import random
+import math
 
 
 def test_basic_filter_vector_generation():
@@ -110,6 +111,7 @@ def assert_valid_filterable_interval_tree(tree: FilterableIntervalTree):
 
     assert tree.nil.filter_vector == 0
     assert tree.nil.subtree_filter_vector == 0
+    assert tree.nil.subtree_size == 0
     for node in inorder_walk(tree.root):
         tracker_a += 1
         qn = generate_query_node(payload=node.payload)
@@ -121,12 +123,28 @@ def assert_valid_filterable_interval_tree(tree: FilterableIntervalTree):
         for vec in vecs:
             minvec |= vec
         assert node.subtree_filter_vector == minvec
+        assert node.subtree_size == node.left_child.subtree_size + node.right_child.subtree_size + 1
+        if tree.track_gaps:
+            left_child, right_child = node.left_child, node.right_child
+            gaps = [0, left_child.subtree_largest_gap, right_child.subtree_largest_gap]
+            if left_child:
+                assert node.subtree_minimum == left_child.subtree_minimum
+                gaps.append(node.key.begin - left_child.subtree_last_end)
+            else:
+                assert node.subtree_minimum == node.key.begin
+            if right_child:
+                assert node.subtree_last_end == right_child.subtree_last_end
+                gaps.append(right_child.subtree_minimum - node.key.end)
+            else:
+                assert node.subtree_last_end == node.key.end
+            assert node.subtree_largest_gap == max(gaps)
         parent = node.parent
         while parent:
             tracker_b += 1
             assert qn in parent
             assert node in parent
-            # assert node.key.begin >= parent.subtree_minimum
+            if tree.track_gaps:
+                assert node.key.begin >= parent.subtree_minimum
             assert node.key.end <= parent.subtree_maximum
             parent = parent.parent
 
@@ -313,6 +331,22 @@ def test_adjust_payload():
         assert node.payload == expectations[i][1]
 
 
+def test_adjusted_payload_is_found_by_queries():
+    config = FilterConfig(256, 7)
+    test_tree = FilterableIntervalTree(config)
+    node_a = add_node(test_tree, test_tree.create_node(Interval(50, 100), {'name': 'chris'}))
+    adjusted = adjust_payload(test_tree, node_a, Interval(60, 70), {'state': 'b'})
+    assert adjusted.filter_vector == config.vector_for_payload({'name': 'chris', 'state': 'b'})
+
+    query = generate_query_node(62, 68, {'name': 'chris', 'state': 'b'}, filter_config=config)
+    assert list(query_tree(test_tree, query)) == [adjusted]
+
+    # a generator can still carry the old vector over, as adjust_payload did by default before
+    node_b = add_node(test_tree, test_tree.create_node(Interval(200, 300), {'name': 'manu'}))
+    kept = adjust_payload(test_tree, node_b, Interval(220, 230), {'state': 'b'}, lambda _: node_b.filter_vector)
+    assert kept.filter_vector == node_b.filter_vector
+
+
 def test_failed_consolidation():
     test_tree = FilterableIntervalTree()
     payload_a = {'name': 'chris'}
@@ -407,4 +441,670 @@ def test_get_maximum_for_node():
 
     ## because of rebalancing
     no_max = get_maximum_node(tree, node_c, payload_d.__eq__)
-    assert no_max is None
\ No newline at end of file
+    assert no_max is None
+
+def test_bulk_load_integrity():
+    random.seed('test')
+    for count in range(0, 40):
+        nodes = build_random_nodes(count)
+        test_tree = FilterableIntervalTree.from_iterable(nodes)
+        if count:
+            assert_valid_rb_tree(test_tree)
+        assert_valid_filterable_interval_tree(test_tree)
+
+        expected = sorted(_.key.begin for _ in nodes)
+        actual = [_.key.begin for _ in inorder_walk(test_tree.root)]
+        assert expected == actual
+
+
+def test_bulk_load_rejects_unsorted_nodes():
+    nodes = [
+        FilterableIntervalTreeNode(Interval(5, 10), 'a'),
+        FilterableIntervalTreeNode(Interval(1, 3), 'b')
+    ]
+    try:
+        FilterableIntervalTree.from_sorted(nodes)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_bulk_loaded_tree_operations():
+    random.seed('test')
+    nodes = build_random_nodes(500)
+    test_tree = FilterableIntervalTree.from_iterable(nodes)
+
+    for node in build_random_nodes(100):
+        add_node(test_tree, node)
+        nodes.append(node)
+    assert_valid_rb_tree(test_tree)
+    assert_valid_filterable_interval_tree(test_tree)
+
+    random.shuffle(nodes)
+    for node in nodes[:300]:
+        delete_node(test_tree, node)
+    assert_valid_rb_tree(test_tree)
+    assert_valid_filterable_interval_tree(test_tree)
+
+    for node in nodes[300:310]:
+        query = generate_query_node(node.key.begin, node.key.end, node.payload)
+        results = list(query_tree(test_tree, query, True))
+        assert node in results
+
+    payload_node = FilterableIntervalTreeNode(Interval(2000, 2100), {'name': 'chris'})
+    add_node(test_tree, payload_node)
+    adjust_payload(test_tree, payload_node, Interval(2020, 2030), {'state': 'b'})
+    adjusted = [_ for _ in inorder_walk(test_tree.root) if _.key.begin >= 2000]
+    assert [_.key for _ in adjusted] == [Interval(2000, 2020), Interval(2020, 2030), Interval(2030, 2100)]
+    assert_valid_rb_tree(test_tree)
+
+
+def test_query_tree_matches_brute_force():
+    random.seed('test')
+    payloads = [id_generator(15) for _ in range(5)]
+    nodes = []
+    test_tree = FilterableIntervalTree()
+    for _ in range(2000):
+        begin = random.randint(0, 1000)
+        node = FilterableIntervalTreeNode(Interval(begin, begin + random.randint(0, 60)), random.choice(payloads))
+        nodes.append(node)
+        add_node(test_tree, node)
+
+    for _ in range(200):
+        begin = random.randint(-20, 1020)
+        query_interval = Interval(begin, begin + random.randint(0, 40))
+        payload = random.choice(payloads)
+        for must_contain in [True, False]:
+            operation = interval_contains if must_contain else interval_overlaps
+            query = generate_query_node(query_interval.begin, query_interval.end, payload)
+            expected = {_ for _ in nodes if operation(_.key, query_interval) and _.payload == payload}
+            actual = set(query_tree(test_tree, query, must_contain))
+            assert expected == actual
+
+            result = search_interval(test_tree, query_interval)
+            if any(query_interval.overlaps(_.key) for _ in nodes):
+                assert result.key.overlaps(query_interval)
+            else:
+                assert result is test_tree.nil
+
+
+def test_node_memory_footprint():
+    import sys
+
+    class UnslottedNode:
+        pass
+
+    for node, budget in [(FilterableIntervalTreeNode(Interval(0, 10), 'payload', 1), 128),
+                         (GapTrackingIntervalTreeNode(Interval(0, 10), 'payload', 1), 152)]:
+        assert not hasattr(node, '__dict__')
+        for cls in type(node).__mro__[:-1]:
+            assert '__slots__' in cls.__dict__
+
+        # the same attributes held in an instance dict, as nodes were before they declared __slots__
+        baseline = UnslottedNode()
+        for cls in type(node).__mro__[:-1]:
+            for name in cls.__slots__:
+                setattr(baseline, name, getattr(node, name, None))
+        baseline_bytes = sys.getsizeof(baseline) + sys.getsizeof(baseline.__dict__)
+
+        # 64 bit CPython: the object and garbage collector headers, then 8 bytes per slot
+        node_bytes = sys.getsizeof(node)
+        assert node_bytes <= budget
+        assert node_bytes < baseline_bytes / 2
+
+
+def test_rotations_preserve_augmentation():
+    random.seed('test')
+    test_tree = FilterableIntervalTree()
+    insert_nodes(test_tree, build_random_nodes(200))
+    nodes = list(inorder_walk(test_tree.root))
+    for _ in range(500):
+        node = random.choice(nodes)
+        if node.right_child is not test_tree.nil and random.random() < 0.5:
+            left_rotate(test_tree, node)
+        elif node.left_child is not test_tree.nil:
+            right_rotate(test_tree, node)
+        assert test_tree.root.parent is test_tree.nil
+        assert_valid_filterable_interval_tree(test_tree)
+    assert sorted(_.key.begin for _ in nodes) == [_.key.begin for _ in inorder_walk(test_tree.root)]
+
+
+def test_delete_repairs_augmentation():
+    random.seed('test')
+    for shape in ['nested', 'duplicate_begins', 'short']:
+        test_tree = FilterableIntervalTree()
+        nodes = []
+        for i in range(300):
+            if shape == 'nested':
+                begin = random.randint(0, 50)
+                interval = Interval(begin, begin + random.randint(0, 1000))
+            elif shape == 'duplicate_begins':
+                begin = random.randint(0, 10) * 100
+                interval = Interval(begin, begin + random.randint(0, 300))
+            else:
+                begin = random.randint(0, 1000)
+                interval = Interval(begin, begin + random.randint(0, 2))
+            nodes.append(FilterableIntervalTreeNode(interval, 'payload-%d' % random.randrange(20)))
+        insert_nodes(test_tree, nodes)
+
+        random.shuffle(nodes)
+        while nodes:
+            delete_node(test_tree, nodes.pop())
+            if random.random() < 0.2:
+                [node] = build_random_nodes(1)
+                add_node(test_tree, node)
+                nodes.insert(random.randint(0, len(nodes)), node)
+            if nodes:
+                assert_valid_rb_tree(test_tree)
+            assert_valid_filterable_interval_tree(test_tree)
+        assert test_tree.root is test_tree.nil
+
+
+def expected_after_delete_range(entries, window, qualifier=None):
+    results = []
+    for key, payload in entries:
+        if (qualifier is None or qualifier(payload)) and key.overlaps(window):
+            results.extend((_, payload) for _ in key.remove(window))
+        else:
+            results.append((key, payload))
+    return sorted((tuple(key), payload) for key, payload in results)
+
+
+def test_delete_range():
+    random.seed('test')
+    payloads = [id_generator(15) for _ in range(5)]
+    for window_size in [5, 50, 400]:
+        for filtered in [False, True]:
+            test_tree = FilterableIntervalTree()
+            for _ in range(300):
+                begin = random.randint(0, 1000)
+                add_node(test_tree, FilterableIntervalTreeNode(Interval(begin, begin + random.randint(1, 60)),
+                                                               random.choice(payloads)))
+            entries = [(_.key, _.payload) for _ in inorder_walk(test_tree.root)]
+            begin = random.randint(0, 1000)
+            window = Interval(begin, begin + window_size)
+
+            if filtered:
+                target = random.choice(payloads)
+                vector = generate_basic_filter_vector(target)
+                removed = delete_range(test_tree, window, vector, qualifier=lambda x: x == target)
+                expected = expected_after_delete_range(entries, window, lambda x: x == target)
+            else:
+                removed = delete_range(test_tree, window)
+                expected = expected_after_delete_range(entries, window)
+
+            assert_valid_rb_tree(test_tree)
+            assert_valid_filterable_interval_tree(test_tree)
+            actual = sorted((tuple(_.key), _.payload) for _ in inorder_walk(test_tree.root))
+            assert actual == expected
+            assert len(test_tree) == len(expected)
+            for node in removed:
+                assert node.key.begin >= window.begin
+            query = generate_query_node(window.begin, window.end, filter_vector=0)
+            remaining = [_ for _ in query_tree(test_tree, query, must_contain=False)]
+            if not filtered:
+                assert remaining == []
+
+
+def build_device_timeline(device_count, segment_count):
+    """
+    back to back segments per device, neighbouring segments of a device never have equal payloads
+    """
+    segments = []
+    for device in range(device_count):
+        clock = random.randint(0, 20)
+        level = random.randint(0, 3)
+        for _ in range(segment_count):
+            duration = random.randint(1, 30)
+            segments.append((Interval(clock, clock + duration), {'device': device, 'level': level}))
+            clock += duration
+            level = random.choice([_ for _ in range(5) if _ != level])
+    return segments
+
+
+def expected_after_adjust_range(segments, window, adjustments, qualifier):
+    pieces = []
+    for key, payload in segments:
+        new_payload = adjusted_payload(payload, adjustments)
+        if key.overlaps(window) and qualifier(payload) and new_payload != payload:
+            pieces.extend((_, payload) for _ in key.remove(window))
+            pieces.append((Interval(max(key.begin, window.begin), min(key.end, window.end)), new_payload))
+        else:
+            pieces.append((key, payload))
+    pieces.sort(key=lambda piece: (piece[1]['device'], piece[0].begin))
+    merged = []
+    for key, payload in pieces:
+        if merged and merged[-1][1] == payload and merged[-1][0].end == key.begin:
+            merged[-1] = (Interval(merged[-1][0].begin, key.end), payload)
+        else:
+            merged.append((key, payload))
+    return sorted((_.begin, _.end, payload['device'], payload['level']) for _, payload in merged)
+
+
+def test_adjust_range():
+    random.seed('test')
+    for window_size in [10, 40, 300]:
+        for adjustments in [{'level': 1}, {'level': -1}]:
+            for only_device in [None, 1]:
+                segments = build_device_timeline(4, 30)
+                test_tree = FilterableIntervalTree.from_iterable(
+                    FilterableIntervalTreeNode(key, payload) for key, payload in segments)
+                begin = random.randint(0, 400)
+                window = Interval(begin, begin + window_size)
+                qualifier = (lambda x: True) if only_device is None else (lambda x: x['device'] == only_device)
+
+                adjusted = adjust_range(test_tree, window, adjustments,
+                                        qualifier=None if only_device is None else qualifier)
+
+                assert_valid_rb_tree(test_tree)
+                assert_valid_filterable_interval_tree(test_tree)
+                actual = sorted((_.key.begin, _.key.end, _.payload['device'], _.payload['level'])
+                                for _ in inorder_walk(test_tree.root))
+                assert actual == expected_after_adjust_range(segments, window, adjustments, qualifier)
+                assert len(test_tree) == len(actual)
+                for node in adjusted:
+                    assert node.tree is test_tree
+                    assert node.key.overlaps(window)
+                    assert node.filter_vector == generate_basic_filter_vector(str(node.payload))
+
+
+def test_neighbor_search_matches_inorder_scan():
+    random.seed('test')
+    payloads = [{'name': id_generator(8)} for _ in range(40)]
+    nodes = []
+    for _ in range(600):
+        begin = random.randint(0, 1000)
+        nodes.append(FilterableIntervalTreeNode(Interval(begin, begin + random.randint(0, 20)),
+                                                random.choice(payloads)))
+    test_tree = FilterableIntervalTree()
+    insert_nodes(test_tree, nodes)
+    ordered = list(inorder_walk(test_tree.root))
+
+    for index in random.sample(range(len(ordered)), 100):
+        node = ordered[index]
+        expected_predecessor = next((_ for _ in reversed(ordered[:index]) if _.payload == node.payload), None)
+        expected_successor = next((_ for _ in ordered[index + 1:] if _.payload == node.payload), None)
+
+        calls = []
+
+        def qualifier(payload):
+            calls.append(payload)
+            return payload == node.payload
+
+        assert get_predecessor_for_node(test_tree, node) is expected_predecessor
+        assert get_successor_for_node(test_tree, node) is expected_successor
+        assert get_predecessor_for_node(test_tree, node, qualifier, node.filter_vector) is expected_predecessor
+        assert get_successor_for_node(test_tree, node, qualifier, node.filter_vector) is expected_successor
+        # payloads are compared along the search paths, the filter vectors keep the qualifier out of other subtrees
+        assert len(calls) < 40
+
+
+def test_neighbor_search_compares_payloads_on_nodes():
+    test_tree = FilterableIntervalTree()
+    # the root has the same payload as its children but a vector of its own
+    middle = add_node(test_tree, FilterableIntervalTreeNode(Interval(2, 3), 'p', 0))
+    first = add_node(test_tree, FilterableIntervalTreeNode(Interval(0, 1), 'p'))
+    last = add_node(test_tree, FilterableIntervalTreeNode(Interval(4, 5), 'p'))
+    assert test_tree.root is middle
+    assert get_successor_for_node(test_tree, first) is middle
+    assert get_predecessor_for_node(test_tree, last) is middle
+
+
+def test_coalescing_insert():
+    test_tree = FilterableIntervalTree(coalesce=True)
+    first = add_node(test_tree, FilterableIntervalTreeNode(Interval(0, 5), 'a'))
+    assert add_node(test_tree, FilterableIntervalTreeNode(Interval(5, 10), 'a')) is first
+    add_node(test_tree, FilterableIntervalTreeNode(Interval(10, 12), 'b'))
+    add_node(test_tree, FilterableIntervalTreeNode(Interval(15, 20), 'a'))
+    assert len(test_tree) == 3
+
+    # bridges both runs of 'a', starting inside the first one
+    assert add_node(test_tree, FilterableIntervalTreeNode(Interval(8, 15), 'a')) is first
+    assert [(tuple(_.key), _.payload) for _ in inorder_walk(test_tree.root)] == [((0, 20), 'a'), ((10, 12), 'b')]
+
+    # starts before every node it merges with, so it takes their place
+    bridge = FilterableIntervalTreeNode(Interval(-5, 0), 'a')
+    assert add_node(test_tree, bridge) is bridge
+    assert [(tuple(_.key), _.payload) for _ in inorder_walk(test_tree.root)] == [((-5, 20), 'a'), ((10, 12), 'b')]
+    assert len(test_tree) == 2
+    assert_valid_rb_tree(test_tree)
+    assert_valid_filterable_interval_tree(test_tree)
+
+
+def merged_runs(entries):
+    runs = []
+    for key, payload in sorted(entries, key=lambda entry: (entry[1], entry[0].begin)):
+        if runs and runs[-1][1] == payload and runs[-1][0].end >= key.begin:
+            runs[-1] = (Interval(runs[-1][0].begin, max(runs[-1][0].end, key.end)), payload)
+        else:
+            runs.append((key, payload))
+    return sorted((tuple(key), payload) for key, payload in runs)
+
+
+def test_coalescing_tree_matches_merged_runs():
+    random.seed('test')
+    payloads = [id_generator(6) for _ in range(4)]
+    entries = []
+    for _ in range(400):
+        begin = random.randint(0, 2000)
+        entries.append((Interval(begin, begin + random.randint(0, 15)), random.choice(payloads)))
+
+    coalescing_tree = FilterableIntervalTree(coalesce=True)
+    plain_tree = FilterableIntervalTree()
+    for key, payload in entries:
+        add_node(coalescing_tree, FilterableIntervalTreeNode(key, payload))
+        add_node(plain_tree, FilterableIntervalTreeNode(key, payload))
+        assert_valid_filterable_interval_tree(coalescing_tree)
+    assert_valid_rb_tree(coalescing_tree)
+
+    expected = merged_runs(entries)
+    assert sorted((tuple(_.key), _.payload) for _ in inorder_walk(coalescing_tree.root)) == expected
+    assert len(coalescing_tree) == len(expected)
+
+    assert compact(plain_tree) == len(entries) - len(expected)
+    assert_valid_rb_tree(plain_tree)
+    assert_valid_filterable_interval_tree(plain_tree)
+    assert sorted((tuple(_.key), _.payload) for _ in inorder_walk(plain_tree.root)) == expected
+    assert compact(plain_tree) == 0
+
+    nodes = [FilterableIntervalTreeNode(key, payload) for key, payload in entries]
+    loaded_tree = FilterableIntervalTree.from_iterable(nodes, coalesce=True)
+    assert sorted((tuple(_.key), _.payload) for _ in inorder_walk(loaded_tree.root)) == expected
+
+
+def test_count_exists_and_aggregate_queries():
+    random.seed('test')
+    payloads = [{'name': id_generator(6), 'load': random.randint(-5, 20)} for _ in range(8)]
+    test_tree = FilterableIntervalTree()
+    for _ in range(800):
+        begin = random.randint(0, 2000)
+        add_node(test_tree, FilterableIntervalTreeNode(Interval(begin, begin + random.randint(0, 40)),
+                                                       random.choice(payloads)))
+    for node in random.sample(list(inorder_walk(test_tree.root)), 100):
+        delete_node(test_tree, node)
+    assert_valid_filterable_interval_tree(test_tree)
+
+    for _ in range(100):
+        begin = random.randint(-50, 2050)
+        end = begin + random.choice([0, 1, 10, 300, 3000])
+        payload = random.choice([None, random.choice(payloads)])
+        query = generate_query_node(begin, end, payload, filter_vector=None if payload else 0)
+        for must_contain in [True, False]:
+            matches = list(query_tree(test_tree, query, must_contain))
+            assert count_query(test_tree, query, must_contain) == len(matches)
+            assert exists_query(test_tree, query, must_contain) == bool(matches)
+            loads = [_.payload['load'] for _ in matches]
+            assert aggregate_query(test_tree, query, 'load', 'sum', must_contain) == sum(loads)
+            assert aggregate_query(test_tree, query, 'load', 'min', must_contain) == min(loads, default=None)
+            assert aggregate_query(test_tree, query, 'load', 'max', must_contain) == max(loads, default=None)
+
+    whole = generate_query_node(-10, 3000, filter_vector=0)
+    assert count_query(test_tree, whole, False) == test_tree.root.subtree_size == 700
+
+
+def test_order_statistics():
+    random.seed('test')
+    test_tree = FilterableIntervalTree()
+    nodes = build_random_nodes(400)
+    insert_nodes(test_tree, nodes)
+    for node in nodes[:150]:
+        delete_node(test_tree, node)
+    assert len(test_tree) == 250
+
+    ordered = list(inorder_walk(test_tree.root))
+    for index, node in enumerate(ordered):
+        assert rank(test_tree, node) == index
+        assert select(test_tree, index) is node
+    assert select(test_tree, -1) is ordered[-1]
+    for index in [250, -251]:
+        try:
+            select(test_tree, index)
+            assert False
+        except IndexError:
+            pass
+
+    for _ in range(50):
+        begin = random.randint(-10, 1010)
+        end = begin + random.randint(0, 400)
+        offset = random.randint(0, 30)
+        limit = random.choice([None, 0, 1, 10, 100])
+        matching = [_ for _ in ordered if begin <= _.key.begin < end]
+        expected = matching[offset:] if limit is None else matching[offset:offset + limit]
+        assert list(query_begin_range(test_tree, begin, end, offset, limit)) == expected
+
+    assert len(FilterableIntervalTree()) == 0
+    assert list(query_begin_range(FilterableIntervalTree(), 0, 10)) == []
+
+
+def test_ordered_query():
+    random.seed('test')
+    payloads = [id_generator(6) for _ in range(5)]
+    test_tree = FilterableIntervalTree()
+    for _ in range(600):
+        begin = random.randint(0, 1000)
+        add_node(test_tree, FilterableIntervalTreeNode(Interval(begin, begin + random.randint(0, 60)),
+                                                       random.choice(payloads)))
+    ordered = list(inorder_walk(test_tree.root))
+
+    for _ in range(60):
+        begin = random.randint(-10, 1010)
+        end = begin + random.choice([0, 5, 50, 500])
+        payload = random.choice([None, random.choice(payloads)])
+        query = generate_query_node(begin, end, payload, filter_vector=None if payload else 0)
+        limit = random.choice([None, 0, 1, 7, 50])
+        for must_contain in [True, False]:
+            matches = set(map(id, query_tree(test_tree, query, must_contain)))
+            expected = [_ for _ in ordered if id(_) in matches]
+            for descending in [False, True]:
+                in_order = list(reversed(expected)) if descending else expected
+                if limit is not None:
+                    in_order = in_order[:limit]
+                assert list(query_tree_ordered(test_tree, query, must_contain, limit, descending)) == in_order
+
+
+def test_nearest():
+    random.seed('test')
+    payloads = [id_generator(6) for _ in range(6)]
+    test_tree = FilterableIntervalTree()
+    for _ in range(500):
+        begin = random.randint(0, 1000)
+        add_node(test_tree, FilterableIntervalTreeNode(Interval(begin, begin + random.randint(0, 30)),
+                                                       random.choice(payloads)))
+    ordered = list(inorder_walk(test_tree.root))
+
+    for _ in range(100):
+        point = random.randint(-20, 1020)
+        k = random.choice([0, 1, 3, 20])
+        payload = random.choice([None, random.choice(payloads)])
+        vector = generate_basic_filter_vector(payload) if payload else None
+        qualifier = (lambda x: x == payload) if payload else None
+
+        before = [_ for _ in reversed(ordered) if _.key.begin <= point and (payload is None or _.payload == payload)]
+        after = [_ for _ in ordered if _.key.begin >= point and (payload is None or _.payload == payload)]
+        assert nearest(test_tree, point, 'before', vector, qualifier, k) == before[:k]
+        assert nearest(test_tree, point, 'after', vector, qualifier, k) == after[:k]
+
+        # with only a vector, every node whose filter vector includes it matches
+        if vector:
+            before = [_ for _ in reversed(ordered) if _.key.begin <= point and _.filter_vector & vector == vector]
+            after = [_ for _ in ordered if _.key.begin >= point and _.filter_vector & vector == vector]
+            assert nearest(test_tree, point, 'before', vector, None, k) == before[:k]
+            assert nearest(test_tree, point, 'after', vector, None, k) == after[:k]
+
+    try:
+        nearest(test_tree, 0, 'sideways')
+        assert False
+    except ValueError:
+        pass
+
+
+def test_join_overlapping_matches_pairwise_queries():
+    random.seed('test')
+    payloads = [id_generator(6) for _ in range(4)]
+
+    def build(count, spread, longest):
+        nodes = []
+        for _ in range(count):
+            begin = random.randint(0, spread)
+            nodes.append(FilterableIntervalTreeNode(Interval(begin, begin + random.randint(0, longest)),
+                                                    random.choice(payloads)))
+        return nodes
+
+    for count_a, count_b, spread, longest in [(200, 200, 1000, 20), (300, 30, 2000, 5), (40, 300, 500, 200),
+                                              (100, 100, 30, 3), (0, 50, 100, 10)]:
+        nodes_a = build(count_a, spread, longest)
+        nodes_b = build(count_b, spread, longest)
+        tree_a = FilterableIntervalTree()
+        tree_b = FilterableIntervalTree()
+        insert_nodes(tree_a, nodes_a)
+        insert_nodes(tree_b, nodes_b)
+
+        for must_contain in [False, True]:
+            for payload in [None, payloads[0]]:
+                vector = generate_basic_filter_vector(payload) if payload else None
+                expected = set()
+                for node_a in nodes_a:
+                    if vector and node_a.filter_vector & vector != vector:
+                        continue
+                    query = generate_query_node(node_a.key.begin, node_a.key.end, filter_vector=vector or 0)
+                    expected.update((id(node_a), id(_)) for _ in query_tree(tree_b, query, must_contain))
+                pairs = list(join_overlapping(tree_a, tree_b, must_contain, vector))
+                assert len(pairs) == len(set(map(lambda _: (id(_[0]), id(_[1])), pairs)))
+                assert set((id(a), id(b)) for a, b in pairs) == expected
+
+
+def covered_cells(intervals):
+    return set(cell for key in intervals for cell in range(key.begin, key.end))
+
+
+def assert_disjoint_runs(runs):
+    for previous, run in zip(runs, runs[1:]):
+        assert previous.end < run.begin
+    for run in runs:
+        assert run.begin < run.end
+
+
+def test_coverage_operations():
+    random.seed('test')
+    payloads = [id_generator(6) for _ in range(3)]
+
+    def build(count, spread, longest):
+        nodes = []
+        for _ in range(count):
+            begin = random.randint(0, spread)
+            nodes.append(FilterableIntervalTreeNode(Interval(begin, begin + random.randint(0, longest)),
+                                                    random.choice(payloads)))
+        return nodes
+
+    for count_a, count_b, spread, longest in [(50, 50, 500, 20), (200, 20, 300, 3), (10, 200, 1000, 100),
+                                              (0, 30, 100, 10), (30, 0, 100, 10)]:
+        nodes_a = build(count_a, spread, longest)
+        nodes_b = build(count_b, spread, longest)
+        tree_a = FilterableIntervalTree.from_iterable(nodes_a)
+        tree_b = FilterableIntervalTree.from_iterable(nodes_b)
+
+        for vector_a, vector_b in [(None, None), (generate_basic_filter_vector(payloads[0]), None),
+                                   (None, generate_basic_filter_vector(payloads[1]))]:
+            cells_a = covered_cells(_.key for _ in nodes_a if not vector_a or _.filter_vector == vector_a)
+            cells_b = covered_cells(_.key for _ in nodes_b if not vector_b or _.filter_vector == vector_b)
+
+            runs = list(coverage_runs(tree_a, vector_a))
+            assert_disjoint_runs(runs)
+            assert covered_cells(runs) == cells_a
+
+            for operation, expected in [(coverage_union, cells_a | cells_b),
+                                        (coverage_intersection, cells_a & cells_b),
+                                        (coverage_difference, cells_a - cells_b)]:
+                runs = list(operation(tree_a, tree_b, vector_a, vector_b))
+                assert_disjoint_runs(runs)
+                assert covered_cells(runs) == expected
+
+    runs = list(coverage_difference(tree_a, tree_b))
+    tree = tree_from_runs(runs, payloads[2])
+    assert_valid_filterable_interval_tree(tree)
+    assert [select(tree, i).key for i in range(len(tree))] == runs
+
+
+def expected_gaps(keys, length, window):
+    """
+    brute force over a grid of half units: a key covers every point from twice its begin to twice its end, and a gap
+    is a run of uncovered points between two covered ones or the bounds of the window
+    """
+    if window is None:
+        if not keys:
+            return []
+        low, high = min(_.begin for _ in keys), max(_.end for _ in keys)
+    else:
+        low, high = window.begin, window.end
+    covered = bytearray(2 * (high - low) + 1)
+    covered[0] = covered[-1] = 1
+    for key in keys:
+        for point in range(max(2 * (key.begin - low), 0), min(2 * (key.end - low), len(covered) - 1) + 1):
+            covered[point] = 1
+
+    gaps = []
+    start = None
+    for point, is_covered in enumerate(covered):
+        if not is_covered and start is None:
+            start = point
+        elif is_covered and start is not None:
+            # the covered points around the run are at even offsets, on whole units
+            gap = Interval(low + (start - 1) // 2, low + point // 2)
+            if gap.end - gap.begin >= length:
+                gaps.append(gap)
+            start = None
+    return gaps
+
+
+def test_find_gaps():
+    random.seed('test')
+    resources = [id_generator(6) for _ in range(4)]
+    for track_gaps in [True, False]:
+        tree = FilterableIntervalTree(track_gaps=track_gaps)
+        nodes = []
+        for _ in range(600):
+            begin = random.randint(0, 20000)
+            node = tree.create_node(Interval(begin, begin + random.choice([0, 5, 20, 60, 300])),
+                                    random.choice(resources))
+            nodes.append(node)
+            add_node(tree, node)
+        assert_valid_filterable_interval_tree(tree)
+
+        for removed in random.sample(nodes, 200):
+            delete_node(tree, removed)
+            nodes.remove(removed)
+        assert_valid_filterable_interval_tree(tree)
+
+        windows = [None, Interval(-100, 500), Interval(5000, 9000), Interval(19900, 21000), Interval(30000, 30100)]
+        for resource in [None] + resources:
+            vector = generate_basic_filter_vector(resource) if resource else None
+            keys = [_.key for _ in nodes if not vector or vector & _.filter_vector == vector]
+            for window in windows:
+                all_gaps = expected_gaps(keys, 0, window)
+                for length in [0, 1, 50, 200, 1000]:
+                    expected = [_ for _ in all_gaps if _.end - _.begin >= length]
+                    assert list(find_gaps(tree, length, window, vector)) == expected
+                    assert first_gap(tree, length, window, vector) == (expected[0] if expected else None)
+
+    bulk_tree = FilterableIntervalTree.from_iterable([GapTrackingIntervalTreeNode(_.key, _.payload) for _ in nodes],
+                                                     track_gaps=True)
+    assert_valid_filterable_interval_tree(bulk_tree)
+    assert list(find_gaps(bulk_tree, 10)) == expected_gaps([_.key for _ in nodes], 10, None)
+
+    assert list(find_gaps(FilterableIntervalTree(), 0, Interval(0, 10))) == [Interval(0, 10)]
+    assert first_gap(FilterableIntervalTree(), 0) is None
+
+
+def test_gap_aggregates_live_on_gap_tracking_nodes():
+    assert not hasattr(FilterableIntervalTree().create_node(Interval(0, 1)), 'subtree_largest_gap')
+    tree = FilterableIntervalTree(track_gaps=True)
+    assert isinstance(tree.create_node(Interval(0, 1)), GapTrackingIntervalTreeNode)
+    for add in [lambda: add_node(tree, FilterableIntervalTreeNode(Interval(0, 1), 'a')),
+                lambda: FilterableIntervalTree.from_sorted([FilterableIntervalTreeNode(Interval(0, 1), 'a')],
+                                                           track_gaps=True)]:
+        try:
+            add()
+            assert False
+        except TypeError:
+            pass
+    assert len(tree) == 0
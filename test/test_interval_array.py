@@ -0,0 +1,93 @@
+from intervaltree.interval import Interval, interval_overlaps, interval_contains
+from intervaltree.interval_array import IntervalArray
+from intervaltree.i_tree_funcs import FilterableIntervalTree, generate_query_node, query_tree
+from .test_filterable_interval_tree import assert_valid_filterable_interval_tree
+from .test_rb_tree import assert_valid_rb_tree
+import random
+
+
+def build_random_intervals(count):
+    intervals = []
+    for _ in range(count):
+        begin = random.randint(0, 40)
+        intervals.append(Interval(begin, begin + random.randint(0, 8)))
+    return intervals
+
+
+def test_conversion():
+    random.seed('test')
+    intervals = build_random_intervals(50)
+    array = IntervalArray.from_intervals(intervals)
+    assert len(array) == 50
+    assert array.to_intervals() == intervals
+    assert list(array) == intervals
+    assert array[3] == intervals[3]
+    assert array[2:5].to_intervals() == intervals[2:5]
+    assert IntervalArray.from_intervals([]).to_intervals() == []
+
+
+def test_predicates_match_interval():
+    random.seed('test')
+    left = build_random_intervals(500)
+    right = build_random_intervals(500)
+    left_array = IntervalArray.from_intervals(left)
+    right_array = IntervalArray.from_intervals(right)
+
+    assert left_array.overlaps(right_array).tolist() == [interval_overlaps(a, b) for a, b in zip(left, right)]
+    assert left_array.contains(right_array).tolist() == [interval_contains(a, b) for a, b in zip(left, right)]
+    assert left_array.touches(right_array).tolist() == [a.touches(b) for a, b in zip(left, right)]
+
+    for other in right[:20]:
+        assert left_array.overlaps(other).tolist() == [interval_overlaps(a, other) for a in left]
+        assert left_array.contains(other).tolist() == [interval_contains(a, other) for a in left]
+        assert left_array.touches(other).tolist() == [a.touches(other) for a in left]
+
+
+def test_remove_matches_interval():
+    random.seed('test')
+    left = build_random_intervals(500)
+    right = build_random_intervals(500)
+    fragments, rows = IntervalArray.from_intervals(left).remove(IntervalArray.from_intervals(right), True)
+
+    expected = []
+    expected_rows = []
+    for row, (a, b) in enumerate(zip(left, right)):
+        pieces = a.remove(b)
+        expected.extend(pieces)
+        expected_rows.extend([row] * len(pieces))
+    assert fragments.to_intervals() == expected
+    assert rows.tolist() == expected_rows
+
+    window = Interval(10, 20)
+    assert IntervalArray.from_intervals(left).remove(window).to_intervals() == \
+        [piece for a in left for piece in a.remove(window)]
+
+
+def test_sort_and_merge():
+    random.seed('test')
+    intervals = build_random_intervals(300)
+    array = IntervalArray.from_intervals(intervals)
+    assert array.sorted().to_intervals() == sorted(intervals)
+
+    for touching in [True, False]:
+        runs = []
+        for interval in sorted(intervals):
+            if runs and (interval.begin < runs[-1].end or touching and interval.begin == runs[-1].end):
+                runs[-1] = Interval(runs[-1].begin, max(runs[-1].end, interval.end))
+            else:
+                runs.append(interval)
+        assert array.merge(touching).to_intervals() == runs
+
+
+def test_to_nodes_bulk_loads():
+    random.seed('test')
+    intervals = build_random_intervals(200)
+    payloads = ['payload-%d' % random.randrange(10) for _ in intervals]
+    tree = FilterableIntervalTree.from_sorted(IntervalArray.from_intervals(intervals).to_nodes(payloads))
+    assert_valid_rb_tree(tree)
+    assert_valid_filterable_interval_tree(tree)
+    assert len(tree) == len(intervals)
+
+    for interval, payload in zip(intervals, payloads):
+        query = generate_query_node(interval.begin, interval.end, payload)
+        assert any(_.key == interval for _ in query_tree(tree, query))
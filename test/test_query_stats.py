@@ -0,0 +1,75 @@
+from intervaltree.i_tree_funcs import *
+from intervaltree.query_stats import QueryStats, query_stats_aggregator
+from .test_filterable_interval_tree import build_random_nodes
+import random
+
+
+def build_tree():
+    random.seed('test')
+    nodes = build_random_nodes(1000)
+    return FilterableIntervalTree.from_iterable(nodes), nodes
+
+
+def test_stats_do_not_change_results():
+    tree, nodes = build_tree()
+    for node in nodes[:50]:
+        for must_contain in [True, False]:
+            query = generate_query_node(node.key.begin, node.key.end, node.payload)
+            stats = QueryStats()
+            expected = list(query_tree(tree, query, must_contain))
+            actual = list(query_tree(tree, query, must_contain, stats))
+            assert expected == actual
+            assert stats.results == len(actual)
+            assert stats.nodes_visited >= stats.results
+            assert stats.wall_time > 0
+
+
+def test_stats_counters():
+    tree, nodes = build_tree()
+    query = generate_query_node(100, 200, filter_vector=0)
+    stats = QueryStats()
+    results = list(query_tree(tree, query, False, stats))
+    assert stats.pruned_by_filter == 0
+    assert stats.pruned_by_maximum + stats.pruned_by_begin > 0
+    assert stats.results == len(results)
+
+    query = generate_query_node(100, 200, nodes[0].payload)
+    stats = QueryStats()
+    list(query_tree(tree, query, False, stats))
+    assert stats.pruned_by_filter > 0
+
+    class AlwaysNo:
+        filter_vector = 0
+
+        def qualifies(self, other):
+            return False
+
+    stats = QueryStats()
+    assert not list(query_tree(tree, generate_query_node(100, 200, AlwaysNo()), False, stats))
+    assert stats.rejected_by_qualifier > 0
+    assert 'rejected by qualifies' in stats.explain()
+
+
+def test_aggregator():
+    tree, nodes = build_tree()
+    query_stats_aggregator.reset()
+    query = generate_query_node(100, 200, filter_vector=0)
+
+    list(query_tree(tree, query, False))
+    assert query_stats_aggregator.snapshot()['queries'] == 0
+
+    query_stats_aggregator.enabled = True
+    try:
+        first = list(query_tree(tree, query, False))
+        results = query_tree(tree, query, False)
+        next(results)
+        results.close()
+    finally:
+        query_stats_aggregator.enabled = False
+
+    snapshot = query_stats_aggregator.snapshot()
+    assert snapshot['queries'] == 2
+    assert snapshot['results'] == len(first) + 1
+    assert snapshot['nodes_visited'] > 0
+    query_stats_aggregator.reset()
+    assert query_stats_aggregator.snapshot()['queries'] == 0
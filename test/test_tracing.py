@@ -0,0 +1,221 @@
+from intervaltree import i_tree_funcs
+from intervaltree.i_tree_funcs import FilterableIntervalTree, FilterableIntervalTreeNode, Interval, \
+    generate_query_node
+from intervaltree.tracing import TraceRecorder, TraceReplayer, ObjectTreeAdapter, ArrayTreeAdapter, read_trace, \
+    percentile
+from decimal import Decimal
+from collections import Counter
+import io
+import math
+import random
+
+PATCHED = ['add_node', 'insert_node', 'add_node_coalescing', 'delete_node', 'query_tree', 'adjust_payload',
+           'delete_range', 'adjust_range', 'compact']
+
+
+def run_workload(tree: FilterableIntervalTree, operation_count: int):
+    """
+    a mix of additions, queries, adjustments and deletions, going through the i_tree_funcs module
+    """
+    for _ in range(operation_count):
+        choice = random.random()
+        if choice < 0.4 or not len(tree):
+            begin = random.randint(0, 10000)
+            payload = {'device': random.randrange(5), 'state': 'idle'}
+            i_tree_funcs.add_node(tree, FilterableIntervalTreeNode(Interval(begin, begin + random.randint(5, 50)),
+                                                                   payload))
+        elif choice < 0.7:
+            begin = random.randint(0, 10000)
+            payload = {'device': random.randrange(5), 'state': 'idle'} if random.random() < 0.5 else None
+            query_node = generate_query_node(begin, begin + 100, payload)
+            list(i_tree_funcs.query_tree(tree, query_node, random.random() < 0.5))
+        elif choice < 0.85:
+            node = i_tree_funcs.select(tree, random.randrange(len(tree)))
+            key = node.key
+            if key.end - key.begin >= 3:
+                i_tree_funcs.adjust_payload(tree, node, Interval(key.begin + 1, key.end - 1), {'state': 'busy'})
+        else:
+            i_tree_funcs.delete_node(tree, i_tree_funcs.select(tree, random.randrange(len(tree))))
+
+
+def run_range_workload(tree: FilterableIntervalTree, operation_count: int) -> Counter:
+    """
+    a mix of every recorded operation, along with calls that use them internally
+    :return: the number of calls made to each recorded operation
+    """
+    calls = Counter()
+    for _ in range(operation_count):
+        choice = random.random()
+        begin = random.randint(0, 2000)
+        window = Interval(begin, begin + random.randint(1, 100))
+        qualifier = None if random.random() < 0.5 else (lambda payload: payload['device'] != 0)
+        if choice < 0.45 or not len(tree):
+            payload = {'device': random.randrange(3), 'state': random.choice(['idle', 'busy'])}
+            name = random.choice(['add_node', 'insert_node', 'add_node_coalescing'])
+            getattr(i_tree_funcs, name)(tree, FilterableIntervalTreeNode(Interval(begin, begin + random.randint(5, 50)),
+                                                                         payload))
+            calls[name] += 1
+        elif choice < 0.6:
+            filter_vector = None
+            if random.random() < 0.3:
+                filter_vector = tree.filter_config.vector_for_payload({'device': 1, 'state': 'idle'})
+            i_tree_funcs.delete_range(tree, window, filter_vector, qualifier)
+            calls['delete_range'] += 1
+        elif choice < 0.8:
+            i_tree_funcs.adjust_range(tree, window, {'state': random.choice(['idle', 'busy'])}, None, qualifier)
+            calls['adjust_range'] += 1
+        elif choice < 0.85:
+            i_tree_funcs.compact(tree)
+            calls['compact'] += 1
+        elif choice < 0.9:
+            node = i_tree_funcs.select(tree, random.randrange(len(tree)))
+            i_tree_funcs.delete_node(tree, node)
+            calls['delete_node'] += 1
+        else:
+            # exists_query goes through query_tree, which is recorded only when called directly
+            i_tree_funcs.exists_query(tree, generate_query_node(window.begin, window.end), False)
+            list(i_tree_funcs.query_tree(tree, generate_query_node(window.begin, window.end), False))
+            calls['query_tree'] += 1
+    return calls
+
+
+def contents(pairs):
+    return sorted((tuple(key), sorted(payload.items())) for key, payload in pairs)
+
+
+def test_record_and_replay():
+    random.seed('test')
+    originals = [getattr(i_tree_funcs, _) for _ in PATCHED]
+
+    tree = FilterableIntervalTree()
+    # nodes added before recording starts reach the trace through the snapshot of the tree
+    run_workload(tree, 50)
+
+    stream = io.BytesIO()
+    with TraceRecorder(stream):
+        run_workload(tree, 400)
+    assert [getattr(i_tree_funcs, _) for _ in PATCHED] == originals
+
+    stream.seek(0)
+    records = list(read_trace(stream))
+    operations = [_.operation for _ in records]
+    assert operations[0] == 'tree'
+    assert operations.count('tree') == 1
+    # the deletions and insertions adjust_payload makes are not recorded on their own
+    assert 350 < len(records) <= 401
+    assert all(a.time <= b.time for a, b in zip(records[1:], records[2:]))
+
+    stream.seek(0)
+    replayer = TraceReplayer()
+    report = replayer.replay(stream)
+    assert contents(ObjectTreeAdapter().contents(replayer.trees[1])) == \
+        contents((_.key, _.payload) for _ in i_tree_funcs._inorder_nodes(tree))
+    for operation in ['add_node', 'query_tree', 'adjust_payload', 'delete_node']:
+        assert report[operation]['count'] == operations.count(operation)
+        assert report[operation]['unresolved'] == 0
+        assert report[operation]['p50_us'] <= report[operation]['p99_us'] <= report[operation]['max_us']
+
+    stream.seek(0)
+    replayer = TraceReplayer(ArrayTreeAdapter())
+    report = replayer.replay(stream)
+    assert len(replayer.trees[1]) == len(tree)
+    assert report['delete_node']['unresolved'] == 0
+
+
+def test_range_operations_replay():
+    for coalesce in [False, True]:
+        random.seed('test')
+        tree = FilterableIntervalTree(coalesce=coalesce)
+        run_range_workload(tree, 50)
+
+        stream = io.BytesIO()
+        with TraceRecorder(stream):
+            calls = run_range_workload(tree, 600)
+
+        stream.seek(0)
+        records = list(read_trace(stream))
+        # every call is recorded once, and none of the calls the library makes to itself
+        assert Counter(_.operation for _ in records[1:]) == calls
+        assert all(calls[_] for _ in PATCHED if _ not in ['query_tree', 'adjust_payload'])
+        assert any(_.arguments[-1] is not None for _ in records if _.operation == 'delete_range')
+        assert any(_.arguments[1] for _ in records if _.operation == 'delete_range')
+
+        stream.seek(0)
+        replayer = TraceReplayer()
+        report = replayer.replay(stream)
+        assert contents(ObjectTreeAdapter().contents(replayer.trees[1])) == \
+            contents((_.key, _.payload) for _ in i_tree_funcs._inorder_nodes(tree))
+        assert sum(_['unresolved'] + _['unsupported'] for _ in report.values()) == 0
+
+        stream.seek(0)
+        replayer = TraceReplayer(ArrayTreeAdapter())
+        report = replayer.replay(stream)
+        assert report['delete_range']['unsupported'] == calls['delete_range']
+        assert report['compact']['count'] == 0
+
+
+def test_hashed_payloads():
+    random.seed('test')
+    tree = FilterableIntervalTree()
+    stream = io.BytesIO()
+    with TraceRecorder(stream, hash_payloads=True):
+        run_workload(tree, 300)
+    assert b'device' not in stream.getvalue()
+    assert b'busy' not in stream.getvalue()
+
+    stream.seek(0)
+    replayer = TraceReplayer()
+    report = replayer.replay(stream)
+    assert len(replayer.trees[1]) == len(tree)
+    assert sum(_['unresolved'] for _ in report.values()) == 0
+
+
+def test_bounds_round_trip():
+    tree = FilterableIntervalTree()
+    stream = io.BytesIO()
+    keys = [Interval(2 ** 53 + 1, 2 ** 62 + 3), Interval(-2 ** 63, 0), Interval(0.5, 2.0), Interval(-math.inf, 1)]
+    with TraceRecorder(stream):
+        for key in keys:
+            i_tree_funcs.add_node(tree, FilterableIntervalTreeNode(key, 'a'))
+        for key in [Interval(0, 2 ** 63), Interval(Decimal(1), 2)]:
+            try:
+                i_tree_funcs.add_node(tree, FilterableIntervalTreeNode(key, 'a'))
+                assert False
+            except ValueError:
+                pass
+    assert len(tree) == len(keys)
+
+    stream.seek(0)
+    replayed = [_.arguments[0] for _ in read_trace(stream) if _.operation == 'add_node']
+    assert replayed == keys
+    assert [type(_.begin) for _ in replayed] == [int, int, float, float]
+
+
+def test_payloads_round_trip():
+    tree = FilterableIntervalTree()
+    stream = io.BytesIO()
+    payloads = ['a', 5, 5.0, -2.5, True, (1, 'a'), [1, (2, 3)], {'a': 1, 2: [True], (3, 4): {'b': None}},
+                {'when': 1.5, 'ok': False}]
+    with TraceRecorder(stream):
+        for begin, payload in enumerate(payloads):
+            i_tree_funcs.add_node(tree, FilterableIntervalTreeNode(Interval(begin, begin + 1), payload))
+        for payload in [{'a': {1, 2}}, Decimal(1), [object()]]:
+            try:
+                i_tree_funcs.add_node(tree, FilterableIntervalTreeNode(Interval(0, 1), payload))
+                assert False
+            except ValueError:
+                pass
+
+    stream.seek(0)
+    replayed = [_.arguments[1] for _ in read_trace(stream) if _.operation == 'add_node']
+    assert replayed == payloads
+    assert [repr(_) for _ in replayed] == [repr(_) for _ in payloads]
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile(values, 1) == 100
+    assert percentile([7], 0.5) == 7
+    assert percentile([], 0.5) == 0.0